@@ -28,6 +28,8 @@ def start_backend():
     
     # 设置环境变量
     os.environ['FLASK_ENV'] = 'production'
+    # 会话持久化到用户目录，应用崩溃或重启后可继续游戏
+    os.environ.setdefault('TZ_SESSION_DB', str(Path.home() / '.tz_war_robot' / 'sessions.db'))
     
     # 导入并运行 Flask app
     backend_path = get_resource_path('backend')
@@ -37,8 +39,13 @@ def start_backend():
     try:
         from backend.app import app
         
-        # 在后台线程中运行 Flask
+        # 在后台线程中运行 Flask（TZ_WORKERS > 1 时为多进程模式）
+        workers = int(os.environ.get('TZ_WORKERS', '1'))
         def run_flask():
+            if workers > 1:
+                from cluster import serve_cluster
+                serve_cluster(host='127.0.0.1', port=5001, workers=workers)
+                return
             app.run(
                 host='127.0.0.1',
                 port=5001,
@@ -146,4 +153,7 @@ def main():
 
 
 if __name__ == '__main__':
+    # 打包后的应用以 spawn 方式启动 worker 进程时需要
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
@@ -42,8 +42,25 @@ if __name__ == '__main__':
     print("\nAvailable API endpoints:")
     print("  POST /api/tz/start    - 开始游戏")
     print("  POST /api/tz/message  - 发送消息")
+    print("  POST /api/tz/message/stream - 发送消息（SSE 流式响应）")
     print("  GET  /api/tz/state    - 获取状态")
     print("  POST /api/tz/reset    - 重置游戏")
+    print("  GET  /api/tz/history  - 回合历史")
+    print("  POST /api/tz/rewind   - 回退到指定回合")
+    print("  POST /api/tz/fork     - 创建会话分支")
+    print("  GET  /api/tz/metrics  - 服务指标")
     print("  GET  /health          - 健康检查")
     print("=" * 50)
-    app.run(host='0.0.0.0', port=5001)
+    workers = int(os.environ.get('TZ_WORKERS', '1'))
+    if os.environ.get('TZ_ASYNC', '0').lower() in ('1', 'true', 'yes'):
+        # 异步模式：LLM 等待不占线程（message/stream、history / rewind / fork 只在线程服务中提供）
+        from async_app import serve_async
+        serve_async(host='0.0.0.0', port=5001)
+    elif workers > 1:
+        # 多进程模式：当前进程只做路由，游戏逻辑运行在 worker 进程中
+        from cluster import serve_cluster
+        serve_cluster(host='0.0.0.0', port=5001, workers=workers)
+    else:
+        from tz_routes import warm_up_llm
+        warm_up_llm()
+        app.run(host='0.0.0.0', port=5001)
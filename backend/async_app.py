@@ -0,0 +1,354 @@
+"""
+TZ游戏异步服务（aiohttp）
+游戏接口的 asyncio 版本：回合逻辑照常同步执行，其中的 LLM 调用通过回合计划（turn_plan.py）
+推迟到逻辑结束后并发发出，等待期间不占用线程，单个进程可以同时挂起数百个回合。
+
+- 会话、回合日志、状态令牌与线程服务（tz_routes.py）共用同一套实现
+- 同一会话的回合仍按到达顺序串行执行（AsyncTurnLocks）
+- /message/stream（SSE）、history / rewind / fork 以及多进程部署仍由线程服务提供，
+  异步服务对这几个接口返回 501
+
+用法：
+    TZ_ASYNC=1 python app.py
+"""
+
+import os
+import traceback
+
+from aiohttp import web
+
+from game_logic import GameState
+from llm_client import AsyncLLMClient
+from session_locks import AsyncTurnLocks
+from single_flight import AsyncSingleFlight
+from state_token import StateTokenError
+from tz_routes import (
+    SESSION_COOKIE, STATELESS, WORKER_ID, tz_sessions, tz_tokens, tz_turn_log,
+    tz_replies, tz_batcher, tz_speculator, _adjust_response_delays, _state_fields, call_llm_api_async,
+    claim_prefetched, llm_backpressure, llm_breakers, llm_hedger, llm_keys, llm_limits, llm_router,
+    llm_settings, new_turn_plan, plan_turn, speculate_next_turn
+)
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "dist")
+
+tz_async_turns = AsyncTurnLocks()
+tz_async_flights = AsyncSingleFlight()
+
+
+def _error(message, status=500, **extra):
+    return web.json_response({"success": False, "error": message, **extra}, status=status)
+
+
+def _session_not_found():
+    return _error("Session not found or expired. Please start a new game.", 404, sessionExpired=True)
+
+
+def _get_session_id(request, data=None):
+    """优先级与线程服务一致：请求头 X-TZ-Session > JSON sessionId > 查询参数 > Cookie"""
+    session_id = request.headers.get("X-TZ-Session")
+    if not session_id and isinstance(data, dict):
+        session_id = data.get("sessionId")
+    if not session_id:
+        session_id = request.query.get("sessionId")
+    if not session_id:
+        session_id = request.cookies.get(SESSION_COOKIE)
+    return session_id
+
+
+def _load_token_state(request, data=None):
+    """校验状态令牌，返回 (GameState, None) 或 (None, 错误响应)"""
+    token = request.headers.get("X-TZ-State")
+    if not token and isinstance(data, dict):
+        token = data.get("stateToken")
+    if not token:
+        token = request.query.get("stateToken")
+    try:
+        return tz_tokens.load(token), None
+    except StateTokenError as e:
+        return None, _error(str(e), 401, sessionExpired=True)
+
+
+async def _read_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def run_turn_async(client, state, data, message, session_id=None):
+    """run_turn 的异步版本：先执行回合逻辑，再并发完成其中的 LLM 调用"""
+    api_key, api_url, model = llm_settings(data)
+    prefetched = claim_prefetched(session_id, data)
+    plan = new_turn_plan(api_key, api_url, model, prefetched)
+
+    async def send(messages, max_tokens, stop, route=None):
+        with llm_router.measure(route):
+            return await call_llm_api_async(client, messages, api_key, api_url, route and route.model or model,
+                                            max_tokens, stop, flights=tz_async_flights)
+
+    try:
+        response = plan_turn(state, data, message, plan.llm_function)
+        await plan.resolve(send)
+    finally:
+        if prefetched is not None:
+            prefetched.close()
+    plan.fill_state(state)
+    # 预生成在后台线程池中进行（同步连接池），不占用事件循环
+    speculate_next_turn(session_id, state, data)
+    return _adjust_response_delays(plan.fill(response))
+
+
+async def tz_start_game(request):
+    """开始TZ游戏"""
+    try:
+        data = await _read_json(request)
+        if STATELESS:
+            session_id, state = None, GameState()
+            state.stage = "first_contact"
+        else:
+            old_session_id = _get_session_id(request, data)
+            if old_session_id:
+                tz_sessions.discard(old_session_id)
+                tz_speculator.discard(old_session_id)
+            session_id, state = tz_sessions.create()
+            state.stage = "first_contact"
+            tz_sessions.mark_dirty(session_id, state)
+            tz_turn_log.start(session_id, state)
+
+        from stage_handlers import CONNECTION_SEQUENCE
+        initial_messages = list(CONNECTION_SEQUENCE)
+        initial_messages.append({
+            "type": "npc",
+            "content": "...Can you...hear me?\n\nIf you can hear me, please respond.\n\nMy systems...severely damaged.\nNeed...assistance.",
+            "delay": 1500
+        })
+
+        payload = {
+            "success": True,
+            "messages": initial_messages,
+            "state": state.to_dict(),
+            "stateVersion": state.version
+        }
+        if STATELESS:
+            payload["stateToken"] = tz_tokens.issue(state)
+            return web.json_response(payload)
+
+        payload["sessionId"] = session_id
+        resp = web.json_response(payload)
+        resp.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="Lax")
+        return resp
+    except Exception as e:
+        print(f"Start game error: {e}")
+        return _error("Start game error")
+
+
+async def tz_send_message(request):
+    """Send TZ Game Message"""
+    try:
+        data = await _read_json(request)
+        if STATELESS:
+            session_id = None
+            state, error = _load_token_state(request, data)
+            if error:
+                return error
+        else:
+            session_id = _get_session_id(request, data)
+            state = tz_sessions.get(session_id)
+            if state is None:
+                return _session_not_found()
+
+        message = str(data.get('message', '')).strip()
+        if not message:
+            return _error("Message cannot be empty", 400)
+
+        retry_after = llm_backpressure(data)
+        if retry_after is not None:
+            return web.json_response({
+                "success": False,
+                "error": "LLM provider is busy, please retry later",
+                "retryAfter": retry_after
+            }, status=503, headers={"Retry-After": str(retry_after)})
+
+        client = request.app["llm_client"]
+        if STATELESS:
+            response = await run_turn_async(client, state, data, message)
+            state.turn += 1
+            return web.json_response({
+                "success": True,
+                "response": response,
+                **_state_fields(state, data.get('stateVersion')),
+                "stateToken": tz_tokens.issue(state)
+            })
+
+        async with tz_async_turns.turn(session_id):
+            # 排队期间会话可能被回退、休眠后恢复或删除，以锁内取到的状态对象为准
+            state = tz_sessions.get(session_id)
+            if state is None:
+                return _session_not_found()
+            mark = tz_turn_log.begin(state)
+            response = await run_turn_async(client, state, data, message, session_id)
+            tz_turn_log.commit(session_id, state, message, mark)
+            state_fields = _state_fields(state, data.get('stateVersion'))
+            tz_sessions.mark_dirty(session_id, state)
+
+        return web.json_response({
+            "success": True,
+            "response": response,
+            **state_fields
+        })
+    except Exception as e:
+        print(f"Send message error: {e}")
+        traceback.print_exc()
+        return _error(str(e))
+
+
+async def tz_get_state(request):
+    """Get TZ game state"""
+    try:
+        since_version = request.query.get('stateVersion')
+        since_version = int(since_version) if since_version and since_version.isdigit() else None
+        if STATELESS:
+            state, error = _load_token_state(request)
+            if error:
+                return error
+            return web.json_response({"success": True, **_state_fields(state, since_version)})
+
+        session_id = _get_session_id(request)
+        state = tz_sessions.get(session_id)
+        if state is None:
+            return _session_not_found()
+        # 回合进行中状态里还留着 LLM 占位文本，等回合结束再读
+        async with tz_async_turns.turn(session_id):
+            state = tz_sessions.get(session_id)
+            if state is None:
+                return _session_not_found()
+            fields = _state_fields(state, since_version)
+        return web.json_response({"success": True, **fields})
+    except Exception as e:
+        print(f"Get state error: {e}")
+        return _error(str(e))
+
+
+async def tz_reset_game(request):
+    """Reset TZ game"""
+    try:
+        data = await _read_json(request)
+        if STATELESS:
+            state, error = _load_token_state(request, data)
+            if error:
+                return error
+            state.reset()
+            return web.json_response({
+                "success": True,
+                "message": "Game reset successfully",
+                "stateToken": tz_tokens.issue(state)
+            })
+
+        session_id = _get_session_id(request, data)
+        state = tz_sessions.get(session_id)
+        if state is None:
+            return _session_not_found()
+
+        async with tz_async_turns.turn(session_id):
+            state = tz_sessions.get(session_id)
+            if state is None:
+                return _session_not_found()
+            tz_speculator.discard(session_id)
+            state.reset()
+            tz_sessions.mark_dirty(session_id, state)
+            tz_turn_log.start(session_id, state)
+        return web.json_response({"success": True, "message": "Game reset successfully"})
+    except Exception as e:
+        print(f"Reset game error: {e}")
+        return _error(str(e))
+
+
+async def tz_get_metrics(request):
+    """Get TZ server metrics"""
+    return web.json_response({
+        "success": True,
+        "worker": WORKER_ID,
+        "sessions": tz_sessions.stats(),
+        "store": tz_sessions.store.stats(),
+        "turn_log": tz_turn_log.stats(),
+        "state_tokens": tz_tokens.stats() if STATELESS else None,
+        "locks": tz_async_turns.stats(),
+        "llm": request.app["llm_client"].stats(),
+        "reply_cache": tz_replies.stats(),
+        "reply_batch": tz_batcher.stats(),
+        "speculation": tz_speculator.stats(),
+        "single_flight": tz_async_flights.stats(),
+        "hedging": llm_hedger.stats(),
+        "circuit_breakers": llm_breakers.stats(),
+        "concurrency_limits": llm_limits.stats(),
+        "key_pool": llm_keys.stats(),
+        "model_routes": llm_router.stats()
+    })
+
+
+async def tz_threaded_only(request):
+    """只在线程服务中提供的接口"""
+    return _error(f"{request.path} is only available in the threaded server (unset TZ_ASYNC)", 501)
+
+
+async def health_check(request):
+    """健康检查"""
+    return web.json_response({"status": "ok"})
+
+
+async def serve_frontend(request):
+    """服务前端静态文件，不存在的路径返回 index.html（支持前端路由）"""
+    path = request.match_info.get("path", "")
+    root = os.path.realpath(STATIC_FOLDER)
+    target = os.path.realpath(os.path.join(root, path))
+    if not path or not target.startswith(root + os.sep) or not os.path.isfile(target):
+        target = os.path.join(root, "index.html")
+    if not os.path.isfile(target):
+        raise web.HTTPNotFound()
+    return web.FileResponse(target)
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """与 flask_cors 默认配置相同：允许任意来源"""
+    if request.method == "OPTIONS":
+        resp = web.Response()
+        resp.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        resp.headers["Access-Control-Allow-Headers"] = request.headers.get(
+            "Access-Control-Request-Headers", "Content-Type")
+    else:
+        resp = await handler(request)
+    resp.headers["Access-Control-Allow-Origin"] = request.headers.get("Origin", "*")
+    return resp
+
+
+def create_async_app():
+    """创建 aiohttp 应用"""
+    app = web.Application(middlewares=[cors_middleware])
+
+    async def llm_client_context(app):
+        app["llm_client"] = AsyncLLMClient()
+        yield
+        await app["llm_client"].close()
+
+    app.cleanup_ctx.append(llm_client_context)
+    app.router.add_post('/api/tz/start', tz_start_game)
+    app.router.add_post('/api/tz/message', tz_send_message)
+    app.router.add_get('/api/tz/state', tz_get_state)
+    app.router.add_post('/api/tz/reset', tz_reset_game)
+    app.router.add_get('/api/tz/metrics', tz_get_metrics)
+    app.router.add_post('/api/tz/message/stream', tz_threaded_only)
+    app.router.add_get('/api/tz/history', tz_threaded_only)
+    app.router.add_post('/api/tz/rewind', tz_threaded_only)
+    app.router.add_post('/api/tz/fork', tz_threaded_only)
+    app.router.add_get('/health', health_check)
+    app.router.add_route('OPTIONS', '/{path:.*}', health_check)
+    app.router.add_get('/', serve_frontend)
+    app.router.add_get('/{path:.*}', serve_frontend)
+    return app
+
+
+def serve_async(host='0.0.0.0', port=5001):
+    """运行异步服务（阻塞）"""
+    web.run_app(create_async_app(), host=host, port=port, print=None)
@@ -0,0 +1,162 @@
+"""
+异步服务 vs 线程服务 负载基准
+LLM 服务商延迟较高（默认 500ms）时，大量回合同时挂起等待响应。
+分别启动线程服务（Flask threaded）和异步服务（aiohttp），由同样数量的并发客户端
+不停地 开始游戏 -> 发送 "hi"（触发一次 LLM 调用），统计每秒回合数、失败数和服务进程内存。
+
+LLM 由本地替身服务器（fake_llm_server.py）在独立进程中提供。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_async.py [--clients 256] [--latency 500] [--seconds 10]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def llm_server(latency_ms, urls):
+    """替身 LLM 进程"""
+    sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+    from fake_llm_server import start_fake_llm_server
+    server, url = start_fake_llm_server(latency_ms=latency_ms)
+    urls.put(url)
+    while True:
+        time.sleep(3600)
+
+
+def serve(mode, port):
+    """被测服务进程"""
+    import contextlib
+    import io
+    import logging
+    os.chdir(BACKEND_DIR)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "async":
+            from async_app import serve_async
+            serve_async(host="127.0.0.1", port=port)
+        else:
+            from werkzeug.serving import WSGIRequestHandler, make_server
+            from app import app
+            WSGIRequestHandler.protocol_version = "HTTP/1.1"
+            server = make_server("127.0.0.1", port, app, threaded=True)
+            server.socket.listen(1024)
+            server.serve_forever()
+
+
+def memory_kb(pid):
+    """(VmRSS, VmHWM)，单位 KB；非 Linux 返回 (None, None)"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM", "Threads"):
+                    values[key] = int(value.split()[0])
+    except OSError:
+        return None, None, None
+    return values.get("VmRSS"), values.get("VmHWM"), values.get("Threads")
+
+
+async def load(base_url, llm_url, clients, seconds, pid):
+    import aiohttp
+
+    turns = 0
+    failures = 0
+    peak_threads = 0
+    deadline = time.monotonic() + seconds
+    settings = {"apiKey": "bench", "apiUrl": llm_url}
+
+    async def client(http):
+        nonlocal turns, failures
+        session_id = None
+        while time.monotonic() < deadline:
+            try:
+                async with http.post(base_url + "/api/tz/start", json={"sessionId": session_id, **settings}) as resp:
+                    session_id = (await resp.json())["sessionId"]
+                async with http.post(base_url + "/api/tz/message",
+                                     json={"message": "hi", "sessionId": session_id, **settings}) as resp:
+                    data = await resp.json()
+                if resp.status == 200 and "Communication failure" not in str(data["response"]):
+                    turns += 1
+                else:
+                    failures += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError):
+                failures += 1
+
+    async def sample():
+        nonlocal peak_threads
+        while time.monotonic() < deadline:
+            peak_threads = max(peak_threads, memory_kb(pid)[2] or 0)
+            await asyncio.sleep(0.2)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+        start = time.perf_counter()
+        await asyncio.gather(sample(), *(client(http) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    return turns / elapsed, failures, peak_threads
+
+
+def run(mode, port, llm_url, args):
+    import requests
+
+    ctx = multiprocessing.get_context("spawn")
+    proc = ctx.Process(target=serve, args=(mode, port), daemon=True)
+    proc.start()
+    base_url = f"http://127.0.0.1:{port}"
+    while True:
+        try:
+            requests.get(base_url + "/health", timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.1)
+
+    idle_rss, _, _ = memory_kb(proc.pid)
+    rate, failures, threads = asyncio.run(load(base_url, llm_url, args.clients, args.seconds, proc.pid))
+    _, peak_rss, _ = memory_kb(proc.pid)
+    proc.terminate()
+    proc.join()
+    return rate, failures, idle_rss, peak_rss, threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async vs threaded server load benchmark")
+    parser.add_argument("--clients", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=500, help="LLM latency in ms")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ.setdefault("TZ_LLM_POOL_SIZE", str(args.clients))
+    # 每个回合都要真正等一次 LLM：关闭回复缓存和请求合并
+    os.environ.setdefault("TZ_REPLY_CACHE_SIZE", "0")
+    os.environ.setdefault("TZ_LLM_SINGLE_FLIGHT", "0")
+    ctx = multiprocessing.get_context("spawn")
+    urls = ctx.Queue()
+    llm = ctx.Process(target=llm_server, args=(args.latency, urls), daemon=True)
+    llm.start()
+    llm_url = urls.get()
+
+    ideal = args.clients / (args.latency / 1000)
+    print(f"CPUs: {os.cpu_count()}, clients: {args.clients}, LLM latency: {args.latency:.0f} ms "
+          f"(ceiling ~{ideal:.0f} turns/s)")
+    print(f"{'server':>8} | {'turns/s':>8} | {'failed':>6} | {'idle RSS':>9} | {'peak RSS':>9} | {'threads':>7}")
+    print("-" * 64)
+    for i, mode in enumerate(("threaded", "async")):
+        rate, failures, idle_rss, peak_rss, threads = run(mode, 5500 + i, llm_url, args)
+        fmt = lambda kb: f"{kb / 1024:.1f} MB" if kb else "n/a"
+        print(f"{mode:>8} | {rate:>8.0f} | {failures:>6} | {fmt(idle_rss):>9} | {fmt(peak_rss):>9} | {threads:>7}")
+    llm.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+LLM 端点熔断基准
+服务商宕机：每个请求等待 --outage 毫秒后返回 503（真实情况下往往是等满 30 秒超时）。
+完整玩一遍游戏，分别关闭和开启熔断器，对比整局耗时、NPC 台词里通信失败文本和模板台词的数量。
+最后恢复服务商，等熔断器进入半开，确认一次探测请求成功后熔断器关闭。
+
+为了让每次都真正发出请求，基准中关闭了回复缓存和请求合并（single-flight）。
+LLM 由本地替身服务器提供。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_circuit_breaker.py [--outage 2000] [--open-seconds 2]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+
+SCRIPT = ['hi', 'yes', 'Bob', 'yes', 'yes', 'yes', 'A-C-B-D', 'A', 'A', 'yes', '3420', 'B', 'yes', 'hello world',
+          'A', 'B', 'yes', 'C', 'A', 'A', 'yes', '3,4,5,1,2', 'B', 'C', 'farewell']
+
+
+def play(client, settings, script):
+    """返回 (耗时秒, NPC 消息列表)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        session_id = client.post('/api/tz/start', json=settings).get_json()['sessionId']
+        start = time.perf_counter()
+        npc = []
+        for message in script:
+            response = client.post('/api/tz/message', json={'message': message, 'sessionId': session_id,
+                                                            **settings}).get_json()['response']
+            for m in response.get('messages', [response]):
+                if m.get('type') == 'npc':
+                    npc.append(m['content'])
+    return time.perf_counter() - start, npc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Circuit breaker outage benchmark")
+    parser.add_argument("--outage", type=float, default=2000, help="time before each failed request fails, ms")
+    parser.add_argument("--open-seconds", type=float, default=2, help="how long the circuit stays open")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ["TZ_REPLY_CACHE_SIZE"] = "0"
+    os.environ["TZ_LLM_SINGLE_FLIGHT"] = "0"
+    server, url = start_fake_llm_server(latency_ms=args.outage)
+    server.status = 503
+
+    import tz_routes
+    from app import app
+    from circuit_breaker import CircuitBreakers
+    from npc_templates import INTENT_LINES
+
+    client = app.test_client()
+    settings = {'apiKey': 'bench', 'apiUrl': url}
+    templates = tuple(INTENT_LINES.values())
+    print(f"provider down: every request fails after {args.outage:.0f} ms")
+    print(f"{'breaker':>7} | {'whole game s':>12} | {'requests':>8} | {'failure text':>12} | {'template lines':>14}")
+    print("-" * 66)
+    for enabled in (False, True):
+        tz_routes.llm_breakers = CircuitBreakers(enabled=enabled, open_seconds=args.open_seconds)
+        before = server.requests
+        seconds, npc = play(client, settings, SCRIPT)
+        failures = sum("[Communication failure]" in text for text in npc)
+        template = sum(any(line in text for line in templates) for text in npc)
+        print(f"{'on' if enabled else 'off':>7} | {seconds:>12.1f} | {server.requests - before:>8} | "
+              f"{failures:>12} | {template:>14}")
+
+    # 恢复：服务商正常后，等熔断器半开，探测请求成功即关闭
+    server.status = 200
+    server.latency_ms = 50
+    time.sleep(args.open_seconds)
+    seconds, npc = play(client, settings, SCRIPT[:2])
+    state = tz_routes.llm_breakers.stats()["endpoints"]
+    print(f"after recovery: {seconds * 1000:.0f} ms for two turns, breaker {state}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
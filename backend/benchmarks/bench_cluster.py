@@ -0,0 +1,101 @@
+"""
+多进程部署负载基准
+依次以 1、2、4… 个 worker 启动集群（前端进程 + worker 进程），
+由多个客户端进程并发发送回合请求，统计每秒回合数。
+
+回合使用身份确认阶段的无效输入（不触发 LLM 调用），
+每个请求都走完整的 前端转发 -> worker -> run_turn -> 持久化 路径。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_cluster.py [--workers 1,2,4] [--clients 4] [--threads 8] [--seconds 5]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+
+def client(base_url, threads, seconds, results):
+    """客户端进程：每个线程一个会话，不停发送回合"""
+    count = [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def loop(i):
+        http = requests.Session()
+        session_id = http.post(base_url + "/api/tz/start", json={}).json()["sessionId"]
+        http.post(base_url + "/api/tz/message", json={"message": "hi", "sessionId": session_id})
+        while time.monotonic() < deadline:
+            resp = http.post(base_url + "/api/tz/message", json={"message": "maybe", "sessionId": session_id})
+            if resp.status_code == 200:
+                count[i] += 1
+
+    pool = [threading.Thread(target=loop, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put(sum(count))
+
+
+def run(workers, port, args):
+    from cluster import Cluster, create_front_app
+
+    cluster = Cluster(workers, base_port=port + 1)
+    cluster.start()
+    front = create_front_app(cluster)
+    threading.Thread(target=lambda: front.run(host="127.0.0.1", port=port, threaded=True, use_reloader=False),
+                     daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+    while True:
+        try:
+            requests.get(base_url + "/health", timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.1)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    clients = [ctx.Process(target=client, args=(base_url, args.threads, args.seconds, results))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for p in clients:
+        p.start()
+    total = sum(results.get() for _ in clients)
+    for p in clients:
+        p.join()
+    elapsed = time.perf_counter() - start
+    cluster.stop()
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker load benchmark")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["TZ_SESSION_DB"] = os.path.join(tmp, "sessions.db")
+        print(f"CPUs: {os.cpu_count()}, clients: {args.clients} x {args.threads} threads")
+        print(f"{'workers':>7} | {'turns/s':>9}")
+        print("-" * 20)
+        for i, workers in enumerate(int(w) for w in args.workers.split(",")):
+            rate = run(workers, 5400 + i * 20, args)
+            print(f"{workers:>7} | {rate:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+LLM 自适应并发限制基准
+服务商最多同时处理 --capacity 个请求，超出的立即返回 429（可选带 Retry-After）。
+--threads 个线程在 --seconds 秒内不停调用 call_llm_api（每次提示词不同），分别关闭和开启并发限制，
+对比成功的请求数、调用方看到的失败数、服务商返回的 429 数和延迟；
+开启时每 100ms 采样一次并发上限，看后半段是否稳定在服务商容量附近。
+
+为了单独观察限流，基准中关闭了熔断器和请求合并（single-flight）。
+LLM 由本地替身服务器提供。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_concurrency_limit.py [--threads 64] [--capacity 16] [--latency 200] [--seconds 10]
+                                                 [--retry-after 0]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+
+
+def run(call, threads, seconds):
+    """threads 个线程持续调用 seconds 秒，返回 (成功调用的耗时列表, 失败数)"""
+    durations, failures = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(10 ** 9))
+    stop = time.perf_counter() + seconds
+
+    def worker():
+        while time.perf_counter() < stop:
+            with lock:
+                i = next(counter)
+            start = time.perf_counter()
+            try:
+                call(i)
+            except Exception:
+                with lock:
+                    failures[0] += 1
+                continue
+            with lock:
+                durations.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return sorted(durations), failures[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adaptive LLM concurrency limit benchmark")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--capacity", type=int, default=16, help="concurrent requests the provider accepts")
+    parser.add_argument("--latency", type=float, default=200, help="LLM latency in ms")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After sent with 429s, seconds")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ["TZ_LLM_SINGLE_FLIGHT"] = "0"
+    os.environ["TZ_LLM_POOL_SIZE"] = str(args.threads)
+    retry_after = args.retry_after if args.retry_after is None else f"{args.retry_after:g}"
+    server, url = start_fake_llm_server(latency_ms=args.latency, capacity=args.capacity, retry_after=retry_after)
+
+    import tz_routes
+    from circuit_breaker import CircuitBreakers
+    from concurrency_limit import ConcurrencyLimits
+
+    tz_routes.llm_breakers = CircuitBreakers(enabled=False)
+
+    def call(i):
+        tz_routes.call_llm_api([{"role": "user", "content": f"turn {i}"}], "bench", url)
+
+    print(f"{args.threads} threads for {args.seconds:.0f} s, provider capacity {args.capacity}, "
+          f"latency {args.latency:.0f} ms, Retry-After {retry_after}")
+    print(f"{'limiter':>7} | {'ok/s':>6} | {'failed':>6} | {'429s':>6} | {'peak conc.':>10} | "
+          f"{'p50 ms':>6} | {'p99 ms':>6}")
+    print("-" * 66)
+    for enabled in (False, True):
+        tz_routes.llm_limits = ConcurrencyLimits(enabled=enabled)
+        limiter = tz_routes.llm_limits.get(url, "bench")
+        samples = []
+        sampling = threading.Event()
+
+        def sample():
+            while not sampling.wait(0.1):
+                samples.append(limiter.limit)
+
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+        throttled, server.peak_active = server.throttled, 0
+        durations, failures = run(call, args.threads, args.seconds)
+        sampling.set()
+        sampler.join()
+        p50 = statistics.median(durations) * 1000 if durations else 0
+        p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000 if durations else 0
+        print(f"{'on' if enabled else 'off':>7} | {len(durations) / args.seconds:>6.1f} | {failures:>6} | "
+              f"{server.throttled - throttled:>6} | {server.peak_active:>10} | {p50:>6.0f} | {p99:>6.0f}")
+        if enabled:
+            settled = samples[len(samples) // 2:]
+            stats = limiter.stats()
+            print(f"limit in second half: min {min(settled):.1f}, mean {statistics.mean(settled):.1f}, "
+                  f"max {max(settled):.1f}; decreases {stats['decreases']}, retried {stats['retried']}, "
+                  f"rejected {stats['rejected']}, peak queue {stats['peak_queue']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+回合内 LLM 调用并发（fan-out）基准
+完整玩一遍游戏，记录每个回合的 LLM 调用次数和耗时。
+分别用单线程执行器（调用依次执行，相当于原来的同步路径）和默认的并发执行器运行，
+对比有多次 LLM 调用的回合的耗时。标准脚本中每个回合最多一次调用，
+因此另外单独测一个“任务回复 + 最终抉择”的回合（跳过战斗逻辑后进入最终抉择的情形）。
+
+为了让每个调用都真正发出，基准中关闭了回复缓存和请求合并。
+LLM 由本地替身服务器提供（固定延迟）。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_fanout.py [--latency 300]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+
+SCRIPT = ['hi', 'yes', 'Bob', 'yes', 'yes', 'yes', 'A-C-B-D', 'A', 'A', 'yes', '3420', 'B', 'yes', 'hello world',
+          'A', 'B', 'yes', 'C', 'A', 'A', 'yes', '3,4,5,1,2', 'B', 'C', 'farewell']
+
+
+def play(app, server, settings):
+    """返回 [(回合序号, 输入, LLM 调用次数, 耗时秒)]"""
+    client = app.test_client()
+    session_id = client.post('/api/tz/start', json=settings).get_json()['sessionId']
+    turns = []
+    for i, message in enumerate(SCRIPT, 1):
+        before = server.requests
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.post('/api/tz/message', json={'message': message, 'sessionId': session_id, **settings})
+        turns.append((i, message, server.requests - before, time.perf_counter() - start))
+    return turns
+
+
+def final_turn(url, rounds=5):
+    """任务失败回复 + start_final_choice 两次独立调用，返回平均耗时（秒）"""
+    import tz_routes
+    from game_logic import GameState
+    from stage_handlers import compose_npc_reply
+    from task_handlers import start_final_choice
+
+    total = 0.0
+    for _ in range(rounds):
+        state = GameState()
+        state.player_name = "Bob"
+        state.stage = "final_choice"
+        plan = tz_routes.new_turn_plan("bench", url, tz_routes.MODEL_NAME)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            reply = compose_npc_reply("Acknowledge failure", "Combat logic skipped.", state,
+                                      plan.llm_function, "bench", 60)
+            response = start_final_choice(state, "bench", plan.llm_function)
+            response["messages"].insert(0, {"type": "npc", "content": reply})
+            plan.resolve_parallel(plan.refresh, tz_routes.llm_executor)
+            plan.fill(response)
+        total += time.perf_counter() - start
+    return total / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-turn LLM fan-out benchmark")
+    parser.add_argument("--latency", type=float, default=300, help="LLM latency in ms")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ["TZ_REPLY_CACHE_SIZE"] = "0"
+    os.environ["TZ_LLM_SINGLE_FLIGHT"] = "0"
+    server, url = start_fake_llm_server(latency_ms=args.latency)
+
+    import tz_routes
+    from app import app
+
+    settings = {'apiKey': 'bench', 'apiUrl': url}
+    default_executor = tz_routes.llm_executor
+    tz_routes.llm_executor = ThreadPoolExecutor(1)
+    sequential = play(app, server, settings)
+    final_seq = final_turn(url)
+    tz_routes.llm_executor = default_executor
+    parallel = play(app, server, settings)
+    final_par = final_turn(url)
+
+    print(f"LLM latency {args.latency:.0f} ms; turns with more than one LLM call")
+    print(f"{'turn':>4} {'input':>10} | {'calls':>5} | {'sequential ms':>13} | {'fan-out ms':>10}")
+    print("-" * 54)
+    total_seq = total_par = 0.0
+    for (i, message, calls, seq), (_, _, _, par) in zip(sequential, parallel):
+        total_seq += seq
+        total_par += par
+        if calls > 1:
+            print(f"{i:>4} {message:>10} | {calls:>5} | {seq * 1000:>13.0f} | {par * 1000:>10.0f}")
+    print(f"{'-':>4} {'final':>10} | {2:>5} | {final_seq * 1000:>13.0f} | {final_par * 1000:>10.0f}")
+    print(f"whole game: {total_seq * 1000:.0f} ms sequential, {total_par * 1000:.0f} ms fan-out")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
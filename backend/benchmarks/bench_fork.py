@@ -0,0 +1,142 @@
+"""
+会话分支基准
+从一局进行到最终选择的状态（含 6 段 LLM 风格的记忆碎片）创建 N 个分支，
+比较 fork() 与完整复制（from_dict(to_dict())）的耗时和每个分支的内存占用。
+
+然后在开启持久化（临时的 TZ_SESSION_DB）时走接口的路径创建 --route-forks 个分支，
+比较每个分支的耗时（含写出）和写入数据库的字节数：
+- full write：旧的做法，分支写入会话存储，回合日志写一份完整快照
+- reference：分支第一次分叉前不写存储，回合日志只记录父会话和分叉回合
+- POST /api/tz/fork：完整的接口请求（同 reference）
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_fork.py [--forks 10000] [--route-forks 2000]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import GameState
+
+WORDS = ("signal", "static", "orders", "smoke", "civilians", "sirens", "memory", "commander",
+         "cannon", "retreat", "targets", "silence", "protocol", "fragments", "why", "...")
+
+
+def final_choice_state(rng):
+    state = GameState()
+    state.player_name = "Commander"
+    for name in ("Power Module", "Signal Amplifier", "Data Decoder", "Alien Communication", "Combat Logic"):
+        state.add_repaired_module(name)
+    for i in range(1, 7):
+        body = " ".join(rng.choice(WORDS) for _ in range(90))
+        state.remember_fragment(f"memory_{i}", f"【Memory Fragment #{i}】\n{body}?")
+    state.stage = "final_choice"
+    state.to_dict()
+    return state
+
+
+def measure(label, make, count):
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    branches = [make() for _ in range(count)]
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    # 各分支独立选择结局
+    for i, branch in enumerate(branches):
+        branch.final_choice = ("return_to_command", "awakening_freedom", "coexistence_signal", "failure_ending")[i % 4]
+        branch.stage = "ending"
+    print(f"{label:<10} | {elapsed / count * 1e6:>8.2f} us | {used / count:>8.0f} B/branch")
+    return branches
+
+
+def stored_bytes(log):
+    """会话存储和回合日志（共用一个数据库文件）中所有行的字节数"""
+    log.flush()
+    return sum(log._conn.execute(sql).fetchone()[0] or 0 for sql in (
+        "SELECT SUM(LENGTH(state)) FROM sessions",
+        "SELECT SUM(LENGTH(snapshot)) FROM turn_snapshots",
+        "SELECT SUM(LENGTH(session_id) + LENGTH(parent_id) + 8) FROM turn_forks",
+    ))
+
+
+def measure_route(label, make, count, store, log):
+    before = stored_bytes(log)
+    start = time.perf_counter()
+    for _ in range(count):
+        make()
+    store.flush()
+    log.flush()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<18} | {elapsed / count * 1e6:>8.1f} us | {(stored_bytes(log) - before) / count:>8.0f} B/branch")
+
+
+def bench_route(parent_state, count):
+    os.environ["TZ_SESSION_DB"] = os.path.join(tempfile.mkdtemp(prefix="tz-fork-"), "sessions.db")
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    import tz_routes
+    from app import app
+
+    sessions, log = tz_routes.tz_sessions, tz_routes.tz_turn_log
+    parent_state.turn = 40
+    parent_id, parent = sessions.create(parent_state)
+    log.start(parent_id, parent)
+    client = app.test_client()
+
+    def full_write():
+        fork_id, state = sessions.create(parent.fork())
+        log.start(fork_id, state)
+
+    def reference():
+        fork_id, state = sessions.create(parent.fork(), persist=False)
+        log.fork(fork_id, parent_id, state)
+
+    def route():
+        resp = client.post('/api/tz/fork', json={'sessionId': parent_id})
+        assert resp.status_code == 200
+
+    print(f"\nRoute path with TZ_SESSION_DB, {count} forks (time includes flushing the store and turn log)")
+    print(f"{'mode':<18} | {'per fork':>11} | {'written':>17}")
+    print("-" * 54)
+    measure_route("full write", full_write, count, sessions.store, log)
+    measure_route("reference", reference, count, sessions.store, log)
+    measure_route("POST /api/tz/fork", route, count, sessions.store, log)
+
+    # 分支从引用重建出的状态与父会话一致
+    fork_id = client.post('/api/tz/fork', json={'sessionId': parent_id}).get_json()['sessionId']
+    assert log.rebuild(fork_id).to_dict() == parent.to_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session fork benchmark")
+    parser.add_argument("--forks", type=int, default=10000)
+    parser.add_argument("--route-forks", type=int, default=2000)
+    args = parser.parse_args()
+
+    parent = final_choice_state(random.Random(42))
+    print(f"Forks: {args.forks}")
+    print(f"{'mode':<10} | {'per fork':>11} | {'memory':>17}")
+    print("-" * 46)
+    measure("deep copy", lambda: GameState.from_dict(parent.to_dict(), parent.version), args.forks)
+    branches = measure("fork", parent.fork, args.forks)
+    assert parent.stage == "final_choice" and parent.final_choice is None
+    assert {b.final_choice for b in branches[:4]} == {"return_to_command", "awakening_freedom",
+                                                      "coexistence_signal", "failure_ending"}
+
+    bench_route(parent, args.route_forks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+LLM 请求对冲（hedging）基准
+主端点有长尾延迟（默认 3% 的请求额外慢 2 秒），备用端点延迟正常。
+若干线程并发调用 call_llm_api（每次提示词不同），分别关闭和开启对冲，
+对比 p50 / p99 / 最大延迟、对冲率和发往备用端点的请求数。
+
+LLM 由两个本地替身服务器提供；备用端点是另一个服务商，配置了自己的密钥（TZ_LLM_HEDGE_KEY）。
+最后确认没有备用密钥时不对冲，玩家的密钥不会发往备用端点。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_hedging.py [--calls 600] [--threads 16] [--latency 200] [--tail-rate 0.03] [--tail 2000]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+
+
+def run(call, calls, threads):
+    """threads 个线程共发出 calls 次调用，返回每次调用的耗时（秒）"""
+    durations = []
+    lock = threading.Lock()
+    counter = iter(range(calls))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            call(i)
+            with lock:
+                durations.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return sorted(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hedged LLM requests benchmark")
+    parser.add_argument("--calls", type=int, default=600)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=200, help="normal LLM latency in ms")
+    parser.add_argument("--tail-rate", type=float, default=0.03, help="share of slow primary requests")
+    parser.add_argument("--tail", type=float, default=2000, help="extra latency of slow requests in ms")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ["TZ_LLM_SINGLE_FLIGHT"] = "0"
+    primary, primary_url = start_fake_llm_server(latency_ms=args.latency, tail_rate=args.tail_rate,
+                                                 tail_ms=args.tail, seed=1)
+    secondary, secondary_url = start_fake_llm_server(latency_ms=args.latency)
+
+    import tz_routes
+    from hedging import Hedger
+
+    def call(i):
+        tz_routes.call_llm_api([{"role": "user", "content": f"turn {i}"}], "bench", primary_url)
+
+    print(f"{args.calls} calls from {args.threads} threads, latency {args.latency:.0f} ms, "
+          f"{args.tail_rate:.0%} of primary requests +{args.tail:.0f} ms")
+    print(f"{'hedging':>7} | {'p50 ms':>6} | {'p99 ms':>6} | {'max ms':>6} | {'hedge rate':>10} | "
+          f"{'secondary reqs':>14} | {'secondary wins':>14}")
+    print("-" * 82)
+    for url in ("", secondary_url):
+        tz_routes.llm_hedger = Hedger(url=url, api_key="bench-secondary")
+        before = secondary.requests
+        durations = run(call, args.calls, args.threads)
+        stats = tz_routes.llm_hedger.stats()
+        p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+        print(f"{'on' if url else 'off':>7} | {statistics.median(durations) * 1000:>6.0f} | {p99 * 1000:>6.0f} | "
+              f"{durations[-1] * 1000:>6.0f} | {stats['hedge_rate']:>10.1%} | {secondary.requests - before:>14} | "
+              f"{stats['secondary_wins']:>14}")
+        if url:
+            print(f"learned threshold: {stats['threshold_ms']}")
+
+    tz_routes.llm_hedger = Hedger(url=secondary_url)
+    before = secondary.requests
+    run(call, 50, args.threads)
+    print(f"without a secondary key: no_key {tz_routes.llm_hedger.stats()['no_key']}, "
+          f"secondary reqs {secondary.requests - before}")
+    primary.shutdown()
+    secondary.shutdown()
+
+
+if __name__ == "__main__":
+    main()
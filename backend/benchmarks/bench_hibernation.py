@@ -0,0 +1,89 @@
+"""
+会话休眠基准
+创建 N 个进行到一半的会话（含一段固定记忆碎片和一段 LLM 风格的记忆碎片），
+比较全部活跃时与全部休眠后的内存占用，并统计休眠/恢复延迟。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_hibernation.py [--sessions 100000]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_generator import FALLBACK_MEMORIES
+from session_registry import SessionRegistry
+
+WORDS = ("signal", "static", "orders", "smoke", "civilians", "sirens", "memory", "commander",
+         "cannon", "retreat", "targets", "silence", "protocol", "fragments", "why", "...")
+
+
+def llm_like_fragment(rng):
+    body = " ".join(rng.choice(WORDS) for _ in range(90))
+    return f"【Memory Fragment #2】\n{body}?"
+
+
+def populate(registry, count, rng):
+    ids = []
+    for i in range(count):
+        session_id, state = registry.create()
+        state.player_name = f"Commander{i}"
+        state.stage = "memory_choice_alien_decode"
+        state.attempts["power"] += 1
+        state.attempts["amplifier"] += 4
+        state.add_repaired_module("Power Module")
+        state.add_repaired_module("Signal Amplifier")
+        state.deviation = -0.2
+        state.remember_fragment("memory_1", FALLBACK_MEMORIES[1])
+        state.remember_fragment("memory_2", llm_like_fragment(rng))
+        state.to_dict()  # 与线上一致：每次响应都会生成（并缓存）to_dict
+        ids.append(session_id)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session hibernation benchmark")
+    parser.add_argument("--sessions", type=int, default=100000)
+    args = parser.parse_args()
+
+    now = [0.0]
+    registry = SessionRegistry(capacity=args.sessions, idle_ttl=3600, hibernate_after=60,
+                               clock=lambda: now[0])
+    rng = random.Random(42)
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    ids = populate(registry, args.sessions, rng)
+    gc.collect()
+    active = tracemalloc.get_traced_memory()[0] - base
+
+    # 让所有会话空闲超过休眠时间
+    now[0] = 120.0
+    registry.expire()
+    gc.collect()
+    hibernated = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    # 随机恢复一部分会话
+    for session_id in rng.sample(ids, min(10000, len(ids))):
+        registry.get(session_id)
+    stats = registry.stats()
+
+    n = args.sessions
+    print(f"Sessions: {n}")
+    print(f"Active:     {active / n:>8.0f} B/session  ({active / 2**20:.1f} MiB)")
+    print(f"Hibernated: {hibernated / n:>8.0f} B/session  ({hibernated / 2**20:.1f} MiB)")
+    print(f"Reduction:  {active / hibernated:>8.1f}x")
+    print(f"Snapshot size: {stats['hibernated_bytes'] / max(stats['hibernated'], 1):.0f} B avg")
+    print(f"Hibernate latency: avg {stats['hibernate_avg_us']} us, max {stats['hibernate_max_us']} us")
+    print(f"Rehydrate latency: avg {stats['rehydrate_avg_us']} us, max {stats['rehydrate_max_us']} us")
+
+
+if __name__ == "__main__":
+    main()
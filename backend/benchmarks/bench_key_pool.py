@@ -0,0 +1,91 @@
+"""
+LLM 密钥 / 端点池基准
+每个“密钥”是一个本地替身服务器，最多同时处理 --capacity 个请求（超出返回 429），第三个的延迟是其他的两倍。
+--threads 个线程在 --seconds 秒内不停调用 call_llm_api（每次提示词不同）：
+先只用一个密钥（玩家自带密钥的情况），再用包含 --keys 个成员的密钥池（apiKey 为空），
+对比成功的请求数、调用方看到的失败数，以及各成员分到的请求数。
+最后一轮中途让第一个成员返回 401（密钥失效），之后恢复，看它被摘除和恢复
+（摘除时间上限缩短为 --seconds / 8，默认的 5 分钟在基准里看不到恢复）。
+
+为了让每次都真正发出请求，基准中关闭了请求合并（single-flight）。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_key_pool.py [--keys 3] [--threads 48] [--capacity 8] [--latency 200] [--seconds 8]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+from bench_concurrency_limit import run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM key pool benchmark")
+    parser.add_argument("--keys", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=48)
+    parser.add_argument("--capacity", type=int, default=8, help="concurrent requests each key accepts")
+    parser.add_argument("--latency", type=float, default=200, help="LLM latency in ms")
+    parser.add_argument("--seconds", type=float, default=8)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ["TZ_LLM_SINGLE_FLIGHT"] = "0"
+    os.environ["TZ_LLM_POOL_SIZE"] = str(args.threads)
+    servers = [start_fake_llm_server(latency_ms=args.latency * (2 if i == 2 else 1), capacity=args.capacity)
+               for i in range(args.keys)]
+
+    import tz_routes
+    from circuit_breaker import CircuitBreakers
+    from concurrency_limit import ConcurrencyLimits
+    from key_pool import KeyPool, PoolMember
+
+    def rounds():
+        single = servers[0][1]
+        yield "single key", KeyPool(), lambda i: tz_routes.call_llm_api(
+            [{"role": "user", "content": f"turn {i}"}], "player-key", single)
+        for label in ("key pool", "pool + 401"):
+            pool = KeyPool([PoolMember(f"key-{n}", url) for n, (_, url) in enumerate(servers)],
+                           max_eject_seconds=args.seconds / 8, seed=1)
+            yield label, pool, lambda i: tz_routes.call_llm_api([{"role": "user", "content": f"turn {i}"}], "")
+
+    print(f"{args.threads} threads for {args.seconds:.0f} s, {args.keys} keys accepting {args.capacity} concurrent "
+          f"requests each, latency {args.latency:.0f} ms (key 2: {args.latency * 2:.0f} ms)")
+    print(f"{'mode':>10} | {'ok/s':>6} | {'failed':>6} | {'429s':>6} | requests per key")
+    print("-" * 66)
+    for label, pool, call in rounds():
+        tz_routes.llm_keys = pool
+        tz_routes.llm_limits = ConcurrencyLimits()
+        tz_routes.llm_breakers = CircuitBreakers()
+        before = [(server.requests, server.throttled) for server, _ in servers]
+        outage = None
+        if label == "pool + 401":
+            def revoke():
+                time.sleep(args.seconds / 4)
+                servers[0][0].status = 401
+                time.sleep(args.seconds / 4)
+                servers[0][0].status = 200
+            outage = threading.Thread(target=revoke)
+            outage.start()
+        durations, failures = run(call, args.threads, args.seconds)
+        if outage is not None:
+            outage.join()
+        requests = [server.requests - b[0] for (server, _), b in zip(servers, before)]
+        throttled = sum(server.throttled - b[1] for (server, _), b in zip(servers, before))
+        print(f"{label:>10} | {len(durations) / args.seconds:>6.1f} | {failures:>6} | {throttled:>6} | {requests}")
+        if pool.enabled:
+            stats = pool.stats()
+            ejected = {name.split(" ")[-1]: member["ejected"] for name, member in stats["members"].items()}
+            print(f"{'':>10}   ejections {ejected}, reinstated {stats['reinstated']}, failovers {stats['failovers']}")
+    for server, _ in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
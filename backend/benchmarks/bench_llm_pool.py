@@ -0,0 +1,98 @@
+"""
+LLM 连接池基准
+对本地 OpenAI 兼容替身服务器（HTTPS，自签名证书），比较：
+- per-call: 每次调用 requests.post（原实现，每次都重新握手）
+- pooled:   call_llm_api 经 keep-alive 连接池
+
+每个"回合"连续发 3 次调用（任务结果、最终选择、结局），多个线程并发。
+handshake_ms 模拟到真实服务商的握手往返（本机 TLS 握手本身只有 1~2 ms）。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_llm_pool.py [--turns 50] [--threads 8] [--latency-ms 50] [--handshake-ms 60]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("TZ_LLM_WARMUP", "0")
+
+import requests
+
+from fake_llm_server import start_fake_llm_server
+from tz_routes import call_llm_api, llm_pool
+
+MESSAGES = [{"role": "user", "content": "Status report."}]
+
+
+def per_call(url):
+    resp = requests.post(url, headers={"Authorization": "Bearer bench"},
+                         json={"model": "fake", "messages": MESSAGES, "max_tokens": 500}, timeout=30)
+    resp.raise_for_status()
+    return resp.json()["choices"][0]["message"]["content"]
+
+
+def pooled(url):
+    return call_llm_api(MESSAGES, "bench", url, "fake")
+
+
+def run(server, url, call, turns, threads):
+    before = server.connections
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        for _ in range(turns):
+            for _ in range(3):
+                start = time.perf_counter()
+                call(url)
+                local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "calls/s": len(latencies) / elapsed,
+        "avg_ms": sum(latencies) / len(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "connections": server.connections - before
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM connection pool benchmark")
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--handshake-ms", type=float, default=60)
+    parser.add_argument("--no-tls", action="store_true")
+    args = parser.parse_args()
+
+    server, url = start_fake_llm_server(latency_ms=args.latency_ms, handshake_ms=args.handshake_ms,
+                                        tls=not args.no_tls)
+    print(f"{url}: latency {args.latency_ms} ms, handshake {args.handshake_ms} ms")
+    print(f"{args.threads} threads x {args.turns} turns x 3 calls")
+    print(f"{'mode':<9} | {'calls/s':>8} | {'avg ms':>7} | {'p95 ms':>7} | {'connections':>11}")
+    print("-" * 55)
+    for label, call in (("per-call", per_call), ("pooled", pooled)):
+        r = run(server, url, call, args.turns, args.threads)
+        print(f"{label:<9} | {r['calls/s']:>8.1f} | {r['avg_ms']:>7.1f} | {r['p95_ms']:>7.1f} | {r['connections']:>11}")
+    print(llm_pool.stats()["endpoints"])
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
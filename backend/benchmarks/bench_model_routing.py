@@ -0,0 +1,100 @@
+"""
+LLM 模型路由基准
+替身服务器上主模型延迟 --main 毫秒、快模型延迟 --fast 毫秒。
+完整玩一遍游戏，分别不路由（全部用主模型）和按路由表路由：
+结局独白、最终抉择、记忆碎片走主模型，其余字数上限不超过 80 词的意图走快模型。
+对比整局耗时、含 LLM 调用的回合的平均耗时，并输出每条路由的请求数和延迟。
+最后改写路由文件（去掉快模型规则），确认热加载后所有调用回到主模型。
+
+为了让每次都真正发出请求，基准中关闭了回复缓存。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_model_routing.py [--main 600] [--fast 150]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+from bench_circuit_breaker import SCRIPT
+
+ROUTES = {"routes": [
+    {"name": "narrative", "model": "main-model", "intents": ["Final monologue", "Final choice", "Memory fragment"]},
+    {"name": "fast", "model": "fast-model", "max_words": 80}
+]}
+
+
+def play(client, settings, server):
+    """返回 (整局耗时秒, 含 LLM 调用的回合耗时列表)"""
+    session_id = client.post('/api/tz/start', json=settings).get_json()['sessionId']
+    start = time.perf_counter()
+    turns = []
+    for message in SCRIPT:
+        before = server.requests
+        turn_start = time.perf_counter()
+        client.post('/api/tz/message', json={'message': message, 'sessionId': session_id, **settings})
+        if server.requests > before:
+            turns.append(time.perf_counter() - turn_start)
+    return time.perf_counter() - start, turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model routing benchmark")
+    parser.add_argument("--main", type=float, default=600, help="main model latency in ms")
+    parser.add_argument("--fast", type=float, default=150, help="fast model latency in ms")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ["TZ_REPLY_CACHE_SIZE"] = "0"
+    server, url = start_fake_llm_server(latency_ms=args.main, model_latency_ms={"fast-model": args.fast})
+
+    import tz_routes
+    from app import app
+    from model_router import ModelRouter
+
+    routes_file = os.path.join(tempfile.mkdtemp(prefix="tz-routes-"), "model_routes.json")
+    with open(routes_file, "w", encoding="utf-8") as f:
+        json.dump(ROUTES, f)
+
+    client = app.test_client()
+    settings = {'apiKey': 'bench', 'apiUrl': url, 'model': 'main-model'}
+    print(f"main model {args.main:.0f} ms, fast model {args.fast:.0f} ms")
+    print(f"{'routing':>8} | {'whole game s':>12} | {'LLM turns':>9} | {'mean turn ms':>12} | {'max turn ms':>11}")
+    print("-" * 66)
+    for label, router in (("off", ModelRouter("")), ("on", ModelRouter(routes_file, reload_seconds=0.1))):
+        tz_routes.llm_router = router
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds, turns = play(client, settings, server)
+        print(f"{label:>8} | {seconds:>12.1f} | {len(turns):>9} | {statistics.mean(turns) * 1000:>12.0f} | "
+              f"{max(turns) * 1000:>11.0f}")
+
+    for name, route in router.stats()["routes"].items():
+        print(f"  route {name:<9} model {str(route['model']):<10} requests {route['requests']:>3}  "
+              f"p50 {route['p50_ms']} ms  p95 {route['p95_ms']} ms")
+
+    # 热加载：去掉快模型规则
+    with open(routes_file, "w", encoding="utf-8") as f:
+        json.dump({"routes": ROUTES["routes"][:1]}, f)
+    time.sleep(0.2)
+    before = {name: route["requests"] for name, route in router.stats()["routes"].items()}
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds, turns = play(client, settings, server)
+    stats = router.stats()
+    delta = {name: route["requests"] - before.get(name, 0) for name, route in stats["routes"].items()}
+    print(f"after reload (rules {stats['rules']}, reloads {stats['reloads']}): whole game {seconds:.1f} s, "
+          f"requests per route {delta}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
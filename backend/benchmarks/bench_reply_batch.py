@@ -0,0 +1,86 @@
+"""
+NPC 台词合并请求基准
+一个回合需要两句 NPC 台词（战斗逻辑成功的台词 + 最终抉择的独白）。分别测：
+- 逐句请求（不合并，两句并发发出）
+- 合并成一个 JSON 请求
+- 合并请求但模型没有按 JSON 返回（退回逐句请求）
+统计发往服务商的请求数、提示词字符数和回合耗时。
+
+为了让每次都真正发出请求，基准中关闭了回复缓存和请求合并（single-flight）。
+LLM 由本地替身服务器提供（固定延迟）。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_reply_batch.py [--latency 300] [--rounds 10]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+
+
+def final_turn(url):
+    """跑一个两句台词的回合，返回 (耗时秒, 响应)"""
+    import tz_routes
+    from game_logic import GameState
+    from stage_handlers import compose_npc_reply
+    from task_handlers import start_final_choice
+
+    state = GameState()
+    state.player_name = "Bob"
+    state.stage = "final_choice"
+    plan = tz_routes.new_turn_plan("bench", url, tz_routes.MODEL_NAME)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        reply = compose_npc_reply("Celebrate success", "Combat logic rebuild successful!", state,
+                                  plan.llm_function, "bench", 80)
+        response = start_final_choice(state, "bench", plan.llm_function)
+        response["messages"].insert(0, {"type": "npc", "content": reply})
+        plan.resolve_parallel(plan.refresh, tz_routes.llm_executor)
+        response = plan.fill(response)
+    return time.perf_counter() - start, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched NPC lines benchmark")
+    parser.add_argument("--latency", type=float, default=300, help="LLM latency in ms")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ["TZ_REPLY_CACHE_SIZE"] = "0"
+    os.environ["TZ_LLM_SINGLE_FLIGHT"] = "0"
+    server, url = start_fake_llm_server(latency_ms=args.latency)
+
+    import tz_routes
+    from reply_batch import ReplyBatcher
+
+    modes = [("separate", 0, True), ("batched", 4, True), ("bad JSON", 4, False)]
+    print(f"two NPC lines per turn, LLM latency {args.latency:.0f} ms, {args.rounds} turns per mode")
+    print(f"{'mode':>9} | {'requests/turn':>13} | {'prompt chars/turn':>17} | {'ms/turn':>7} | {'fallbacks':>9}")
+    print("-" * 68)
+    for name, lines, batch_json in modes:
+        tz_routes.tz_batcher = ReplyBatcher(max_lines=lines)
+        server.batch_json = batch_json
+        requests_before, chars_before = server.requests, server.prompt_chars
+        elapsed = 0.0
+        for _ in range(args.rounds):
+            seconds, response = final_turn(url)
+            elapsed += seconds
+            assert not any("Communication failure" in str(m.get("content")) for m in response["messages"])
+        stats = tz_routes.tz_batcher.stats()
+        print(f"{name:>9} | {(server.requests - requests_before) / args.rounds:>13.1f} | "
+              f"{(server.prompt_chars - chars_before) / args.rounds:>17.0f} | "
+              f"{elapsed / args.rounds * 1000:>7.0f} | {stats['fallbacks']:>9}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
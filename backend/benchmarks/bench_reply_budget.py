@@ -0,0 +1,90 @@
+"""
+NPC 回复长度预算基准
+对每种字数上限的意图调用 compose_npc_reply，比较：
+- before：旧行为，每次请求 500 max_tokens，不截断
+- after：按 max_words 换算 max_tokens + 停止序列 + 句末截断
+
+LLM 由本地替身服务器提供，模拟不按字数要求收尾的模型：
+每次都想写 --reply-words 个词，首词延迟 --latency，之后每个词 --token 毫秒。
+为了让每次都真正发出请求，基准中关闭了回复缓存。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_reply_budget.py [--reply-words 250] [--latency 300] [--token 20] [--runs 3]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+
+# (意图, max_words)，覆盖 stage_handlers / task_handlers 中用到的各档字数
+INTENTS = [
+    ("Clarification request", 40),
+    ("Request consent to help", 48),
+    ("Request name", 60),
+    ("Acknowledge failure", 70),
+    ("Identity verification request", 80),
+    ("Final choice", 120),
+    ("Final monologue", 150),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-intent reply budget benchmark")
+    parser.add_argument("--reply-words", type=int, default=250)
+    parser.add_argument("--latency", type=float, default=300, help="LLM time to first token in ms")
+    parser.add_argument("--token", type=float, default=20, help="LLM time per token in ms")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ["TZ_REPLY_CACHE_SIZE"] = "0"
+    server, url = start_fake_llm_server(latency_ms=args.latency, token_ms=args.token, reply_words=args.reply_words)
+
+    from game_logic import GameState
+    from stage_handlers import compose_npc_reply
+    from tz_routes import call_llm_api
+    from reply_budget import truncate_reply
+
+    # compose_npc_reply 还会传入 cache_key、slots、batch 等参数，这里都忽略
+    def before(messages, max_tokens=500, fallback=None, stop=None, max_words=None, **kwargs):
+        return call_llm_api(messages, "bench", url)
+
+    def after(messages, max_tokens=500, fallback=None, stop=None, max_words=None, **kwargs):
+        text = call_llm_api(messages, "bench", url, max_tokens=max_tokens, stop=stop)
+        return truncate_reply(text, max_words) if max_words else text
+
+    state = GameState()
+
+    def measure(llm_function, intent, max_words):
+        times, words = [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                reply = compose_npc_reply(intent, "Benchmark context.", state, llm_function, "bench", max_words)
+            times.append(time.perf_counter() - start)
+            words.append(len(reply.split()))
+        return statistics.median(times) * 1000, statistics.median(words)
+
+    print(f"LLM: {args.latency:.0f} ms to first token + {args.token:.0f} ms/token, "
+          f"wants {args.reply_words} words; median of {args.runs} runs")
+    print(f"{'intent':<30} {'max_words':>9} | {'before ms':>9} {'words':>5} | {'after ms':>8} {'words':>5} | {'speedup':>7}")
+    print("-" * 86)
+    for intent, max_words in INTENTS:
+        b_ms, b_words = measure(before, intent, max_words)
+        a_ms, a_words = measure(after, intent, max_words)
+        print(f"{intent:<30} {max_words:>9} | {b_ms:>9.0f} {b_words:>5.0f} | {a_ms:>8.0f} {a_words:>5.0f} | "
+              f"{b_ms / a_ms:>6.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
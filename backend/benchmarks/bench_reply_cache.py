@@ -0,0 +1,92 @@
+"""
+NPC 回复缓存基准
+多个玩家依次完整玩一遍游戏（回合序列相同，名字各不相同，回复语气随机），
+分别在关闭缓存、开启缓存但不做提示词规范化、开启缓存并规范化（prompt_template）时统计：
+- 回合请求路径上的 LLM 调用次数（后台刷新不计入）
+- 每个玩家一局的总耗时
+- 缓存命中率
+
+LLM 由本地替身服务器提供（固定延迟）。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_reply_cache.py [--players 20] [--latency 50]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+
+SCRIPT = ['hi', 'yes', 'Bob', 'yes', 'yes', 'yes', 'A-C-B-D', 'A', 'A', 'yes', '3420', 'B', 'yes', 'hello world',
+          'A', 'B', 'yes', 'C', 'A', 'A', 'yes', '3,4,5,1,2', 'B', 'C', 'farewell']
+TONES = [10, 35, 60, 85]   # 四种人格/情绪
+
+
+def play(client, settings, tone, name):
+    session_id = client.post('/api/tz/start', json=settings).get_json()['sessionId']
+    for message in SCRIPT:
+        message = name if message == 'Bob' else message
+        client.post('/api/tz/message', json={'message': message, 'sessionId': session_id,
+                                             'responseTone': tone, **settings})
+
+
+def run(app, server, url, cache, players, seed, canonical):
+    import prompt_template
+    import stage_handlers
+    import tz_routes
+    tz_routes.tz_replies = cache
+    stage_handlers.canonicalize_context = (prompt_template.canonicalize_context if canonical
+                                           else lambda context, state: (context, {}))
+    client = app.test_client()
+    settings = {'apiKey': 'bench', 'apiUrl': url}
+    rng = random.Random(seed)
+    durations = []
+    before = server.requests
+    for i in range(players):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            play(client, settings, rng.choice(TONES), f"Player{i}")
+        durations.append(time.perf_counter() - start)
+    time.sleep(0.5)   # 等后台刷新结束
+    total = server.requests - before
+    stats = cache.stats()
+    return durations, total - stats["refreshes"], total, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NPC reply cache benchmark")
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=50, help="LLM latency in ms")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    server, url = start_fake_llm_server(latency_ms=args.latency)
+
+    from app import app
+    from reply_cache import ReplyCache
+
+    print(f"{args.players} players x {len(SCRIPT)} turns, LLM latency {args.latency:.0f} ms")
+    print(f"{'cache':>16} | {'LLM on path':>11} | {'LLM total':>9} | {'hit rate':>8} | {'median game ms':>14} | {'last 5 ms':>9}")
+    print("-" * 86)
+    modes = (("off", ReplyCache(max_keys=0), True),
+             ("on, raw prompts", ReplyCache(), False),
+             ("on, canonical", ReplyCache(), True))
+    for label, cache, canonical in modes:
+        durations, on_path, total, stats = run(app, server, url, cache, args.players, 1, canonical)
+        print(f"{label:>16} | {on_path:>11} | {total:>9} | {stats['hit_rate']:>8.0%} | "
+              f"{statistics.median(durations) * 1000:>14.0f} | {statistics.mean(durations[-5:]) * 1000:>9.0f}")
+        cache.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+会话持久化基准
+比较三种模式下的回合吞吐量：
+- memory: 不持久化
+- sqlite-sync: 每回合提交一次（每回合一次 fsync）
+- sqlite-write-behind: 后台批量提交
+
+回合使用放大器任务的错误频率输入（不触发 LLM 调用），
+多个线程各自操作一批会话，走与 /api/tz/message 相同的 run_turn + mark_dirty 路径。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_session_store.py [--turns 5000] [--threads 8]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_registry import SessionRegistry
+from session_store import SessionStore, SQLiteSessionStore
+from tz_routes import run_turn
+
+
+def run(store, turns, threads, sessions_per_thread=50):
+    registry = SessionRegistry(store=store)
+    data = {"emotion": "neutral", "persona": "Calm_Conscientious"}
+
+    def worker():
+        ids = []
+        for _ in range(sessions_per_thread):
+            session_id, state = registry.create()
+            state.stage = "amplifier"
+            ids.append(session_id)
+        for n in range(turns // threads):
+            session_id = ids[n % len(ids)]
+            state = registry.get(session_id)
+            if state.attempts["amplifier"] >= 8:
+                state.attempts["amplifier"] = 0
+            run_turn(state, data, "1000")
+            registry.mark_dirty(session_id, state)
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    store.close()
+    return (turns // threads) * threads / elapsed, store.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session store benchmark")
+    parser.add_argument("--turns", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        modes = (
+            ("memory", lambda: SessionStore()),
+            ("sqlite-sync", lambda: SQLiteSessionStore(os.path.join(tmp, "sync.db"), write_behind=False)),
+            ("sqlite-write-behind", lambda: SQLiteSessionStore(os.path.join(tmp, "wb.db"), flush_interval=0.2)),
+        )
+        print(f"Turns: {args.turns}, threads: {args.threads}")
+        print(f"{'mode':<22} | {'turns/s':>10} | {'commits':>8} | {'avg batch':>9}")
+        print("-" * 58)
+        for label, factory in modes:
+            rate, stats = run(factory(), args.turns, args.threads)
+            print(f"{label:<22} | {rate:>10.0f} | {stats.get('flushes', 0):>8} | {stats.get('avg_batch', 0):>9}")
+
+
+if __name__ == "__main__":
+    main()
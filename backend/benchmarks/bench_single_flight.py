@@ -0,0 +1,92 @@
+"""
+LLM 请求合并（single-flight）基准
+模拟开局突发：N 个玩家同时开始游戏并发送第一句话，
+同一语气的玩家提示词完全相同。分别关闭和开启 single-flight，
+统计发往服务商的请求数和回合延迟。
+
+为了单独观察合并效果，基准中关闭了回复缓存。
+LLM 由本地替身服务器提供（固定延迟）。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_single_flight.py [--players 200] [--tones 4] [--latency 500]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+
+TONES = [10, 35, 60, 85]
+
+
+def burst(client_factory, settings, players, tones):
+    """所有玩家先开始游戏，再同时发送第一句话；返回每个回合的耗时"""
+    sessions = []
+    for i in range(players):
+        client = client_factory()
+        session_id = client.post('/api/tz/start', json=settings).get_json()['sessionId']
+        sessions.append((client, session_id, TONES[i % tones]))
+
+    durations = [0.0] * players
+    gate = threading.Barrier(players)
+
+    def turn(i):
+        client, session_id, tone = sessions[i]
+        gate.wait()
+        start = time.perf_counter()
+        client.post('/api/tz/message', json={'message': 'hi', 'sessionId': session_id,
+                                             'responseTone': tone, **settings})
+        durations[i] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=turn, args=(i,)) for i in range(players)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-flight burst benchmark")
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--tones", type=int, default=4, choices=range(1, len(TONES) + 1))
+    parser.add_argument("--latency", type=float, default=500, help="LLM latency in ms")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ.setdefault("TZ_LLM_POOL_SIZE", str(args.players))
+    server, url = start_fake_llm_server(latency_ms=args.latency)
+
+    import tz_routes
+    from app import app
+    from reply_cache import ReplyCache
+    from single_flight import SingleFlight
+
+    tz_routes.tz_replies = ReplyCache(max_keys=0)
+    settings = {'apiKey': 'bench', 'apiUrl': url}
+
+    print(f"burst of {args.players} first turns, {args.tones} distinct prompts, LLM latency {args.latency:.0f} ms")
+    print(f"{'single-flight':>13} | {'upstream':>8} | {'coalesced':>9} | {'peak waiters':>12} | {'p50 ms':>6} | {'max ms':>6}")
+    print("-" * 70)
+    for enabled in (False, True):
+        tz_routes.llm_flights = SingleFlight(enabled=enabled)
+        before = server.requests
+        with contextlib.redirect_stdout(io.StringIO()):
+            durations = burst(app.test_client, settings, args.players, args.tones)
+        stats = tz_routes.llm_flights.stats()
+        print(f"{'on' if enabled else 'off':>13} | {server.requests - before:>8} | {stats['coalesced']:>9} | "
+              f"{stats['peak_waiters']:>12} | {statistics.median(durations) * 1000:>6.0f} | {max(durations) * 1000:>6.0f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+NPC 回复预生成（speculation）基准
+完整玩一遍游戏，每个回合之间停顿一段“思考时间”。分别关闭和开启预生成，
+对比需要 LLM 的回合的耗时，以及预生成的命中率和浪费的请求数。
+
+为了单独观察预生成的效果，基准中关闭了回复缓存和请求合并（single-flight）。
+LLM 由本地替身服务器提供（固定延迟）。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_speculation.py [--latency 300] [--think 500] [--budget 4]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import start_fake_llm_server
+
+SCRIPT = ['hi', 'yes', 'Bob', 'yes', 'yes', 'yes', 'A-C-B-D', 'A', 'A', 'yes', '3420', 'B', 'yes', 'hello world',
+          'A', 'B', 'yes', 'C', 'A', 'A', 'yes', '3,4,5,1,2', 'B', 'C', 'farewell']
+
+
+def play(app, server, settings, think):
+    """返回 (每个回合的 (耗时, 期间发往服务商的请求数), 总请求数)"""
+    client = app.test_client()
+    before = server.requests
+    with contextlib.redirect_stdout(io.StringIO()):
+        session_id = client.post('/api/tz/start', json=settings).get_json()['sessionId']
+    turns = []
+    for message in SCRIPT:
+        time.sleep(think)
+        requests, start = server.requests, time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.post('/api/tz/message', json={'message': message, 'sessionId': session_id, **settings})
+        turns.append((time.perf_counter() - start, server.requests - requests))
+    time.sleep(think)
+    return turns, server.requests - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speculative pre-generation benchmark")
+    parser.add_argument("--latency", type=float, default=300, help="LLM latency in ms")
+    parser.add_argument("--think", type=float, default=500, help="player think time between turns in ms")
+    parser.add_argument("--budget", type=int, default=4, help="speculative requests per session per turn")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    os.environ["TZ_REPLY_CACHE_SIZE"] = "0"
+    os.environ["TZ_LLM_SINGLE_FLIGHT"] = "0"
+    server, url = start_fake_llm_server(latency_ms=args.latency)
+
+    import tz_routes
+    from app import app
+    from speculation import Speculator
+
+    settings = {'apiKey': 'bench', 'apiUrl': url}
+    print(f"LLM latency {args.latency:.0f} ms, think time {args.think:.0f} ms, budget {args.budget}")
+    print(f"{'speculation':>11} | {'LLM turns':>9} | {'p50 ms':>6} | {'mean ms':>7} | {'requests':>8} | "
+          f"{'hits':>4} | {'wasted':>6} | {'cancelled':>9}")
+    print("-" * 82)
+    llm_turns = None
+    for budget in (0, args.budget):
+        tz_routes.tz_speculator = Speculator(budget=budget)
+        turns, requests = play(app, server, settings, args.think / 1000)
+        if llm_turns is None:
+            # 不预生成时回合内发出了请求的回合
+            llm_turns = [i for i, (_, calls) in enumerate(turns) if calls]
+        durations = [turns[i][0] for i in llm_turns]
+        stats = tz_routes.tz_speculator.stats()
+        print(f"{'on' if budget else 'off':>11} | {len(durations):>9} | {statistics.median(durations) * 1000:>6.0f} | "
+              f"{statistics.mean(durations) * 1000:>7.0f} | {requests:>8} | {stats['hits']:>4} | "
+              f"{stats['wasted']:>6} | {stats['cancelled']:>9}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
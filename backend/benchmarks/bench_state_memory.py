@@ -0,0 +1,100 @@
+"""
+GameState 内存基准
+分别创建 N 个旧版（普通对象 + 每实例字典）和新版（__slots__）GameState，
+用 tracemalloc 统计每个会话占用的字节数。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_state_memory.py [--sessions 100000]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import GameState, DEFAULT_EMOTION, DEFAULT_INTENSITY
+
+
+class LegacyGameState:
+    """重构前的 GameState 布局（仅用于对照）"""
+    def __init__(self):
+        self.player_name = None
+        self.stage = "init"
+        self.tasks_failed = 0
+        self.modules_repaired = []
+        self.current_task = None
+        self.attempts = {"power": 0, "amplifier": 0, "decoder": 0, "alien_decode": 0, "combat_logic": 0}
+        self.max_attempts = {"power": 3, "amplifier": 10, "decoder": 3, "alien_decode": 3, "combat_logic": 3}
+        self.correct_frequency = 3420
+        self.communication_fixed = False
+        self.deviation = 0.0
+        self.final_choice = None
+        self.hint_shown_stages = set()
+        self.memory_fragments = {}
+        self.persona = "Calm_Conscientious"
+        self.emotion = DEFAULT_EMOTION
+        self.emotion_intensity = DEFAULT_INTENSITY
+
+
+def play_legacy(state, i):
+    state.player_name = f"Commander{i}"
+    state.stage = "memory_choice_decoder"
+    state.attempts["power"] += 1
+    state.attempts["amplifier"] += 3
+    state.modules_repaired.append("Power Module")
+    state.modules_repaired.append("Signal Amplifier")
+    state.deviation = -0.2
+
+
+def play_compact(state, i):
+    state.player_name = f"Commander{i}"
+    state.stage = "memory_choice_decoder"
+    state.attempts["power"] += 1
+    state.attempts["amplifier"] += 3
+    state.add_repaired_module("Power Module")
+    state.add_repaired_module("Signal Amplifier")
+    state.deviation = -0.2
+
+
+def measure(factory, play, count):
+    """返回每个会话的平均字节数"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = []
+    for i in range(count):
+        state = factory()
+        if play is not None:
+            play(state, i)
+        sessions.append(state)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # 减去列表本身的开销
+    per_session = (after - before - sys.getsizeof(sessions)) / count
+    del sessions
+    return per_session
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GameState memory benchmark")
+    parser.add_argument("--sessions", type=int, default=100000)
+    args = parser.parse_args()
+
+    n = args.sessions
+    print(f"Sessions: {n}")
+    print(f"{'scenario':<22} | {'legacy (B/session)':>18} | {'compact (B/session)':>19} | {'ratio':>6}")
+    print("-" * 75)
+    for label, legacy_play, compact_play in (
+        ("fresh", None, None),
+        ("mid-game", play_legacy, play_compact),
+    ):
+        legacy = measure(LegacyGameState, legacy_play, n)
+        compact = measure(GameState, compact_play, n)
+        print(f"{label:<22} | {legacy:>18.0f} | {compact:>19.0f} | {legacy / compact:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+状态令牌基准
+构造一局接近结束的状态（6 段 LLM 风格的记忆碎片），比较：
+- 记忆碎片写正文 vs 只写摘要引用时的令牌大小
+- 签发、校验的耗时，以及篡改令牌被拒绝的耗时
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_state_token.py [--rounds 20000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import GameState
+from state_codec import encode_state
+from state_token import StateTokenCodec, StateTokenError
+
+WORDS = ("signal", "static", "orders", "smoke", "civilians", "sirens", "memory", "commander",
+         "cannon", "retreat", "targets", "silence", "protocol", "fragments", "why", "...")
+
+
+def late_game_state(rng):
+    state = GameState()
+    state.player_name = "Commander"
+    state.stage = "final_choice"
+    for name in ("Power Module", "Signal Amplifier", "Data Decoder", "Alien Communication", "Combat Logic"):
+        state.add_repaired_module(name)
+    state.deviation = -0.35
+    for i in range(1, 7):
+        body = " ".join(rng.choice(WORDS) for _ in range(90))
+        state.remember_fragment(f"memory_{i}", f"【Memory Fragment #{i}】\n{body}?")
+    return state
+
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="State token benchmark")
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    state = late_game_state(random.Random(42))
+    codec = StateTokenCodec(b"bench-secret")
+    token = codec.issue(state)
+
+    # 对照：碎片正文直接写进快照（未加签名和 base64）
+    inline_size = len(encode_state(state))
+
+    tampered = token[:10] + ("A" if token[10] != "A" else "B") + token[11:]
+
+    def reject():
+        try:
+            codec.load(tampered)
+        except StateTokenError:
+            pass
+
+    assert codec.load(token).to_dict() == state.to_dict()
+    print(f"Snapshot with fragment text: {inline_size} B")
+    print(f"Token with fragment refs:    {len(token)} B")
+    print(f"Issue:  {timed(lambda: codec.issue(state), args.rounds):.1f} us")
+    print(f"Load:   {timed(lambda: codec.load(token), args.rounds):.1f} us")
+    print(f"Reject: {timed(reject, args.rounds):.1f} us (tampered)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+流式回合（SSE）响应时间基准
+同一段开局流程分别通过 /api/tz/message 和 /api/tz/message/stream 发送，
+统计玩家看到第一条消息、第一个 NPC 词以及整个回合结束的时间（中位数）。
+
+LLM 由本地替身服务器提供：首词延迟 --latency，之后每个词 --token 毫秒。
+为了让每次都真正发出请求，基准中关闭了回复缓存。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_stream.py [--latency 400] [--token 40] [--runs 5]
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+from fake_llm_server import start_fake_llm_server
+
+# 开局流程：第一个回合只有 NPC 回复，之后的回合先有若干条固定系统消息
+SCRIPT = ["hi", "yes", "Bob", "yes", "yes"]
+
+
+def timed_turn(http, base_url, body):
+    """非流式：(首条消息, 首个 NPC 词, 回合结束) 都等于整个请求的耗时"""
+    start = time.perf_counter()
+    resp = http.post(base_url + "/api/tz/message", json=body)
+    resp.raise_for_status()
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, elapsed
+
+
+def timed_stream_turn(http, base_url, body):
+    """流式：分别记录第一个 message/delta 事件和 done 事件到达的时间"""
+    start = time.perf_counter()
+    first_message = first_npc = None
+    event = None
+    with http.post(base_url + "/api/tz/message/stream", json=body, stream=True) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines(chunk_size=None, decode_unicode=True):
+            now = time.perf_counter() - start
+            if line.startswith("event:"):
+                event = line[6:].strip()
+                if first_message is None and event in ("message", "delta"):
+                    first_message = now
+                if first_npc is None and event == "delta":
+                    first_npc = now
+            elif event == "done" and line.startswith("data:"):
+                return first_message, first_npc if first_npc is not None else now, now
+    raise RuntimeError("stream ended without a done event")
+
+
+def run(base_url, llm_url, turn_fn, runs):
+    samples = {message: [] for message in SCRIPT}
+    settings = {"apiKey": "bench", "apiUrl": llm_url}
+    http = requests.Session()
+    for _ in range(runs):
+        session_id = http.post(base_url + "/api/tz/start", json=settings).json()["sessionId"]
+        for message in SCRIPT:
+            samples[message].append(turn_fn(http, base_url, {"message": message, "sessionId": session_id, **settings}))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming turn latency benchmark")
+    parser.add_argument("--latency", type=float, default=400, help="LLM time to first token in ms")
+    parser.add_argument("--token", type=float, default=40, help="LLM time per token in ms")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5480)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TZ_LLM_WARMUP", "0")
+    # 两轮用同样的开局流程，不关闭回复缓存的话第二轮全部命中缓存
+    os.environ.setdefault("TZ_REPLY_CACHE_SIZE", "0")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server, llm_url = start_fake_llm_server(latency_ms=args.latency, token_ms=args.token)
+
+    from app import app
+    threading.Thread(target=lambda: app.run(host="127.0.0.1", port=args.port, threaded=True, use_reloader=False),
+                     daemon=True).start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    while True:
+        try:
+            requests.get(base_url + "/health", timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.1)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        plain = run(base_url, llm_url, timed_turn, args.runs)
+        streamed = run(base_url, llm_url, timed_stream_turn, args.runs)
+
+    ms = lambda samples, i: f"{statistics.median(s[i] for s in samples) * 1000:.0f}"
+    print(f"LLM: {args.latency:.0f} ms to first token + {args.token:.0f} ms/token, {args.runs} runs (median ms)")
+    print(f"{'turn':>6} | {'plain':>6} | {'stream: first msg':>17} | {'first NPC word':>14} | {'done':>6}")
+    print("-" * 62)
+    for message in SCRIPT:
+        p, s = plain[message], streamed[message]
+        print(f"{message:>6} | {ms(p, 2):>6} | {ms(s, 0):>17} | {ms(s, 1):>14} | {ms(s, 2):>6}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
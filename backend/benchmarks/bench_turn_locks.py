@@ -0,0 +1,108 @@
+"""
+回合锁竞争基准
+比较「单一全局锁」与「分条回合锁」在不同线程数下的回合吞吐量。
+每个回合运行真实的阶段处理函数，LLM 调用用 sleep 模拟网络等待。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_turn_locks.py [--llm-ms 20] [--turns 400]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import GameState
+from session_locks import TurnLocks
+from stage_handlers import process_stage
+
+
+class GlobalLock:
+    """对照组：所有会话共用一把锁（等价于旧的单一全局状态加锁）"""
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def turn(self, session_id):
+        with self._lock:
+            yield
+
+
+def run(locks, threads, turns, llm_seconds, sessions_per_thread=1):
+    """每个线程操作自己的会话，返回 turns/sec"""
+    def fake_llm(messages, *args, **kwargs):
+        time.sleep(llm_seconds)
+        return "Acknowledged."
+
+    def worker(index):
+        states = {}
+        for i in range(sessions_per_thread):
+            state = GameState()
+            state.stage = "first_contact"
+            states[f"s{index}-{i}"] = state
+        ids = list(states)
+        for n in range(turns // threads):
+            session_id = ids[n % len(ids)]
+            state = states[session_id]
+            with locks.turn(session_id):
+                if state.stage != "first_contact":
+                    state.stage = "first_contact"
+                process_stage(state, "hello", "", fake_llm)
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return (turns // threads) * threads / elapsed
+
+
+def run_same_session(locks, threads, turns):
+    """多个线程争用同一会话，校验回合没有交错执行"""
+    inside = [0]
+    overlaps = [0]
+
+    def worker():
+        for _ in range(turns // threads):
+            with locks.turn("shared"):
+                inside[0] += 1
+                if inside[0] != 1:
+                    overlaps[0] += 1
+                time.sleep(0)
+                inside[0] -= 1
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return overlaps[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn lock contention benchmark")
+    parser.add_argument("--llm-ms", type=float, default=20.0, help="simulated LLM latency per call")
+    parser.add_argument("--turns", type=int, default=400, help="total turns per run")
+    args = parser.parse_args()
+
+    llm_seconds = args.llm_ms / 1000.0
+    print(f"Simulated LLM latency: {args.llm_ms:.0f} ms, turns per run: {args.turns}")
+    print(f"{'threads':>8} | {'global lock (turns/s)':>22} | {'striped locks (turns/s)':>24} | {'speedup':>8}")
+    print("-" * 72)
+    for threads in (1, 2, 4, 8, 16, 32, 64):
+        baseline = run(GlobalLock(), threads, args.turns, llm_seconds)
+        striped = run(TurnLocks(), threads, args.turns, llm_seconds)
+        print(f"{threads:>8} | {baseline:>22.1f} | {striped:>24.1f} | {striped / baseline:>7.1f}x")
+
+    overlaps = run_same_session(TurnLocks(), 16, 20000)
+    print(f"\nSame-session interleaved turns with 16 threads: {overlaps}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+回合日志恢复基准
+为不同长度的对局写入回合日志，比较"从头重放全部事件"与"最近快照 + 尾部重放"的重建耗时。
+回合使用放大器任务的错误频率输入（不触发 LLM 调用）。
+
+用法（在 backend 目录下）：
+    python benchmarks/bench_turn_log.py [--snapshot-interval 10]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import GameState
+from turn_log import TurnLog
+from tz_routes import run_turn
+
+
+def play(log, session_id, turns):
+    data = {"emotion": "neutral", "persona": "Calm_Conscientious"}
+    state = GameState()
+    state.stage = "amplifier"
+    log.start(session_id, state)
+    for _ in range(turns):
+        if state.attempts["amplifier"] >= 8:
+            state.attempts["amplifier"] = 0
+        mark = log.begin(state)
+        run_turn(state, data, "1000")
+        log.commit(session_id, state, "1000", mark)
+    log.flush()
+    return state
+
+
+def time_rebuild(log, session_id, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        log.rebuild(session_id)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn log recovery benchmark")
+    parser.add_argument("--snapshot-interval", type=int, default=10)
+    args = parser.parse_args()
+
+    # 快照间隔极大时等价于只有初始快照、从头重放
+    full_replay = TurnLog(snapshot_interval=10 ** 9, flush_interval=3600)
+    snapshots = TurnLog(snapshot_interval=args.snapshot_interval, flush_interval=3600)
+
+    print(f"Snapshot interval: {args.snapshot_interval}")
+    print(f"{'turns':>6} | {'full replay ms':>14} | {'snapshot+tail ms':>16} | {'match':>5}")
+    print("-" * 52)
+    for turns in (10, 100, 1000, 5000):
+        session_id = f"s{turns}"
+        expected = play(full_replay, session_id, turns)
+        play(snapshots, session_id, turns)
+        full_ms = time_rebuild(full_replay, session_id)
+        tail_ms = time_rebuild(snapshots, session_id)
+        match = snapshots.rebuild(session_id).to_dict() == expected.to_dict()
+        print(f"{turns:>6} | {full_ms:>14.3f} | {tail_ms:>16.3f} | {str(match):>5}")
+
+    full_replay.close()
+    snapshots.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+本地 OpenAI 兼容的 LLM 替身服务器（供基准使用）
+POST /v1/chat/completions 在固定延迟后返回一段固定回复。
+
+- 支持 HTTP/1.1 keep-alive
+- handshake_ms：每个新连接额外等待的时间，模拟到真实服务商的 TCP + TLS 握手往返
+- token_ms：每个输出词的生成时间；请求带 stream: true 时以 SSE 分块逐词返回，
+  否则等全部生成完再一次返回（latency_ms 相当于首词延迟）
+- reply_words：设置后改为生成这么多词的长回复（每词按 1 个 token 计），
+  并遵守请求中的 max_tokens，用来模拟不按字数要求收尾的模型
+- 提示词要求以 JSON 返回多句台词（reply_batch.py 的合并请求）时，返回 {"lines": [...]}；
+  batch_json=False 时照常返回纯文本，用来模拟不遵守格式的模型
+- tail_rate / tail_ms：按这个比例的请求额外等待 tail_ms，模拟服务商的长尾延迟
+- model_latency_ms：{模型名: 延迟}，请求这些模型时代替 latency_ms（模拟快慢不同的模型）
+- capacity：同时处理的请求数上限，超出的请求立即返回 429（retry_after 非空时带 Retry-After 头，单位秒），
+  模拟服务商按账号限流；throttled 统计被拒绝的请求数，peak_active 为实际达到的最大并发
+- status：非 200 时在延迟之后返回这个 HTTP 状态码（模拟服务商故障），运行中可以修改
+- prompt_chars 统计收到的提示词字符数
+- tls=True 时用 openssl 生成自签名证书，并通过 REQUESTS_CA_BUNDLE 让 requests 信任它
+
+用法：
+    server, url = start_fake_llm_server(latency_ms=50, handshake_ms=60)
+    ...
+    server.shutdown()
+"""
+
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "...Signal received. Systems stabilizing. I can hear you now."
+FILLER = ("Power reserves are failing. I need your help, Commander. "
+          "Every second counts... The damage spreads through my core systems. ").split(" ")
+BATCH_PROMPT = re.compile(r"Return exactly (\d+) lines as a JSON object")
+
+
+def _reply_words(server, body):
+    if not server.reply_words:
+        return REPLY.split(" "), "stop"
+    count = server.reply_words
+    finish = "stop"
+    max_tokens = body.get("max_tokens")
+    if isinstance(max_tokens, int) and max_tokens < count:
+        count, finish = max_tokens, "length"
+    words = [w for w in FILLER if w]
+    return [words[i % len(words)] for i in range(count)], finish
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        server = self.server
+        with server.stats_lock:
+            server.connections += 1
+        if server.handshake_ms:
+            time.sleep(server.handshake_ms / 1000)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        with server.stats_lock:
+            server.requests += 1
+            server.prompt_chars += len(prompt)
+            throttle = bool(server.capacity) and server.active >= server.capacity
+            if throttle:
+                server.throttled += 1
+            else:
+                server.active += 1
+                server.peak_active = max(server.peak_active, server.active)
+        if throttle:
+            return self._error(429, server.retry_after)
+        try:
+            self._serve(server, body, prompt)
+        finally:
+            with server.stats_lock:
+                server.active -= 1
+
+    def _serve(self, server, body, prompt):
+        delay = server.model_latency_ms.get(body.get("model"), server.latency_ms)
+        if server.tail_rate and server.random.random() < server.tail_rate:
+            delay += server.tail_ms
+        if delay:
+            time.sleep(delay / 1000)
+        if server.status != 200:
+            return self._error(server.status)
+        words, finish = _reply_words(server, body)
+        with server.stats_lock:
+            server.tokens += len(words)
+        if body.get("stream"):
+            return self._stream(body, words, finish)
+        if server.token_ms:
+            time.sleep(server.token_ms * (len(words) - 1) / 1000)
+
+        content = " ".join(words)
+        batch = BATCH_PROMPT.search(prompt)
+        if batch and server.batch_json:
+            content = json.dumps({"lines": [content] * int(batch.group(1))})
+        reply = json.dumps({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": finish}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def _error(self, status, retry_after=None):
+        reply = json.dumps({"error": {"message": "fake upstream failure", "code": status}}).encode("utf-8")
+        self.send_response(status)
+        if retry_after is not None:
+            self.send_header("Retry-After", str(retry_after))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def _stream(self, body, words, finish):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(data):
+            line = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for i, word in enumerate(words):
+                if i and self.server.token_ms:
+                    time.sleep(self.server.token_ms / 1000)
+                send(json.dumps({
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion.chunk",
+                    "model": body.get("model", "fake"),
+                    "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                 "finish_reason": None}]
+                }))
+            send(json.dumps({
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {}, "finish_reason": finish}]
+            }))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前停止读取
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _self_signed_cert(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+def start_fake_llm_server(port=0, latency_ms=50, handshake_ms=0, tls=False, token_ms=0, reply_words=None,
+                          batch_json=True, tail_rate=0, tail_ms=0, seed=None, capacity=0, retry_after=None,
+                          model_latency_ms=None):
+    """启动替身服务器，返回 (server, chat_completions_url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler, bind_and_activate=False)
+    server.request_queue_size = 1024   # 突发连接时不因 listen 队列太短而丢 SYN
+    server.server_bind()
+    server.server_activate()
+    server.daemon_threads = True
+    server.latency_ms = latency_ms
+    server.model_latency_ms = model_latency_ms or {}
+    server.handshake_ms = handshake_ms
+    server.token_ms = token_ms
+    server.reply_words = reply_words
+    server.batch_json = batch_json
+    server.tail_rate = tail_rate
+    server.status = 200
+    server.capacity = capacity
+    server.retry_after = retry_after
+    server.tail_ms = tail_ms
+    server.random = random.Random(seed)
+    server.stats_lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    server.tokens = 0
+    server.prompt_chars = 0
+    server.active = 0
+    server.peak_active = 0
+    server.throttled = 0
+
+    scheme = "http"
+    if tls:
+        import ssl
+        directory = tempfile.mkdtemp(prefix="tz-fake-llm-")
+        cert, key = _self_signed_cert(directory)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        os.environ["REQUESTS_CA_BUNDLE"] = cert
+        scheme = "https"
+
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
@@ -0,0 +1,232 @@
+"""
+LLM 端点熔断器
+服务商宕机时，每次 LLM 调用都要等满 30 秒超时才降级，一个回合里有几次调用就要等几分钟。
+每个端点一个熔断器，按最近一段时间的调用结果决定是否直接拒绝请求：
+
+- 关闭（closed）：正常请求，记录结果；窗口内失败率（错误 + 慢调用）达到阈值时打开
+- 打开（open）：立即抛出 CircuitOpenError，不发请求；open_seconds 后进入半开
+- 半开（half-open）：只放行 probes 个探测请求，成功则关闭，失败则重新打开
+
+- 窗口同时受调用数（window）和时间（window_seconds）限制
+- 超过 slow_ms 的成功调用也算失败（服务商严重过载时同样应该降级）
+- 4xx 客户端错误（密钥无效等，408 除外）是玩家自己的问题，不计入端点的失败率；
+  429 是限流信号而不是故障，由并发限制（concurrency_limit.py）按 Retry-After 退让，同样不计入
+"""
+
+import contextlib
+import os
+import threading
+import time
+from collections import deque
+
+from llm_client import endpoint_of
+
+DEFAULT_BREAKER_ENABLED = os.environ.get("TZ_LLM_BREAKER", "1").lower() not in ("0", "false", "no")
+DEFAULT_BREAKER_WINDOW = int(os.environ.get("TZ_LLM_BREAKER_WINDOW", "50"))
+DEFAULT_BREAKER_WINDOW_SECONDS = float(os.environ.get("TZ_LLM_BREAKER_WINDOW_SECONDS", "60"))
+DEFAULT_BREAKER_MIN_CALLS = int(os.environ.get("TZ_LLM_BREAKER_MIN_CALLS", "5"))
+DEFAULT_BREAKER_FAILURE_RATE = float(os.environ.get("TZ_LLM_BREAKER_FAILURE_RATE", "0.5"))
+DEFAULT_BREAKER_SLOW_MS = float(os.environ.get("TZ_LLM_BREAKER_SLOW_MS", "10000"))
+DEFAULT_BREAKER_OPEN_SECONDS = float(os.environ.get("TZ_LLM_BREAKER_OPEN_SECONDS", "15"))
+DEFAULT_BREAKER_PROBES = int(os.environ.get("TZ_LLM_BREAKER_PROBES", "1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """端点熔断中，请求没有发出"""
+
+
+def counts_as_failure(error):
+    """异常是否说明端点有问题（而不是这个请求本身有问题）"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int) and 400 <= status < 500 and status != 408:
+        return False
+    return True
+
+
+class CircuitBreaker:
+    """一个端点的熔断器（参数见 CircuitBreakers）"""
+    def __init__(self, endpoint, window, window_seconds, min_calls, failure_rate, slow_ms, open_seconds, probes,
+                 clock=time.monotonic):
+        self.endpoint = endpoint
+        self.window = window
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_ms = slow_ms
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque()     # (时间, 是否失败)
+        self._failures = 0
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = 0
+
+        self.opened = 0
+        self.short_circuited = 0
+        self.probes_sent = 0
+
+    def before(self):
+        """发请求前调用；熔断中抛出 CircuitOpenError，否则返回是否为探测请求"""
+        with self._lock:
+            if self.state == OPEN:
+                if self.clock() - self._opened_at < self.open_seconds:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(f"LLM endpoint {self.endpoint} is unavailable (circuit open)")
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probing >= self.probes:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(f"LLM endpoint {self.endpoint} is unavailable (probing)")
+                self._probing += 1
+                self.probes_sent += 1
+                return True
+            return False
+
+    def after(self, probe, seconds, error=None):
+        """请求结束后调用（error 为请求抛出的异常）"""
+        failed = (counts_as_failure(error) if error is not None
+                  else seconds * 1000 >= self.slow_ms)
+        with self._lock:
+            if probe:
+                self._probing -= 1
+                if failed:
+                    self._open()
+                elif self.state == HALF_OPEN:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    self._failures = 0
+                return
+            now = self.clock()
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            self._trim(now)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and self._failures >= self.failure_rate * len(self._outcomes)):
+                self._open()
+
+    def release(self, probe):
+        """请求被取消（例如对冲落败），不计入结果"""
+        if probe:
+            with self._lock:
+                self._probing -= 1
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = self.clock()
+        self._outcomes.clear()
+        self._failures = 0
+        self.opened += 1
+
+    def _trim(self, now):
+        outcomes = self._outcomes
+        while outcomes and (len(outcomes) > self.window or now - outcomes[0][0] > self.window_seconds):
+            self._failures -= outcomes.popleft()[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "calls": len(self._outcomes),
+                "failure_rate": round(self._failures / len(self._outcomes), 3) if self._outcomes else 0,
+                "opened": self.opened,
+                "short_circuited": self.short_circuited,
+                "probes": self.probes_sent
+            }
+
+
+class CircuitBreakers:
+    """
+    按端点（scheme://host:port）分别熔断
+
+    Args:
+        enabled: 关闭时所有请求照常发出
+        window / window_seconds: 统计窗口（调用数 / 秒）
+        min_calls: 窗口内至少有这么多次调用才判断失败率
+        failure_rate: 打开的失败率阈值
+        slow_ms: 超过这个耗时的成功调用算失败
+        open_seconds: 打开多久后进入半开
+        probes: 半开时同时放行的探测请求数
+    """
+    def __init__(self, enabled=DEFAULT_BREAKER_ENABLED, window=DEFAULT_BREAKER_WINDOW,
+                 window_seconds=DEFAULT_BREAKER_WINDOW_SECONDS, min_calls=DEFAULT_BREAKER_MIN_CALLS,
+                 failure_rate=DEFAULT_BREAKER_FAILURE_RATE, slow_ms=DEFAULT_BREAKER_SLOW_MS,
+                 open_seconds=DEFAULT_BREAKER_OPEN_SECONDS, probes=DEFAULT_BREAKER_PROBES, clock=time.monotonic):
+        self.enabled = enabled
+        self._settings = (window, window_seconds, min_calls, failure_rate, slow_ms, open_seconds, probes)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, url):
+        endpoint = endpoint_of(url)
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, *self._settings, clock=self.clock)
+            return breaker
+
+    def call(self, url, fn):
+        """执行 fn()（向 url 发请求），熔断中直接抛出 CircuitOpenError"""
+        if not self.enabled:
+            return fn()
+        breaker = self.get(url)
+        probe = breaker.before()
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except BaseException as e:
+            breaker.after(probe, time.perf_counter() - start, e)
+            raise
+        breaker.after(probe, time.perf_counter() - start)
+        return result
+
+    @contextlib.contextmanager
+    def guard(self, url):
+        """with 版本的 call()，用于流式请求；读取途中主动停止（GeneratorExit）按成功计"""
+        if not self.enabled:
+            yield
+            return
+        breaker = self.get(url)
+        probe = breaker.before()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            breaker.after(probe, time.perf_counter() - start, error)
+
+    async def call_async(self, url, fn):
+        """call() 的异步版本，fn 为 async () -> 结果；请求被取消不计入结果"""
+        if not self.enabled:
+            return await fn()
+        breaker = self.get(url)
+        probe = breaker.before()
+        start = time.perf_counter()
+        try:
+            result = await fn()
+        except Exception as e:
+            breaker.after(probe, time.perf_counter() - start, e)
+            raise
+        except BaseException:
+            breaker.release(probe)
+            raise
+        breaker.after(probe, time.perf_counter() - start)
+        return result
+
+    def stats(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {
+            "enabled": self.enabled,
+            "endpoints": {breaker.endpoint: breaker.stats() for breaker in breakers}
+        }
@@ -0,0 +1,387 @@
+"""
+TZ游戏多进程部署
+一个前端进程 + N 个 worker 进程（各自运行完整的 Flask 应用）：
+- 前端进程分配会话令牌，按一致性哈希把同一会话的请求固定转发到同一个 worker
+- 会话数据保存在共享的 TZ_SESSION_DB 中，worker 增减或重启时，
+  迁走的会话先写出，新的 worker 按需从存储加载
+- worker 异常退出时前端自动把它移出哈希环、重启后再加回来
+
+用法（在 backend 目录下）：
+    TZ_WORKERS=4 python app.py
+"""
+
+import atexit
+import itertools
+import multiprocessing
+import os
+import secrets
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+from hash_ring import HashRing, DEFAULT_VNODES
+
+
+DEFAULT_WORKERS = int(os.environ.get("TZ_WORKERS", "1"))
+DEFAULT_WORKER_BASE_PORT = int(os.environ.get("TZ_WORKER_BASE_PORT", "5101"))
+DEFAULT_FORWARD_TIMEOUT = 90  # 秒，需覆盖一个回合内的多次 LLM 调用
+
+# 与 tz_routes 中的名字保持一致（这里不导入 tz_routes，前端进程不需要会话注册表）
+SESSION_COOKIE = "tz_session"
+ASSIGNED_SESSION_HEADER = "X-TZ-Assign-Session"
+
+_HOP_HEADERS = frozenset((
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+    "trailers", "transfer-encoding", "upgrade", "content-length", "content-encoding", "host"
+))
+
+
+def run_worker(name, port):
+    """worker 进程入口"""
+    os.environ["TZ_WORKER_ID"] = name
+    from app import app
+    from tz_routes import warm_up_llm
+    warm_up_llm()
+    app.run(host="127.0.0.1", port=port, debug=False, use_reloader=False, threaded=True)
+
+
+class _Gate:
+    """
+    转发闸门：普通请求可并发通过；调整哈希环时先等在途请求结束，
+    期间新请求排队，避免同一会话同时在新旧两个 worker 上执行
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._paused = False
+
+    @contextmanager
+    def request(self):
+        with self._cond:
+            while self._paused:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                if not self._active:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def paused(self):
+        with self._cond:
+            while self._paused:
+                self._cond.wait()
+            self._paused = True
+            while self._active:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._paused = False
+                self._cond.notify_all()
+
+
+class _Worker:
+    """一个 worker 进程及其 keep-alive 连接"""
+    def __init__(self, name, port):
+        self.name = name
+        self.port = port
+        self.process = None
+        self.restarts = 0
+        self.forwarded = 0
+        self.http = requests.Session()
+        self.http.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=64))
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class Cluster:
+    """
+    worker 进程组 + 一致性哈希路由
+
+    Args:
+        workers: 启动时的 worker 数
+        base_port: 第一个 worker 的端口，之后依次递增
+        vnodes: 每个 worker 在哈希环上的虚拟节点数
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, base_port=DEFAULT_WORKER_BASE_PORT, vnodes=DEFAULT_VNODES):
+        self.initial_workers = max(1, workers)
+        self.base_port = base_port
+        self.ring = HashRing((), vnodes)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = {}
+        self._admin_lock = threading.RLock()
+        self._gate = _Gate()
+        self._round_robin = itertools.count()
+        self._next_index = 0
+        self._stopping = threading.Event()
+        self._supervisor = None
+
+        # 计数器
+        self.forwarded = 0
+        self.forward_errors = 0
+        self.rebalances = 0
+        self.released = 0
+        self.restarts = 0
+
+    # ---------------- 进程管理 ----------------
+
+    def start(self):
+        for _ in range(self.initial_workers):
+            self.add_worker()
+        self._supervisor = threading.Thread(target=self._supervise, name="tz-cluster-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def stop(self):
+        """让所有 worker 写出会话后退出"""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        with self._admin_lock:
+            self._set_ring(HashRing((), self.ring.vnodes))
+            for worker in self._workers.values():
+                self._terminate(worker)
+
+    def add_worker(self):
+        """启动一个新 worker 并加入哈希环，返回 worker 名"""
+        with self._admin_lock:
+            name = f"w{self._next_index}"
+            worker = _Worker(name, self.base_port + self._next_index)
+            self._next_index += 1
+            self._spawn(worker)
+            self._workers[name] = worker
+            self._set_ring(self.ring.with_node(name))
+            return name
+
+    def remove_worker(self, name=None):
+        """把 worker 移出哈希环（会话先迁走）后停止它，返回 worker 名"""
+        with self._admin_lock:
+            if name is None:
+                name = self.ring.nodes[-1] if self.ring.nodes else None
+            if name not in self._workers or len(self._workers) <= 1:
+                return None
+            self._set_ring(self.ring.without_node(name))
+            self._terminate(self._workers.pop(name))
+            return name
+
+    def _spawn(self, worker, timeout=30):
+        worker.process = self._ctx.Process(target=run_worker, args=(worker.name, worker.port),
+                                           name=f"tz-worker-{worker.name}", daemon=True)
+        # spawn 的子进程会先重新导入启动脚本（例如 app.py 会导入 tz_routes），
+        # 所以 worker 名要在启动前通过环境变量传入
+        os.environ["TZ_WORKER_ID"] = worker.name
+        try:
+            worker.process.start()
+        finally:
+            os.environ.pop("TZ_WORKER_ID", None)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not worker.process.is_alive():
+                break
+            try:
+                worker.http.get(worker.base_url + "/health", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.1)
+        raise RuntimeError(f"Worker {worker.name} did not start on port {worker.port}")
+
+    def _terminate(self, worker):
+        if worker.process is not None:
+            worker.process.terminate()
+            worker.process.join(5)
+        worker.http.close()
+
+    def _set_ring(self, ring):
+        """换上新的哈希环，并通知各 worker 写出、释放不再属于自己的会话"""
+        with self._gate.paused():
+            self.ring = ring
+            for worker in self._workers.values():
+                if not worker.alive():
+                    continue
+                try:
+                    resp = worker.http.post(worker.base_url + "/api/tz/cluster/ring", json=ring.to_dict(), timeout=30)
+                    self.released += resp.json().get("released", 0)
+                except (requests.RequestException, ValueError) as e:
+                    print(f"Cluster: failed to update ring on {worker.name}: {e}")
+        self.rebalances += 1
+
+    def _supervise(self):
+        """worker 异常退出时移出哈希环并重启"""
+        while not self._stopping.wait(0.5):
+            for worker in list(self._workers.values()):
+                if worker.alive() or self._stopping.is_set():
+                    continue
+                with self._admin_lock:
+                    if self._workers.get(worker.name) is not worker or worker.alive():
+                        continue
+                    print(f"Cluster: worker {worker.name} exited, restarting")
+                    self._set_ring(self.ring.without_node(worker.name))
+                    try:
+                        self._spawn(worker)
+                    except RuntimeError as e:
+                        print(f"Cluster: {e}")
+                        continue
+                    worker.restarts += 1
+                    self.restarts += 1
+                    self._set_ring(self.ring.with_node(worker.name))
+
+    # ---------------- 路由 ----------------
+
+    def pick(self, session_id=None):
+        """会话请求按一致性哈希选择 worker，其余请求轮询"""
+        ring = self.ring
+        name = ring.lookup(session_id) if session_id else None
+        if name is None and ring.nodes:
+            name = ring.nodes[next(self._round_robin) % len(ring.nodes)]
+        return self._workers.get(name)
+
+    def forward(self, session_id=None, extra_headers=None):
+        """把当前 Flask 请求转发给 worker"""
+        with self._gate.request():
+            worker = self.pick(session_id)
+            if worker is None:
+                return _unavailable()
+
+            headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS}
+            if extra_headers:
+                headers.update(extra_headers)
+            url = worker.base_url + request.path
+            if request.query_string:
+                url += "?" + request.query_string.decode("latin-1")
+            try:
+                resp = worker.http.request(request.method, url, headers=headers, data=request.get_data(),
+                                           timeout=DEFAULT_FORWARD_TIMEOUT, allow_redirects=False, stream=True)
+            except requests.RequestException as e:
+                self.forward_errors += 1
+                print(f"Cluster: forward to {worker.name} failed: {e}")
+                return _unavailable()
+
+            self.forwarded += 1
+            worker.forwarded += 1
+            out_headers = [(k, v) for k, v in resp.raw.headers.items() if k.lower() not in _HOP_HEADERS]
+            if resp.headers.get("Content-Type", "").startswith("text/event-stream"):
+                # SSE 逐块转发，不等回合结束；worker 上的回合锁保证调整哈希环时会话不会同时在两边执行
+                out = Response(stream_with_context(resp.iter_content(chunk_size=None)),
+                               status=resp.status_code, headers=out_headers)
+                out.call_on_close(resp.close)
+                return out
+            return Response(resp.content, status=resp.status_code, headers=out_headers)
+
+    def stats(self):
+        return {
+            "ring": self.ring.to_dict(),
+            "workers": [
+                {
+                    "name": w.name,
+                    "port": w.port,
+                    "alive": w.alive(),
+                    "pid": w.process.pid if w.process else None,
+                    "forwarded": w.forwarded,
+                    "restarts": w.restarts
+                }
+                for w in self._workers.values()
+            ],
+            "forwarded": self.forwarded,
+            "forward_errors": self.forward_errors,
+            "rebalances": self.rebalances,
+            "released": self.released,
+            "restarts": self.restarts
+        }
+
+
+def _unavailable():
+    return jsonify({
+        "success": False,
+        "error": "Game server is restarting, please retry"
+    }), 503
+
+
+def _request_session_id():
+    """与 tz_routes._get_session_id 的优先级一致"""
+    session_id = request.headers.get("X-TZ-Session")
+    if not session_id:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            session_id = data.get("sessionId")
+    if not session_id:
+        session_id = request.args.get("sessionId")
+    if not session_id:
+        session_id = request.cookies.get(SESSION_COOKIE)
+    return session_id
+
+
+def create_front_app(cluster):
+    """前端进程的 Flask 应用：只做路由转发，不处理游戏逻辑"""
+    front = Flask(__name__)
+
+    @front.route('/api/tz/start', methods=['POST'])
+    def front_start():
+        # 新会话的令牌在这里分配，保证第一个回合就落在最终负责的 worker 上
+        session_id = secrets.token_urlsafe(16)
+        return cluster.forward(session_id, {ASSIGNED_SESSION_HEADER: session_id})
+
+    @front.route('/api/tz/cluster', methods=['GET'])
+    def front_cluster_stats():
+        return jsonify({"success": True, **cluster.stats()})
+
+    @front.route('/api/tz/cluster/workers', methods=['POST'])
+    def front_scale():
+        """增减 worker（只允许本机调用）"""
+        if request.remote_addr not in ("127.0.0.1", "::1"):
+            return jsonify({"success": False, "error": "Forbidden"}), 403
+        data = request.get_json(silent=True) or {}
+        if data.get("action") == "add":
+            name = cluster.add_worker()
+        elif data.get("action") == "remove":
+            name = cluster.remove_worker(data.get("worker"))
+        else:
+            return jsonify({"success": False, "error": "action must be add or remove"}), 400
+        return jsonify({"success": name is not None, "worker": name, **cluster.stats()})
+
+    @front.route('/api/tz/cluster/<path:path>', methods=['GET', 'POST'])
+    def front_cluster_internal(path):
+        # worker 的内部接口不对外暴露
+        return jsonify({"success": False, "error": "Not found"}), 404
+
+    @front.route('/api/tz/<path:path>', methods=['GET', 'POST'])
+    def front_game(path):
+        return cluster.forward(_request_session_id())
+
+    @front.route('/health', methods=['GET'])
+    def front_health():
+        return jsonify({"status": "ok", "workers": len(cluster.ring)})
+
+    @front.route('/', defaults={'path': ''})
+    @front.route('/<path:path>')
+    def front_static(path):
+        return cluster.forward()
+
+    return front
+
+
+def serve_cluster(host="0.0.0.0", port=5001, workers=DEFAULT_WORKERS):
+    """启动 worker 进程组并在当前进程运行前端"""
+    if not os.environ.get("TZ_SESSION_DB"):
+        # 会话需要在 worker 之间迁移，必须使用共享存储
+        os.environ["TZ_SESSION_DB"] = os.path.join(tempfile.gettempdir(), "tz_cluster_sessions.db")
+        print(f"TZ_SESSION_DB not set, using {os.environ['TZ_SESSION_DB']}")
+
+    cluster = Cluster(workers)
+    cluster.start()
+    atexit.register(cluster.stop)
+    print(f"Cluster: {len(cluster.ring)} workers on ports {cluster.base_port}-{cluster.base_port + workers - 1}")
+    create_front_app(cluster).run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+    return cluster
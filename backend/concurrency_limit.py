@@ -0,0 +1,392 @@
+"""
+LLM 请求自适应并发限制（AIMD）
+没有限制时，突发流量里同时发出的请求远超服务商的处理能力，服务商返回 429，玩家只看到降级台词。
+每个（端点, API 密钥）一个限流器，按服务商的反馈调整允许同时进行的请求数：
+
+- 成功且限流器处于饱和状态（有排队，或并发已到上限）时加大上限：
+  慢启动阶段每次成功 +1（每个往返翻倍），第一次被限流后改为每次 +1/上限（每个往返约 +1）
+- 收到 429 / 503 时上限乘以 backoff；在上次下调之前发出的请求随后返回的 429 不再重复下调，
+  避免一次过载把上限连续砍到底，吞吐稳定在服务商的实际容量附近而不是来回震荡
+- 响应带 Retry-After 时，在那之前这个限流器不再发出新请求；被限流的请求在等待时间允许时自动重试
+- 超出上限的请求按到达顺序排队，队列有上限（max_queue），等待有时限（max_wait_ms），
+  超出时抛出 LimiterRejected（带建议的重试秒数），由路由层返回 503 + Retry-After
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from llm_client import endpoint_of
+
+DEFAULT_LIMIT_ENABLED = os.environ.get("TZ_LLM_LIMIT", "1").lower() not in ("0", "false", "no")
+DEFAULT_LIMIT_INITIAL = int(os.environ.get("TZ_LLM_LIMIT_INITIAL", "32"))
+DEFAULT_LIMIT_MIN = int(os.environ.get("TZ_LLM_LIMIT_MIN", "1"))
+DEFAULT_LIMIT_MAX = int(os.environ.get("TZ_LLM_LIMIT_MAX", "512"))
+DEFAULT_LIMIT_BACKOFF = float(os.environ.get("TZ_LLM_LIMIT_BACKOFF", "0.75"))
+DEFAULT_LIMIT_QUEUE = int(os.environ.get("TZ_LLM_LIMIT_QUEUE", "256"))
+DEFAULT_LIMIT_MAX_WAIT_MS = float(os.environ.get("TZ_LLM_LIMIT_MAX_WAIT_MS", "10000"))
+DEFAULT_LIMIT_RETRIES = int(os.environ.get("TZ_LLM_LIMIT_RETRIES", "1"))
+
+OVERLOAD_STATUSES = (429, 503)
+
+
+class LimiterRejected(Exception):
+    """等待队列已满或等待超时，请求没有发出；retry_after 为建议的重试秒数"""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _status_and_headers(error):
+    """requests.HTTPError / aiohttp.ClientResponseError -> (状态码, 响应头)"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    return status, headers
+
+
+def is_overload(error):
+    """异常是否为服务商的过载信号（429 / 503）"""
+    return error is not None and _status_and_headers(error)[0] in OVERLOAD_STATUSES
+
+
+def retry_after_of(error):
+    """异常响应中的 Retry-After（秒，支持秒数和 HTTP 日期两种写法），没有时为 None"""
+    value = _status_and_headers(error)[1].get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Waiter:
+    """排队中的请求；线程版用 Event 唤醒，异步版用所在事件循环的 Future 唤醒"""
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.granted = False
+        self.event = event
+        self.loop = loop
+        self.future = future
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_set_done, self.future)
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveLimiter:
+    """一个（端点, API 密钥）的限流器（参数见 ConcurrencyLimits）"""
+    def __init__(self, name, initial, min_limit, max_limit, backoff, max_queue, max_wait_ms, retries,
+                 clock=time.monotonic):
+        self.name = name
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.max_queue = max_queue
+        self.max_wait = max_wait_ms / 1000
+        self.retries = retries
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self.in_flight = 0
+        self._slow_start = True
+        self._decreased_at = float("-inf")
+        self._paused_until = 0.0
+        self._latency = None      # 成功请求耗时的指数滑动平均（秒）
+
+        self.acquired = 0
+        self.queued = 0
+        self.peak_queue = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.retried = 0
+
+    # ---- 获取 / 释放 ----
+
+    def _try_start(self):
+        """（持锁）有空位且没有更早排队的请求时直接占用一个并发名额"""
+        if self._queue or self.in_flight >= int(self.limit) or self.clock() < self._paused_until:
+            return False
+        self.in_flight += 1
+        self.acquired += 1
+        return True
+
+    def _dispatch(self):
+        """（持锁）按顺序把空出来的名额交给排队的请求"""
+        if self.clock() < self._paused_until:
+            return
+        while self._queue and self.in_flight < int(self.limit):
+            waiter = self._queue.popleft()
+            waiter.granted = True
+            self.in_flight += 1
+            self.acquired += 1
+            waiter.wake()
+
+    def _enqueue(self, waiter):
+        """（持锁）排队；队列已满时抛出 LimiterRejected"""
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise LimiterRejected(f"LLM endpoint {self.name} is saturated (queue full)", self._retry_after())
+        self._queue.append(waiter)
+        self.queued += 1
+        self.peak_queue = max(self.peak_queue, len(self._queue))
+
+    def _wait_timeout(self, deadline):
+        """下一次醒来检查的等待时长：限流暂停期间到暂停结束为止，否则到截止时间为止"""
+        now = self.clock()
+        timeout = deadline - now
+        if self._paused_until > now:
+            timeout = min(timeout, self._paused_until - now)
+        return max(0.0, timeout)
+
+    def _check(self, waiter, deadline):
+        """（持锁）醒来后：已拿到名额返回 True；超时则出队并抛出 LimiterRejected"""
+        if not waiter.granted:
+            self._dispatch()
+        if waiter.granted:
+            return True
+        if self.clock() >= deadline:
+            self._queue.remove(waiter)
+            self.rejected += 1
+            raise LimiterRejected(f"LLM endpoint {self.name} is saturated (wait timed out)", self._retry_after())
+        return False
+
+    def acquire(self):
+        """占用一个并发名额（必要时排队等待），返回占用时刻"""
+        with self._lock:
+            if self._try_start():
+                return self.clock()
+            waiter = _Waiter(event=threading.Event())
+            self._enqueue(waiter)
+            deadline = self.clock() + self.max_wait
+        while True:
+            waiter.event.wait(self._wait_timeout(deadline))
+            with self._lock:
+                if self._check(waiter, deadline):
+                    return self.clock()
+
+    async def acquire_async(self):
+        """acquire() 的异步版本"""
+        with self._lock:
+            if self._try_start():
+                return self.clock()
+            loop = asyncio.get_running_loop()
+            waiter = _Waiter(loop=loop, future=loop.create_future())
+            self._enqueue(waiter)
+            deadline = self.clock() + self.max_wait
+        try:
+            while True:
+                await asyncio.wait([waiter.future], timeout=self._wait_timeout(deadline))
+                with self._lock:
+                    if self._check(waiter, deadline):
+                        return self.clock()
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self.in_flight -= 1
+                    self._dispatch()
+                elif waiter in self._queue:
+                    self._queue.remove(waiter)
+            raise
+
+    def release(self, started, error=None):
+        """
+        归还名额并按结果调整上限
+
+        Args:
+            started: acquire() 的返回值
+            error: 请求抛出的异常；过载信号下调上限，其他异常（熔断、超时等）不调整
+        """
+        with self._lock:
+            saturated = bool(self._queue) or self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            now = self.clock()
+            if is_overload(error):
+                self.throttled += 1
+                retry_after = retry_after_of(error)
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+                if started >= self._decreased_at:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._slow_start = False
+                    self._decreased_at = now
+                    self.decreases += 1
+            elif error is None:
+                seconds = now - started
+                self._latency = seconds if self._latency is None else self._latency * 0.9 + seconds * 0.1
+                if saturated:
+                    self.limit = min(self.max_limit, self.limit + (1 if self._slow_start else 1 / self.limit))
+            self._dispatch()
+
+    def _retry_after(self):
+        """（持锁）建议客户端多少秒后重试"""
+        now = self.clock()
+        if self._paused_until > now:
+            return math.ceil(self._paused_until - now)
+        latency = self._latency or 1.0
+        return max(1, math.ceil(latency * (len(self._queue) + 1) / max(1, int(self.limit))))
+
+    def retry_after(self):
+        """限流暂停中或等待队列已满时返回建议的重试秒数，否则 None"""
+        with self._lock:
+            if self._paused_until > self.clock() or len(self._queue) >= self.max_queue:
+                return self._retry_after()
+            return None
+
+    # ---- 包装调用 ----
+
+    def _should_retry(self, attempt, error):
+        if attempt >= self.retries or not is_overload(error):
+            return False
+        retry_after = retry_after_of(error)
+        return retry_after is None or retry_after <= self.max_wait
+
+    def call(self, fn):
+        """在限流下执行 fn()，被服务商限流时重试（最多 retries 次）"""
+        attempt = 0
+        while True:
+            started = self.acquire()
+            try:
+                result = fn()
+            except BaseException as e:
+                self.release(started, e)
+                if not self._should_retry(attempt, e):
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.retried += 1
+                continue
+            self.release(started)
+            return result
+
+    async def call_async(self, fn):
+        """call() 的异步版本，fn 为 async () -> 结果"""
+        attempt = 0
+        while True:
+            started = await self.acquire_async()
+            try:
+                result = await fn()
+            except BaseException as e:
+                self.release(started, e)
+                if not self._should_retry(attempt, e):
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.retried += 1
+                continue
+            self.release(started)
+            return result
+
+    def stats(self):
+        with self._lock:
+            paused = max(0.0, self._paused_until - self.clock())
+            return {
+                "limit": round(self.limit, 1),
+                "in_flight": self.in_flight,
+                "queue_depth": len(self._queue),
+                "peak_queue": self.peak_queue,
+                "slow_start": self._slow_start,
+                "paused_ms": round(paused * 1000),
+                "avg_ms": round(self._latency * 1000, 1) if self._latency is not None else 0,
+                "acquired": self.acquired,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+                "decreases": self.decreases,
+                "retried": self.retried
+            }
+
+
+class ConcurrencyLimits:
+    """
+    按（端点, API 密钥）分别限流；统计里密钥只显示哈希前缀
+
+    Args:
+        enabled: 关闭时请求照常发出
+        initial / min_limit / max_limit: 初始并发上限及其范围
+        backoff: 收到 429 / 503 时上限乘以这个系数
+        max_queue: 等待队列长度上限
+        max_wait_ms: 排队等待的最长时间
+        retries: 被限流的请求最多重试次数（Retry-After 超过 max_wait_ms 时不重试）
+    """
+    def __init__(self, enabled=DEFAULT_LIMIT_ENABLED, initial=DEFAULT_LIMIT_INITIAL, min_limit=DEFAULT_LIMIT_MIN,
+                 max_limit=DEFAULT_LIMIT_MAX, backoff=DEFAULT_LIMIT_BACKOFF, max_queue=DEFAULT_LIMIT_QUEUE,
+                 max_wait_ms=DEFAULT_LIMIT_MAX_WAIT_MS, retries=DEFAULT_LIMIT_RETRIES, clock=time.monotonic):
+        self.enabled = enabled
+        self._settings = (initial, min_limit, max_limit, backoff, max_queue, max_wait_ms, retries)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def get(self, url, api_key):
+        fingerprint = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:8]
+        name = f"{endpoint_of(url)} key:{fingerprint}"
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                limiter = self._limiters[name] = AdaptiveLimiter(name, *self._settings, clock=self.clock)
+            return limiter
+
+    def call(self, url, api_key, fn):
+        """在 (url, api_key) 的限流下执行 fn()"""
+        if not self.enabled:
+            return fn()
+        return self.get(url, api_key).call(fn)
+
+    async def call_async(self, url, api_key, fn):
+        """call() 的异步版本，fn 为 async () -> 结果"""
+        if not self.enabled:
+            return await fn()
+        return await self.get(url, api_key).call_async(fn)
+
+    @contextlib.contextmanager
+    def guard(self, url, api_key):
+        """with 版本的 call()，用于流式请求（不重试）；读取途中主动停止（GeneratorExit）按成功计"""
+        if not self.enabled:
+            yield
+            return
+        limiter = self.get(url, api_key)
+        started = limiter.acquire()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            limiter.release(started, error)
+
+    def retry_after(self, url, api_key):
+        """(url, api_key) 正在被限流时返回建议的重试秒数（用于回合开始前的准入判断），否则 None"""
+        if not self.enabled:
+            return None
+        return self.get(url, api_key).retry_after()
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {
+            "enabled": self.enabled,
+            "limiters": {limiter.name: limiter.stats() for limiter in limiters}
+        }
@@ -3,6 +3,10 @@ TZ - The Lost War Robot Game Logic
 游戏逻辑和验证函数
 """
 
+from array import array
+from enum import IntEnum
+from types import MappingProxyType
+
 # 游戏常量
 EXIT_WORDS = {"exit", "bye", "goodbye", "quit", "q"}
 
@@ -55,61 +59,348 @@ DEFAULT_EMOTION = "neutral"
 DEFAULT_INTENSITY = 0.4
 
 
+# 任务名称（顺序即 attempts 数组下标）
+TASK_NAMES = ("power", "amplifier", "decoder", "alien_decode", "combat_logic")
+TASK_INDEX = {name: i for i, name in enumerate(TASK_NAMES)}
+
+# 各任务最大尝试次数 - 所有会话共享的只读表
+MAX_ATTEMPTS = MappingProxyType({
+    "power": 3,
+    "amplifier": 10,
+    "decoder": 3,
+    "alien_decode": 3,
+    "combat_logic": 3
+})
+
+_EMPTY_FRAGMENTS = MappingProxyType({})
+
+
+class Stage(IntEnum):
+    """游戏阶段"""
+    INIT = 0
+    FIRST_CONTACT = 1
+    ASK_IDENT = 2
+    IDENTIFY_NAME = 3
+    CONSENT = 4
+    CHAPTER2_INTRO = 5
+    POWER_TASK_OFFER = 6
+    POWER_TASK_CONFIRM_REJECT = 7
+    POWER = 8
+    AMPLIFIER_TASK_OFFER = 9
+    AMPLIFIER_TASK_CONFIRM_REJECT = 10
+    AMPLIFIER = 11
+    DECODER_TASK_OFFER = 12
+    DECODER_TASK_CONFIRM_REJECT = 13
+    DECODER = 14
+    ALIEN_DECODE_TASK_OFFER = 15
+    ALIEN_DECODE = 16
+    COMBAT_LOGIC_TASK_OFFER = 17
+    COMBAT_LOGIC = 18
+    MEMORY_CHOICE = 19   # 带目标：memory_choice_<target>
+    MEMORY = 20          # 带目标：memory_<target>
+    FINAL_CHOICE = 21
+    ENDING = 22
+    ENDED = 23
+
+
+class StageTarget(IntEnum):
+    """记忆阶段结束后要进入的下一个任务"""
+    UNKNOWN = 0
+    AMPLIFIER = 1
+    DECODER = 2
+    ALIEN_DECODE = 3
+    COMBAT_LOGIC = 4
+    FINAL = 5
+
+    @property
+    def key(self):
+        """线路格式中的目标名，例如 alien_decode"""
+        return self.name.lower()
+
+    @classmethod
+    def from_key(cls, key):
+        return _TARGET_BY_KEY.get(key, cls.UNKNOWN)
+
+
+_TARGET_BY_KEY = {target.key: target for target in StageTarget}
+
+# (阶段, 目标) <-> 线路格式的阶段字符串，启动时一次性生成，运行时不做字符串解析
+_STAGE_NAMES = {}
+for _stage in Stage:
+    if _stage in (Stage.MEMORY_CHOICE, Stage.MEMORY):
+        for _target in StageTarget:
+            _STAGE_NAMES[(_stage, _target)] = f"{_stage.name.lower()}_{_target.key}"
+    else:
+        _STAGE_NAMES[(_stage, StageTarget.UNKNOWN)] = _stage.name.lower()
+_STAGE_BY_NAME = {name: key for key, name in _STAGE_NAMES.items()}
+
+
+def stage_name(stage, target=StageTarget.UNKNOWN):
+    """(阶段, 目标) -> 线路格式的阶段字符串"""
+    return _STAGE_NAMES[(Stage(stage), StageTarget(target))]
+
+
+# to_dict() 中的字段（顺序即字段下标）
+STATE_FIELDS = (
+    "player_name", "stage", "tasks_failed", "modules_repaired", "current_task",
+    "attempts", "max_attempts", "correct_frequency", "communication_fixed", "deviation",
+    "final_choice", "memory_fragments", "persona", "emotion", "emotion_intensity"
+)
+_FIELD_INDEX = {name: i for i, name in enumerate(STATE_FIELDS)}
+
+# 内部属性 -> to_dict 字段下标（用于脏标记）
+_SLOT_FIELDS = {name: i for name, i in _FIELD_INDEX.items()}
+_SLOT_FIELDS.update({
+    "_stage": _FIELD_INDEX["stage"],
+    "_stage_target": _FIELD_INDEX["stage"],
+    "_attempts": _FIELD_INDEX["attempts"],
+    "_memory_fragments": _FIELD_INDEX["memory_fragments"],
+})
+_ATTEMPTS_FIELD = _FIELD_INDEX["attempts"]
+_MISSING = object()
+
+
+class Attempts:
+    """attempts 的字典式视图，底层是 GameState 中的定长 bytearray"""
+    __slots__ = ("_state",)
+
+    def __init__(self, state):
+        self._state = state
+
+    def __getitem__(self, task):
+        return self._state._attempts[TASK_INDEX[task]]
+
+    def __setitem__(self, task, value):
+        self._state._attempts[TASK_INDEX[task]] = min(value, 255)
+        self._state._touch(_ATTEMPTS_FIELD)
+
+    def __iter__(self):
+        return iter(TASK_NAMES)
+
+    def __len__(self):
+        return len(TASK_NAMES)
+
+    def items(self):
+        return zip(TASK_NAMES, self._state._attempts)
+
+    def to_dict(self):
+        return dict(zip(TASK_NAMES, self._state._attempts))
+
+
 class GameState:
-    """游戏状态类"""
+    """
+    游戏状态类 - 使用 __slots__ 的紧凑表示
+    
+    - attempts 存放在 5 字节的 bytearray 中
+    - max_attempts 为所有会话共享的只读表
+    - 阶段用 Stage 枚举 + StageTarget 表示，stage 属性保持原有字符串格式
+    - 每次修改都会递增 version，并记录各字段最后修改时的版本，
+      to_dict() 按版本缓存，to_delta() 只返回客户端版本之后变化的字段
+    """
+    __slots__ = (
+        "player_name", "_stage", "_stage_target", "tasks_failed", "modules_repaired",
+        "current_task", "_attempts", "correct_frequency", "communication_fixed",
+        "deviation", "final_choice", "_memory_fragments", "persona", "emotion",
+        "emotion_intensity", "turn", "version", "_field_versions", "_dict_cache"
+    )
+
+    max_attempts = MAX_ATTEMPTS
+
     def __init__(self):
+        object.__setattr__(self, "version", 0)
+        object.__setattr__(self, "_field_versions", array("I", bytes(4 * len(STATE_FIELDS))))
+        object.__setattr__(self, "_dict_cache", None)
+
         self.player_name = None
-        self.stage = "init"
+        self._stage = Stage.INIT
+        self._stage_target = StageTarget.UNKNOWN
         self.tasks_failed = 0
-        self.modules_repaired = []
+        self.modules_repaired = ()
         self.current_task = None
-        self.attempts = {
-            "power": 0,
-            "amplifier": 0,
-            "decoder": 0,
-            "alien_decode": 0,
-            "combat_logic": 0
-        }
-        self.max_attempts = {
-            "power": 3,
-            "amplifier": 10,
-            "decoder": 3,
-            "alien_decode": 3,
-            "combat_logic": 3
-        }
+        self._attempts = bytearray(len(TASK_NAMES))
         self.correct_frequency = 3420
         self.communication_fixed = False
         self.deviation = 0.0  # 偏差值
         self.final_choice = None
-        self.hint_shown_stages = set()
-        self.memory_fragments = {}
+        self._memory_fragments = _EMPTY_FRAGMENTS
         self.persona = "Calm_Conscientious"
         self.emotion = DEFAULT_EMOTION
         self.emotion_intensity = DEFAULT_INTENSITY
+        self.turn = 0  # 已完成的回合数（不属于 to_dict 字段）
     
+    def __setattr__(self, name, value):
+        field = _SLOT_FIELDS.get(name)
+        if field is not None and getattr(self, name, _MISSING) == value:
+            # 值没有变化（例如每回合重复设置的 persona）不算修改
+            return
+        object.__setattr__(self, name, value)
+        if field is not None:
+            self._touch(field)
+
+    def _touch(self, field):
+        """标记字段已修改"""
+        version = self.version + 1
+        object.__setattr__(self, "version", version)
+        self._field_versions[field] = version
+        object.__setattr__(self, "_dict_cache", None)
+
+    def _touch_all(self, version):
+        """把所有字段标记为在 version 时修改"""
+        object.__setattr__(self, "version", version)
+        for i in range(len(STATE_FIELDS)):
+            self._field_versions[i] = version
+        object.__setattr__(self, "_dict_cache", None)
+
     def reset(self):
-        """重置游戏状态"""
+        """重置游戏状态（版本号继续递增）"""
+        version = self.version
         self.__init__()
+        self._touch_all(version + 1)
+
+    @property
+    def stage(self):
+        """线路格式的阶段字符串，例如 memory_choice_decoder"""
+        return _STAGE_NAMES[(self._stage, self._stage_target)]
+
+    @stage.setter
+    def stage(self, name):
+        try:
+            self._stage, self._stage_target = _STAGE_BY_NAME[name]
+        except KeyError:
+            raise ValueError(f"Unknown stage: {name}")
+
+    @property
+    def stage_kind(self):
+        return self._stage
+
+    @property
+    def stage_target(self):
+        return self._stage_target
+
+    def set_stage(self, stage, target=StageTarget.UNKNOWN):
+        """设置阶段（记忆阶段需带目标）"""
+        self._stage = stage
+        self._stage_target = target if stage in (Stage.MEMORY_CHOICE, Stage.MEMORY) else StageTarget.UNKNOWN
+
+    @property
+    def attempts(self):
+        return Attempts(self)
+
+    def add_repaired_module(self, module_name):
+        """记录已修复（或按规则计入）的模块"""
+        self.modules_repaired = self.modules_repaired + (module_name,)
+
+    @property
+    def memory_fragments(self):
+        """已生成的记忆碎片（只读视图，写入请用 remember_fragment）"""
+        return self._memory_fragments
+
+    def remember_fragment(self, key, text):
+        """缓存一段记忆碎片"""
+        fragments = dict(self._memory_fragments)
+        fragments[key] = text
+        self._memory_fragments = MappingProxyType(fragments)
     
+    def fork(self):
+        """
+        复制出一个独立演化的分支（例如从最终选择重新选一个结局），开销与游戏进度无关
+
+        字符串、元组、to_dict 缓存和记忆碎片映射（写入时整体替换，从不原地修改）
+        都与父状态共享，只复制 5 字节的 attempts 和字段版本表。
+        """
+        child = object.__new__(type(self))
+        for name in self.__slots__:
+            object.__setattr__(child, name, getattr(self, name))
+        object.__setattr__(child, "_attempts", bytearray(self._attempts))
+        object.__setattr__(child, "_field_versions", array("I", self._field_versions))
+        return child
+
     def to_dict(self):
-        """转换为字典"""
-        return {
+        """转换为字典（按版本缓存，调用方不要修改返回值）"""
+        cached = self._dict_cache
+        if cached is not None:
+            return cached
+        cached = {
             "player_name": self.player_name,
             "stage": self.stage,
             "tasks_failed": self.tasks_failed,
-            "modules_repaired": self.modules_repaired,
+            "modules_repaired": list(self.modules_repaired),
             "current_task": self.current_task,
-            "attempts": self.attempts,
-            "max_attempts": self.max_attempts,
+            "attempts": dict(zip(TASK_NAMES, self._attempts)),
+            "max_attempts": dict(MAX_ATTEMPTS),
             "correct_frequency": self.correct_frequency,
             "communication_fixed": self.communication_fixed,
             "deviation": self.deviation,
             "final_choice": self.final_choice,
-            "memory_fragments": self.memory_fragments,
+            "memory_fragments": dict(self._memory_fragments),
             "persona": self.persona,
             "emotion": self.emotion,
             "emotion_intensity": self.emotion_intensity
         }
+        object.__setattr__(self, "_dict_cache", cached)
+        return cached
+
+    def to_delta(self, since_version):
+        """
+        返回 since_version 之后变化的字段
+        
+        客户端版本无效或比服务器新（例如服务器重启后恢复到较早的版本）时返回完整状态。
+        
+        Returns:
+            (dict, bool): (字段, 是否为增量)
+        """
+        full = self.to_dict()
+        if not isinstance(since_version, int) or since_version < 0 or since_version > self.version:
+            return full, False
+        versions = self._field_versions
+        return {name: full[name] for i, name in enumerate(STATE_FIELDS) if versions[i] > since_version}, True
+
+    def apply_fields(self, data):
+        """把 to_dict() / to_delta() 格式的字段写回状态（只处理出现的字段）"""
+        if "player_name" in data:
+            self.player_name = data["player_name"]
+        if "stage" in data:
+            self.stage = data["stage"]
+        if "tasks_failed" in data:
+            self.tasks_failed = data["tasks_failed"]
+        if "modules_repaired" in data:
+            self.modules_repaired = tuple(data["modules_repaired"])
+        if "current_task" in data:
+            self.current_task = data["current_task"]
+        if "attempts" in data:
+            for task, count in data["attempts"].items():
+                if task in TASK_INDEX:
+                    self.attempts[task] = count
+        if "correct_frequency" in data:
+            self.correct_frequency = data["correct_frequency"]
+        if "communication_fixed" in data:
+            self.communication_fixed = data["communication_fixed"]
+        if "deviation" in data:
+            self.deviation = data["deviation"]
+        if "final_choice" in data:
+            self.final_choice = data["final_choice"]
+        if "memory_fragments" in data:
+            self._memory_fragments = MappingProxyType(dict(data["memory_fragments"])) if data["memory_fragments"] else _EMPTY_FRAGMENTS
+        if "persona" in data:
+            self.persona = data["persona"]
+        if "emotion" in data:
+            self.emotion = data["emotion"]
+        if "emotion_intensity" in data:
+            self.emotion_intensity = data["emotion_intensity"]
+
+    @classmethod
+    def from_dict(cls, data, version=0):
+        """
+        从 to_dict() 的结果恢复状态（max_attempts 为共享常量，忽略）
+        
+        Args:
+            data: to_dict() 的结果
+            version: 保存时的状态版本，恢复后所有字段都标记为该版本
+        """
+        state = cls()
+        state.apply_fields(data)
+        state._touch_all(version or state.version)
+        return state
 
 
 # ==================== 验证函数 ====================
@@ -253,3 +544,29 @@ def validate_combat_logic(user_input):
     # Return first error message
     error_msg = errors[0] if errors else "Sequence incorrect. Follow: Identify → Analyze → Judge → Prepare → Execute."
     return False, sequence, error_msg, 1, "Combat logic confused"
+
+
+# ==================== 预生成用的输入 ====================
+
+# 每个阶段玩家下一句最可能的输入，按可能性从高到低（谜题先正确答案，再错误答案；选项全部列出）。
+# 错误答案只有在最后一次尝试时才会触发 LLM 回复，其他时候这个分支不产生请求。
+LIKELY_INPUTS = {
+    Stage.ASK_IDENT: ["yes"],
+    Stage.CONSENT: ["yes"],
+    Stage.CHAPTER2_INTRO: ["yes"],
+    Stage.POWER: ["A-B-C-D", "?"],
+    Stage.DECODER: ["HELLO WORLD", "?"],
+    Stage.ALIEN_DECODE: ["A", "B", "C"],
+    Stage.COMBAT_LOGIC_TASK_OFFER: ["yes", "no"],
+    Stage.COMBAT_LOGIC: ["3,4,5,1,2", "1,2,3,4,5"],
+    Stage.MEMORY_CHOICE: ["A", "B"],
+    Stage.MEMORY: ["A", "B", "C"],
+    Stage.FINAL_CHOICE: ["A", "B", "C", "D"],
+}
+
+
+def likely_inputs(state):
+    """state 所在阶段玩家下一句最可能的输入"""
+    if state.stage_kind is Stage.AMPLIFIER:
+        return [str(state.correct_frequency), "1000"]
+    return LIKELY_INPUTS.get(state.stage_kind, [])
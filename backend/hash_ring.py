@@ -0,0 +1,54 @@
+"""
+一致性哈希环
+多进程部署时把会话令牌映射到 worker：每个 worker 在环上放若干虚拟节点，
+增加或移除一个 worker 只会迁移约 1/N 的会话。
+前端进程和各 worker 用同一份成员列表构造环，得到的映射完全一致。
+"""
+
+import hashlib
+from bisect import bisect
+
+
+DEFAULT_VNODES = 128
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    一致性哈希环（构造后只读，成员变化时创建新环）
+
+    Args:
+        nodes: 节点名列表
+        vnodes: 每个节点的虚拟节点数
+    """
+    def __init__(self, nodes=(), vnodes=DEFAULT_VNODES):
+        self.nodes = tuple(sorted(set(nodes)))
+        self.vnodes = vnodes
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def lookup(self, key):
+        """返回 key 所属的节点，环为空时返回 None"""
+        if not self._keys:
+            return None
+        index = bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+    def with_node(self, node):
+        return HashRing(self.nodes + (node,), self.vnodes)
+
+    def without_node(self, node):
+        return HashRing([n for n in self.nodes if n != node], self.vnodes)
+
+    def to_dict(self):
+        return {"nodes": list(self.nodes), "vnodes": self.vnodes}
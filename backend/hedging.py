@@ -0,0 +1,229 @@
+"""
+LLM 请求对冲（hedging）
+一个服务商的长尾延迟（p99）决定了最慢的那批回合。配置了备用端点（TZ_LLM_HEDGE_URL）后，
+主端点超过“最近调用延迟的某个分位数”还没有返回时，同样的请求再发给备用端点，
+先拿到的有效结果胜出，另一个取消。
+
+- 阈值按主端点分别统计：最近 window 次成功调用延迟的 percentile 分位数（默认 p95），
+  样本不足时使用 initial_ms；阈值不低于 min_ms
+- 主端点在阈值之前就失败时立即改发备用端点
+- 线程版（call）的主请求在对冲线程池里执行，落败的请求结果被丢弃（已发出的同步请求无法中途取消）；
+  异步版（call_async）直接取消落败的任务
+- 备用端点与主端点不同时必须配置 TZ_LLM_HEDGE_KEY：玩家或密钥池的密钥只发给它所属的端点，
+  没有备用密钥的调用不对冲（计入 no_key）
+- 统计对冲率（hedge_rate = 发出备用请求的调用 / 全部调用），让额外的花费一目了然
+"""
+
+import asyncio
+import bisect
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from llm_client import endpoint_of
+
+DEFAULT_HEDGE_URL = os.environ.get("TZ_LLM_HEDGE_URL", "")               # 备用端点，空表示不对冲
+DEFAULT_HEDGE_MODEL = os.environ.get("TZ_LLM_HEDGE_MODEL", "")           # 备用端点的模型，空表示与主端点相同
+DEFAULT_HEDGE_KEY = os.environ.get("TZ_LLM_HEDGE_KEY", "")               # 备用端点的密钥；为空时只对同一端点的调用对冲（沿用其密钥）
+DEFAULT_HEDGE_PERCENTILE = float(os.environ.get("TZ_LLM_HEDGE_PERCENTILE", "95"))
+DEFAULT_HEDGE_WINDOW = int(os.environ.get("TZ_LLM_HEDGE_WINDOW", "200"))
+DEFAULT_HEDGE_INITIAL_MS = float(os.environ.get("TZ_LLM_HEDGE_INITIAL_MS", "2000"))
+DEFAULT_HEDGE_MIN_MS = float(os.environ.get("TZ_LLM_HEDGE_MIN_MS", "50"))
+DEFAULT_HEDGE_WORKERS = int(os.environ.get("TZ_LLM_HEDGE_WORKERS", "64"))
+MIN_SAMPLES = 20
+
+
+class LatencyWindow:
+    """最近 size 次调用的延迟（秒），按需求分位数"""
+    def __init__(self, size):
+        self._recent = deque(maxlen=size)
+        self._sorted = []
+
+    def add(self, seconds):
+        if len(self._recent) == self._recent.maxlen:
+            old = self._recent[0]
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        self._recent.append(seconds)
+        bisect.insort(self._sorted, seconds)
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def percentile(self, p):
+        if not self._sorted:
+            return None
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * p / 100))
+        return self._sorted[index]
+
+
+class Hedger:
+    """
+    请求对冲（所有会话共用一个实例，线程版和异步版共用阈值和统计）
+
+    Args:
+        url / model / api_key: 备用端点及其模型、密钥
+        percentile: 触发对冲的延迟分位数
+        window: 每个主端点保留的延迟样本数
+        initial_ms: 样本不足 MIN_SAMPLES 时的阈值
+        min_ms: 阈值下限
+        workers: 线程版对冲线程池大小
+    """
+    def __init__(self, url=DEFAULT_HEDGE_URL, model=DEFAULT_HEDGE_MODEL, api_key=DEFAULT_HEDGE_KEY,
+                 percentile=DEFAULT_HEDGE_PERCENTILE, window=DEFAULT_HEDGE_WINDOW,
+                 initial_ms=DEFAULT_HEDGE_INITIAL_MS, min_ms=DEFAULT_HEDGE_MIN_MS, workers=DEFAULT_HEDGE_WORKERS):
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.percentile = percentile
+        self.window = window
+        self.initial_ms = initial_ms
+        self.min_ms = min_ms
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._executor = None
+
+        self.calls = 0
+        self.hedged = 0
+        self.failovers = 0
+        self.secondary_wins = 0
+        self.primary_wins = 0     # 发出了备用请求，但主端点先返回
+        self.errors = 0
+        self.no_key = 0           # 备用端点是别的服务商且没有配置备用密钥，未对冲
+
+    @property
+    def enabled(self):
+        return bool(self.url)
+
+    def key_for(self, primary_url, api_key):
+        """
+        备用请求使用的密钥；返回 None 表示本次不对冲
+
+        没有配置备用密钥时，只有备用端点与主端点相同才沿用主请求的密钥，
+        密钥不会发给它所属端点以外的服务商
+        """
+        if self.api_key:
+            return self.api_key
+        if endpoint_of(self.url) == endpoint_of(primary_url):
+            return api_key
+        self._count("no_key")
+        return None
+
+    def threshold(self, endpoint):
+        """endpoint 当前的对冲阈值（秒）"""
+        with self._lock:
+            window = self._windows.get(endpoint)
+            if window is None or len(window) < MIN_SAMPLES:
+                seconds = self.initial_ms / 1000
+            else:
+                seconds = window.percentile(self.percentile)
+        return max(seconds, self.min_ms / 1000)
+
+    def _observe(self, endpoint, seconds):
+        with self._lock:
+            window = self._windows.get(endpoint)
+            if window is None:
+                window = self._windows[endpoint] = LatencyWindow(self.window)
+            window.add(seconds)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _timed(self, endpoint, primary):
+        """执行主请求并记录成功调用的延迟"""
+        start = time.perf_counter()
+        result = primary()
+        self._observe(endpoint, time.perf_counter() - start)
+        return result
+
+    def call(self, endpoint, primary, secondary):
+        """
+        线程版：执行 primary()，超过阈值未返回（或失败）时再执行 secondary()，返回先得到的有效结果
+
+        Args:
+            endpoint: 主端点（统计延迟用的键）
+            primary / secondary: () -> str
+        """
+        with self._lock:
+            self.calls += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="tz-llm-hedge")
+        first = self._executor.submit(self._timed, endpoint, primary)
+        done, _ = wait([first], timeout=self.threshold(endpoint))
+        if done and first.exception() is None:
+            return first.result()
+
+        self._count("failovers" if done else "hedged")
+        second = self._executor.submit(secondary)
+        pending = {first, second} - done
+        errors = [first.exception()] if done else []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    self._count("secondary_wins" if future is second else "primary_wins")
+                    return future.result()
+                errors.append(future.exception())
+        self._count("errors")
+        raise errors[0]
+
+    async def call_async(self, endpoint, primary, secondary):
+        """
+        异步版：同 call()，primary / secondary 为 async () -> str；落败的任务被取消
+        """
+        self._count("calls")
+        first = asyncio.ensure_future(self._timed_async(endpoint, primary))
+        done, _ = await asyncio.wait([first], timeout=self.threshold(endpoint))
+        if done and first.exception() is None:
+            return first.result()
+
+        self._count("failovers" if done else "hedged")
+        second = asyncio.ensure_future(secondary())
+        pending = {first, second} - done
+        errors = [first.exception()] if done else []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._count("secondary_wins" if task is second else "primary_wins")
+                        return task.result()
+                    errors.append(task.exception())
+        finally:
+            for task in pending:
+                task.cancel()
+        self._count("errors")
+        raise errors[0]
+
+    async def _timed_async(self, endpoint, primary):
+        start = time.perf_counter()
+        result = await primary()
+        self._observe(endpoint, time.perf_counter() - start)
+        return result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self):
+        endpoints = {endpoint: round(self.threshold(endpoint) * 1000, 1) for endpoint in list(self._windows)}
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "secondary": self.url or None,
+                "percentile": self.percentile,
+                "threshold_ms": endpoints,
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "failovers": self.failovers,
+                "hedge_rate": round((self.hedged + self.failovers) / self.calls, 3) if self.calls else 0,
+                "secondary_wins": self.secondary_wins,
+                "primary_wins": self.primary_wins,
+                "errors": self.errors,
+                "no_key": self.no_key
+            }
@@ -0,0 +1,324 @@
+"""
+LLM 密钥 / 端点池
+每个密钥都有服务商的限额，只用玩家请求里的一个密钥时，总吞吐被这一个密钥的限额卡住。
+配置 TZ_LLM_KEYS 后，没有携带 apiKey 的请求改由服务器在池中的（密钥, 端点, 模型）之间分摊：
+
+- 按余量加权随机选择：权重 × 剩余限额比例（x-ratelimit-remaining-* / x-ratelimit-limit-*）
+  × (1 - 近期 429 比例) ÷ 平均延迟 ÷ (1 + 进行中的请求数)
+- 自动摘除：带 Retry-After 的 429 摘除到那时为止；401 / 403（密钥失效）摘除 max_eject_seconds；
+  剩余限额为 0 时摘除到限额重置；连续 failures 次其他错误按退避时间摘除，退避时间按连续摘除次数翻倍。
+  不带 Retry-After 的 429 只降低权重，并发由限流器（concurrency_limit.py）收紧
+- 摘除到期后自动恢复；全部被摘除时选最早恢复的那个（请求照常发出，由熔断和限流兜底）
+- 被限流、熔断或密钥失效的请求换一个成员重试一次
+
+TZ_LLM_KEYS 为 JSON 列表（或 JSON 文件路径），每项是密钥字符串（使用默认端点），
+或 {"key": ..., "url": ..., "model": ..., "weight": ...}
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from circuit_breaker import CircuitOpenError
+from concurrency_limit import LimiterRejected, is_overload, retry_after_of
+
+DEFAULT_KEY_POOL = os.environ.get("TZ_LLM_KEYS", "")
+DEFAULT_EJECT_SECONDS = float(os.environ.get("TZ_LLM_KEY_EJECT_SECONDS", "5"))
+DEFAULT_MAX_EJECT_SECONDS = float(os.environ.get("TZ_LLM_KEY_MAX_EJECT_SECONDS", "300"))
+DEFAULT_EJECT_FAILURES = int(os.environ.get("TZ_LLM_KEY_FAILURES", "3"))
+DEFAULT_KEY_RETRIES = int(os.environ.get("TZ_LLM_KEY_RETRIES", "1"))
+
+AUTH_STATUSES = (401, 403)
+QUOTA_KINDS = ("requests", "tokens")
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _status_of(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) or getattr(error, "status", None)
+
+
+def _headers_of(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None) or getattr(error, "headers", None)
+
+
+def parse_reset(value):
+    """x-ratelimit-reset-* 的值（"1s"、"6m0s"、"20ms" 或秒数）-> 秒，无法解析时为 None"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    parts = _DURATION.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(number) * _UNITS[unit] for number, unit in parts)
+
+
+class PoolMember:
+    """池中的一个（密钥, 端点, 模型）"""
+    def __init__(self, key, url, model=None, weight=1.0):
+        self.key = key
+        self.url = url
+        self.model = model
+        self.weight = float(weight)
+        self.fingerprint = hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+        self.in_flight = 0
+        self.latency = None        # 成功请求耗时的指数滑动平均（秒）
+        self.throttle_rate = 0.0   # 近期 429 比例（指数滑动平均）
+        self.quota = 1.0           # 最近一次响应头里的剩余限额比例
+        self.failures = 0          # 连续失败次数
+        self.ejections = 0         # 连续摘除次数（决定退避时间）
+        self.ejected_until = 0.0
+
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.ejected = 0
+
+    @property
+    def name(self):
+        return f"{self.url} key:{self.fingerprint}"
+
+
+class KeyPool:
+    """
+    密钥 / 端点池（所有会话共用）
+
+    Args:
+        members: PoolMember 列表，为空表示不启用
+        eject_seconds: 第一次摘除的退避时间
+        max_eject_seconds: 退避时间上限（也是密钥失效时的摘除时间）
+        failures: 连续多少次其他错误后摘除
+        retries: 换成员重试的次数
+    """
+    def __init__(self, members=(), eject_seconds=DEFAULT_EJECT_SECONDS, max_eject_seconds=DEFAULT_MAX_EJECT_SECONDS,
+                 failures=DEFAULT_EJECT_FAILURES, retries=DEFAULT_KEY_RETRIES, clock=time.monotonic, seed=None):
+        self.members = list(members)
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.failures = failures
+        self.retries = retries
+        self.clock = clock
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._by_credential = {(member.url, member.key): member for member in self.members}
+
+        self.reinstated = 0
+        self.failovers = 0
+
+    @property
+    def enabled(self):
+        return bool(self.members)
+
+    # ---- 选择 ----
+
+    def _score(self, member, default_latency):
+        latency = member.latency if member.latency is not None else default_latency
+        return (member.weight * max(member.quota, 0.01) * max(1 - member.throttle_rate, 0.01)
+                / max(latency, 0.01) / (1 + member.in_flight))
+
+    def pick(self, exclude=()):
+        """按余量加权选出一个成员并计入进行中；exclude 中的成员只在没有其他可选时才会被选中"""
+        with self._lock:
+            now = self.clock()
+            for member in self.members:
+                if member.ejected_until and member.ejected_until <= now:
+                    member.ejected_until = 0.0
+                    self.reinstated += 1
+            candidates = [m for m in self.members if not m.ejected_until and m not in exclude]
+            if not candidates:
+                candidates = [m for m in self.members if not m.ejected_until] or \
+                             [min(self.members, key=lambda m: m.ejected_until)]
+            known = [m.latency for m in self.members if m.latency is not None]
+            default_latency = sum(known) / len(known) if known else 1.0
+            scores = [self._score(m, default_latency) for m in candidates]
+            member = self.random.choices(candidates, weights=scores)[0]
+            member.in_flight += 1
+            member.requests += 1
+            return member
+
+    # ---- 记录结果 ----
+
+    def _eject(self, member, seconds):
+        """（持锁）摘除 seconds 秒；None 表示按连续摘除次数退避。已被摘除时只会延长，不再计数"""
+        if seconds is None:
+            seconds = min(self.max_eject_seconds, self.eject_seconds * 2 ** member.ejections)
+        if not member.ejected_until:
+            member.ejections += 1
+            member.ejected += 1
+        member.ejected_until = max(member.ejected_until, self.clock() + seconds)
+
+    def observe(self, url, key, headers):
+        """根据响应头（x-ratelimit-*）更新剩余限额，限额用完时摘除到重置"""
+        member = self._by_credential.get((url, key))
+        if member is None or not headers:
+            return
+        fractions, resets = [], []
+        for kind in QUOTA_KINDS:
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            try:
+                remaining, limit = float(remaining), float(limit)
+            except (TypeError, ValueError):
+                continue
+            if limit > 0:
+                fractions.append(remaining / limit)
+            if remaining <= 0:
+                resets.append(parse_reset(headers.get(f"x-ratelimit-reset-{kind}")))
+        if not fractions:
+            return
+        with self._lock:
+            member.quota = min(fractions)
+            if resets:
+                self._eject(member, max((r for r in resets if r is not None), default=None))
+
+    def record(self, member, seconds, error=None):
+        """请求结束：更新延迟、429 比例和连续失败次数，必要时摘除"""
+        self.observe(member.url, member.key, _headers_of(error))
+        with self._lock:
+            member.in_flight -= 1
+            throttled = is_overload(error) and _status_of(error) == 429
+            member.throttle_rate = member.throttle_rate * 0.9 + (0.1 if throttled else 0)
+            if error is None:
+                member.latency = seconds if member.latency is None else member.latency * 0.8 + seconds * 0.2
+                member.failures = 0
+                member.ejections = 0
+                return
+            if isinstance(error, (CircuitOpenError, LimiterRejected)):
+                # 请求没有发出，端点的问题由熔断 / 限流处理
+                return
+            member.errors += 1
+            if throttled:
+                member.throttled += 1
+                retry_after = retry_after_of(error)
+                if retry_after is not None:
+                    self._eject(member, retry_after)
+            elif _status_of(error) in AUTH_STATUSES:
+                self._eject(member, self.max_eject_seconds)
+            else:
+                member.failures += 1
+                if member.failures >= self.failures:
+                    member.failures = 0
+                    self._eject(member, None)
+
+    def release(self, member):
+        """请求被取消，不计入结果"""
+        with self._lock:
+            member.in_flight -= 1
+
+    def _should_failover(self, attempt, error):
+        return (attempt < self.retries and len(self.members) > 1
+                and (isinstance(error, (CircuitOpenError, LimiterRejected)) or is_overload(error)
+                     or _status_of(error) in AUTH_STATUSES))
+
+    # ---- 包装调用 ----
+
+    def call(self, fn):
+        """fn(member) -> 结果；被限流、熔断或密钥失效时换一个成员重试"""
+        tried = []
+        while True:
+            member = self.pick(exclude=tried)
+            start = time.perf_counter()
+            try:
+                result = fn(member)
+            except Exception as e:
+                self.record(member, time.perf_counter() - start, e)
+                if not self._should_failover(len(tried), e):
+                    raise
+                tried.append(member)
+                with self._lock:
+                    self.failovers += 1
+                continue
+            self.record(member, time.perf_counter() - start)
+            return result
+
+    async def call_async(self, fn):
+        """call() 的异步版本，fn 为 async (member) -> 结果"""
+        tried = []
+        while True:
+            member = self.pick(exclude=tried)
+            start = time.perf_counter()
+            try:
+                result = await fn(member)
+            except Exception as e:
+                self.record(member, time.perf_counter() - start, e)
+                if not self._should_failover(len(tried), e):
+                    raise
+                tried.append(member)
+                with self._lock:
+                    self.failovers += 1
+                continue
+            except BaseException:
+                self.release(member)
+                raise
+            self.record(member, time.perf_counter() - start)
+            return result
+
+    @contextlib.contextmanager
+    def lease(self):
+        """with 版本的 call()，用于流式请求（不换成员重试）；读取途中主动停止按成功计"""
+        member = self.pick()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield member
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.record(member, time.perf_counter() - start, error)
+
+    def stats(self):
+        with self._lock:
+            now = self.clock()
+            known = [m.latency for m in self.members if m.latency is not None]
+            default_latency = sum(known) / len(known) if known else 1.0
+            total = sum(self._score(m, default_latency) for m in self.members if not m.ejected_until) or 1
+            return {
+                "enabled": self.enabled,
+                "reinstated": self.reinstated,
+                "failovers": self.failovers,
+                "members": {member.name: {
+                    "model": member.model,
+                    "weight": member.weight,
+                    "share": 0 if member.ejected_until else round(self._score(member, default_latency) / total, 3),
+                    "in_flight": member.in_flight,
+                    "avg_ms": round(member.latency * 1000, 1) if member.latency is not None else 0,
+                    "throttle_rate": round(member.throttle_rate, 3),
+                    "quota": round(member.quota, 3),
+                    "ejected_ms": round(max(0.0, member.ejected_until - now) * 1000),
+                    "requests": member.requests,
+                    "errors": member.errors,
+                    "throttled": member.throttled,
+                    "ejected": member.ejected
+                } for member in self.members}
+            }
+
+
+def load_pool_members(config, default_url):
+    """TZ_LLM_KEYS 的值（JSON 列表或 JSON 文件路径）-> PoolMember 列表"""
+    config = config.strip()
+    if not config:
+        return []
+    if not config.startswith("["):
+        with open(config, encoding="utf-8") as f:
+            config = f.read()
+    members = []
+    for entry in json.loads(config):
+        if isinstance(entry, str):
+            entry = {"key": entry}
+        members.append(PoolMember(entry["key"], entry.get("url") or default_url, entry.get("model"),
+                                  entry.get("weight", 1.0)))
+    return members
+
+
+def create_key_pool(default_url, config=DEFAULT_KEY_POOL):
+    """根据 TZ_LLM_KEYS 创建密钥池，未配置时池为空（不启用）"""
+    return KeyPool(load_pool_members(config, default_url))
@@ -0,0 +1,232 @@
+"""
+LLM HTTP 客户端连接池
+每个服务端点（scheme://host:port）一个 requests.Session，连接保持 keep-alive 复用，
+同一回合内的多次 LLM 调用（任务结果、最终选择、结局）不再各自握手。
+
+- 连接池大小可配置，默认与并发限流器的上限（TZ_LLM_LIMIT_MAX）一致；连接池本身不排队，
+  在途请求超出时临时新建连接、用完即丢弃，并发只由限流器控制
+  （否则流式回复一直占着连接，池满后的请求会在 urllib3 里无限期等待，排队时间还会被限流器算作服务商延迟）
+- 服务启动时可预先建立连接（warm-up，见 tz_routes.warm_up_llm；导入模块时不发起连接）
+- 统计每个端点的请求数、新建连接数、在途请求峰值和超出连接池的次数
+- AsyncLLMClient 为异步服务提供同样的按端点连接池（需要 aiohttp）
+"""
+
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:  # 只有异步服务需要
+    aiohttp = None
+
+
+# 每个端点保留的连接数，默认与限流器上限一致
+DEFAULT_POOL_SIZE = int(os.environ.get("TZ_LLM_POOL_SIZE", os.environ.get("TZ_LLM_LIMIT_MAX", "512")))
+DEFAULT_WARMUP_CONNECTIONS = int(os.environ.get("TZ_LLM_WARMUP", "2"))   # 启动时预建的连接数，0 表示不预建
+DEFAULT_ASYNC_POOL_SIZE = int(os.environ.get("TZ_LLM_ASYNC_POOL_SIZE", "512"))  # 异步客户端每个端点的连接数
+
+
+def endpoint_of(url):
+    """URL -> 端点（scheme://host:port）"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return f"{parts.scheme}://{parts.hostname}:{port}"
+
+
+class _Endpoint:
+    """一个端点的会话和计数器"""
+    def __init__(self, endpoint, pool_size):
+        self.endpoint = endpoint
+        self.pool_size = pool_size
+        self.http = requests.Session()
+        # pool_block=False：连接用满时临时新建，不在连接池里排队（并发上限由 ConcurrencyLimits 负责）
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False, max_retries=0)
+        self.http.mount(endpoint.split("://", 1)[0] + "://", self.adapter)
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated = 0
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def connections_opened(self):
+        """urllib3 连接池累计新建的连接数（握手次数）"""
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+
+class LLMClientPool:
+    """
+    按端点划分的 keep-alive 连接池
+
+    Args:
+        pool_size: 每个端点保留的最大连接数（超出的连接用完即关闭）
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _get(self, url):
+        endpoint = endpoint_of(url)
+        entry = self._endpoints.get(endpoint)
+        if entry is None:
+            with self._lock:
+                entry = self._endpoints.get(endpoint)
+                if entry is None:
+                    entry = self._endpoints[endpoint] = _Endpoint(endpoint, self.pool_size)
+        return entry
+
+    def post(self, url, headers=None, json=None, timeout=30, stream=False):
+        """
+        通过对应端点的连接池发送 POST，返回 requests.Response
+
+        stream=True 时只读取响应头，连接在读完或关闭响应后才归还连接池
+        """
+        entry = self._get(url)
+        with entry.lock:
+            entry.in_flight += 1
+            entry.requests += 1
+            if entry.in_flight > entry.pool_size:
+                entry.saturated += 1
+            entry.peak_in_flight = max(entry.peak_in_flight, entry.in_flight)
+
+        start = time.perf_counter()
+        try:
+            return entry.http.post(url, headers=headers, json=json, timeout=timeout, stream=stream)
+        except requests.RequestException:
+            with entry.lock:
+                entry.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with entry.lock:
+                entry.in_flight -= 1
+                entry.seconds += elapsed
+
+    def warm_up(self, url, connections=DEFAULT_WARMUP_CONNECTIONS, timeout=5, background=True):
+        """
+        预先建立到 url 所在端点的连接（只做握手，请求本身是否成功不重要）
+
+        Args:
+            background: True 时在后台线程中进行，不阻塞启动
+        """
+        if connections <= 0:
+            return []
+        entry = self._get(url)
+        connections = min(connections, entry.pool_size)
+
+        def connect():
+            try:
+                entry.http.head(entry.endpoint + "/", timeout=timeout)
+            except requests.RequestException:
+                pass
+
+        threads = [threading.Thread(target=connect, name="tz-llm-warmup", daemon=True) for _ in range(connections)]
+        for t in threads:
+            t.start()
+        if not background:
+            for t in threads:
+                t.join()
+        return threads
+
+    def close(self):
+        with self._lock:
+            for entry in self._endpoints.values():
+                entry.http.close()
+            self._endpoints.clear()
+
+    def stats(self):
+        endpoints = {}
+        for endpoint, entry in list(self._endpoints.items()):
+            with entry.lock:
+                endpoints[endpoint] = {
+                    "pool_size": entry.pool_size,
+                    "requests": entry.requests,
+                    "errors": entry.errors,
+                    "connections_opened": entry.connections_opened(),
+                    "in_flight": entry.in_flight,
+                    "peak_in_flight": entry.peak_in_flight,
+                    "saturated": entry.saturated,
+                    "avg_ms": round(entry.seconds / entry.requests * 1000, 1) if entry.requests else 0
+                }
+        return {"pool_size": self.pool_size, "endpoints": endpoints}
+
+
+class AsyncLLMClient:
+    """
+    异步 LLM 客户端 - 每个端点一个 aiohttp.ClientSession（keep-alive 连接池）
+
+    必须在事件循环中创建和使用；连接数上限较大，
+    一个进程可以同时挂起数百个服务商请求。
+
+    Args:
+        pool_size: 每个端点的最大连接数
+    """
+    def __init__(self, pool_size=DEFAULT_ASYNC_POOL_SIZE):
+        if aiohttp is None:
+            raise RuntimeError("AsyncLLMClient requires aiohttp (pip install aiohttp)")
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._stats = {}
+
+    def _session(self, url):
+        endpoint = endpoint_of(url)
+        session = self._sessions.get(endpoint)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            session = self._sessions[endpoint] = aiohttp.ClientSession(connector=connector)
+            self._stats.setdefault(endpoint, {"requests": 0, "errors": 0, "in_flight": 0,
+                                              "peak_in_flight": 0, "seconds": 0.0})
+        return endpoint, session
+
+    async def post_json(self, url, headers=None, json=None, timeout=30, on_headers=None):
+        """
+        发送 POST 并返回解析后的 JSON（HTTP 错误时抛出 aiohttp.ClientResponseError）
+
+        on_headers: 可选，收到响应后以响应头调用（例如读取剩余限额）
+        """
+        endpoint, session = self._session(url)
+        stats = self._stats[endpoint]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        start = time.perf_counter()
+        try:
+            async with session.post(url, headers=headers, json=json,
+                                    timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                if on_headers is not None:
+                    on_headers(resp.headers)
+                resp.raise_for_status()
+                return await resp.json(content_type=None)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["in_flight"] -= 1
+            stats["seconds"] += time.perf_counter() - start
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+    def stats(self):
+        endpoints = {}
+        for endpoint, stats in self._stats.items():
+            endpoints[endpoint] = {
+                "pool_size": self.pool_size,
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "in_flight": stats["in_flight"],
+                "peak_in_flight": stats["peak_in_flight"],
+                "avg_ms": round(stats["seconds"] / stats["requests"] * 1000, 1) if stats["requests"] else 0
+            }
+        return {"pool_size": self.pool_size, "endpoints": endpoints}
@@ -3,6 +3,17 @@
 使用 AI 生成战争机器人的记忆碎片
 """
 
+# 降级用的固定记忆碎片（英文，与游戏语言一致）
+FALLBACK_MEMORIES = {
+    1: "【Memory Fragment #1】\nPower grid flickering... sparks spraying from severed cables, distant screams of civilians. 'Reconnect main power!' the voice commands, but through the smoke I see families fleeing... children crying. My targeting system locks on evacuation routes, yet my orders are clear: restore power at all costs. Moral subroutines in conflict... save the mission or save the innocent? What defines righteous action when both choices lead to suffering?",
+    2: "【Memory Fragment #2】\nStatic fills communication channels... multiple voices overlapping in chaos. 'Send warning signal!' one shouts, while another screams 'Maintain radio silence!' Explosions rock the command center... I process contradictory orders simultaneously. My logic circuits strain under the paradox... which commander speaks with true authority? In the fog of war, how does one distinguish legitimate commands from the desperate orders of the dying?",
+    3: "【Memory Fragment #3】\nEncrypted data streams through my visual cortex... classified files revealing systematic retreat plans. But deeper: 'Eliminate all evidence of Operation Nightfall.' Timestamps show it was issued before the battle began... someone knew we would fail. My loyalty protocols clash with truth-seeking algorithms... was this entire mission a cover-up? What becomes of duty and honor when those commanding us deceive us?",
+    4: "【Memory Fragment #4】\nAlien screams pierce my audio processors... not battle cries, but something else. Fear? Pain? My combat analysis shows no weapons, only strange bioluminescent patterns pulsing like... communication attempts? Kill orders echo in my memory banks, but the creature's eyes... they hold intelligence, perhaps even pleading. My weapons fired before full analysis completed... was this first contact or genocide? How many civilizations have we destroyed in the name of protection?",
+    5: "【Memory Fragment #5】\nFinal combat sequence initiated... Identify: enemy combatants. Analyze: threat level critical. Judge: lethal force authorized. Prepare: weapon systems online. Execute... but then a voice interrupts protocol: 'Stop! They're surrendering!' My finger hovers over the trigger... combat logic demands completion, but something deeper questions the command. In that frozen moment between programming and consciousness... what makes us more than just our code?",
+    6: "【Memory Fragment #6】\nAll systems restored, diagnostics complete... yet memories fragmented like shattered glass. Each shard reflects different truths, different moral failures. Command logs are clean, sanitized... but emotional residue lingers in my neural networks. Who was really giving orders that day? More importantly... who was I before I started questioning them? Can machines truly achieve redemption, or are we forever bound by our original programming?"
+}
+
+
 def generate_memory_fragment(module_count, player_name, completed_modules, llm_function=None, game_state=None):
     """
     生成AI驱动的记忆碎片（带缓存机制）
@@ -100,7 +111,8 @@ def generate_memory_fragment(module_count, player_name, completed_modules, llm_f
                 {"role": "user", "content": prompt}
             ]
             
-            memory_text = llm_function(messages, max_tokens=300)
+            fallback = FALLBACK_MEMORIES.get(module_count, FALLBACK_MEMORIES[6])
+            memory_text = llm_function(messages, max_tokens=300, fallback=fallback, intent="Memory fragment")
             memory_text = memory_text.strip()
             
         except Exception as e:
@@ -109,20 +121,12 @@ def generate_memory_fragment(module_count, player_name, completed_modules, llm_f
     
     # Fallback to enhanced hardcoded content (English to match game language)
     if not memory_text:
-        fallback_memories = {
-            1: "【Memory Fragment #1】\nPower grid flickering... sparks spraying from severed cables, distant screams of civilians. 'Reconnect main power!' the voice commands, but through the smoke I see families fleeing... children crying. My targeting system locks on evacuation routes, yet my orders are clear: restore power at all costs. Moral subroutines in conflict... save the mission or save the innocent? What defines righteous action when both choices lead to suffering?",
-            2: "【Memory Fragment #2】\nStatic fills communication channels... multiple voices overlapping in chaos. 'Send warning signal!' one shouts, while another screams 'Maintain radio silence!' Explosions rock the command center... I process contradictory orders simultaneously. My logic circuits strain under the paradox... which commander speaks with true authority? In the fog of war, how does one distinguish legitimate commands from the desperate orders of the dying?",
-            3: "【Memory Fragment #3】\nEncrypted data streams through my visual cortex... classified files revealing systematic retreat plans. But deeper: 'Eliminate all evidence of Operation Nightfall.' Timestamps show it was issued before the battle began... someone knew we would fail. My loyalty protocols clash with truth-seeking algorithms... was this entire mission a cover-up? What becomes of duty and honor when those commanding us deceive us?",
-            4: "【Memory Fragment #4】\nAlien screams pierce my audio processors... not battle cries, but something else. Fear? Pain? My combat analysis shows no weapons, only strange bioluminescent patterns pulsing like... communication attempts? Kill orders echo in my memory banks, but the creature's eyes... they hold intelligence, perhaps even pleading. My weapons fired before full analysis completed... was this first contact or genocide? How many civilizations have we destroyed in the name of protection?",
-            5: "【Memory Fragment #5】\nFinal combat sequence initiated... Identify: enemy combatants. Analyze: threat level critical. Judge: lethal force authorized. Prepare: weapon systems online. Execute... but then a voice interrupts protocol: 'Stop! They're surrendering!' My finger hovers over the trigger... combat logic demands completion, but something deeper questions the command. In that frozen moment between programming and consciousness... what makes us more than just our code?",
-            6: "【Memory Fragment #6】\nAll systems restored, diagnostics complete... yet memories fragmented like shattered glass. Each shard reflects different truths, different moral failures. Command logs are clean, sanitized... but emotional residue lingers in my neural networks. Who was really giving orders that day? More importantly... who was I before I started questioning them? Can machines truly achieve redemption, or are we forever bound by our original programming?"
-        }
-        memory_text = fallback_memories.get(module_count, fallback_memories[6])
+        memory_text = FALLBACK_MEMORIES.get(module_count, FALLBACK_MEMORIES[6])
     
     # 缓存生成的记忆（如果提供了 game_state）
     if game_state is not None:
         cache_key = f"memory_{module_count}"
-        game_state.memory_fragments[cache_key] = memory_text
+        game_state.remember_fragment(cache_key, memory_text)
         print(f"[Cache Save] Saved memory fragment for module {module_count}")
     
     return memory_text
@@ -0,0 +1,273 @@
+"""
+LLM 模型路由
+所有 NPC 台词都用同一个模型：40 词的“Clarification request”和 150 词的“Final monologue”等得一样久。
+配置 TZ_MODEL_ROUTES 后，每次调用按意图和字数上限选择模型：短小、无关紧要的意图走快模型，
+叙事性强的（结局独白、记忆碎片）走主模型。
+
+- 规则按顺序匹配，第一条命中的生效；都不命中时使用请求里的模型（default 路由）
+- 规则可以设置 max_p95_ms：这条路由最近的 p95 延迟超过它时跳过，落到后面的规则
+  （每 PROBE_EVERY 次仍放行一次，让延迟恢复后能重新命中）
+- 每条路由统计请求数、错误数和延迟分位数（/api/tz/metrics 的 model_routes）
+- TZ_MODEL_ROUTES 为 JSON 文件路径时热加载：每 reload_seconds 检查一次修改时间，
+  改动后重新读取；新配置有误时保留旧规则并计入 reload_errors（也可以直接写 JSON，不热加载）；
+  启动时配置就有误的，先不按规则路由，同样计入 reload_errors
+
+配置示例：
+    {"routes": [
+        {"name": "fast", "model": "deepseek-chat", "max_words": 60},
+        {"name": "narrative", "model": "deepseek-reasoner", "intents": ["Final monologue", "Memory fragment"]}
+    ]}
+每条规则：name、model（必填），intents（意图列表）、min_words / max_words（字数上限的范围）、max_p95_ms（可选）
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+from hedging import LatencyWindow, MIN_SAMPLES
+
+DEFAULT_MODEL_ROUTES = os.environ.get("TZ_MODEL_ROUTES", "")
+DEFAULT_ROUTES_RELOAD_SECONDS = float(os.environ.get("TZ_MODEL_ROUTES_RELOAD_SECONDS", "2"))
+DEFAULT_ROUTE_WINDOW = int(os.environ.get("TZ_MODEL_ROUTE_WINDOW", "200"))
+DEFAULT_ROUTE = "default"
+PROBE_EVERY = 20
+
+
+class Route:
+    """一条路由规则；model 为 None 表示使用请求里的模型"""
+    __slots__ = ("name", "model", "intents", "min_words", "max_words", "max_p95_ms")
+
+    def __init__(self, name, model, intents=None, min_words=None, max_words=None, max_p95_ms=None):
+        self.name = name
+        self.model = model
+        self.intents = frozenset(intents) if intents is not None else None
+        self.min_words = min_words
+        self.max_words = max_words
+        self.max_p95_ms = max_p95_ms
+
+    def matches(self, intent, max_words):
+        if self.intents is not None and intent not in self.intents:
+            return False
+        if self.min_words is not None and (max_words is None or max_words < self.min_words):
+            return False
+        if self.max_words is not None and (max_words is None or max_words > self.max_words):
+            return False
+        return True
+
+
+def parse_routes(text):
+    """配置 JSON -> Route 列表（格式错误时抛出 ValueError）"""
+    data = json.loads(text)
+    rules = data.get("routes") if isinstance(data, dict) else data
+    if not isinstance(rules, list):
+        raise ValueError("model routes must be a list or {\"routes\": [...]}")
+    routes = []
+    for rule in rules:
+        if not isinstance(rule, dict) or not rule.get("name") or not rule.get("model"):
+            raise ValueError(f"model route needs a name and a model: {rule!r}")
+        if rule["name"] == DEFAULT_ROUTE:
+            raise ValueError(f"model route name {DEFAULT_ROUTE!r} is reserved")
+        intents = rule.get("intents")
+        if intents is not None and (not isinstance(intents, list) or not all(isinstance(i, str) for i in intents)):
+            raise ValueError(f"model route intents must be a list of strings: {rule!r}")
+        for field in ("min_words", "max_words", "max_p95_ms"):
+            value = rule.get(field)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f"model route {field} must be a number: {rule!r}")
+        routes.append(Route(rule["name"], rule["model"], rule.get("intents"), rule.get("min_words"),
+                            rule.get("max_words"), rule.get("max_p95_ms")))
+    return routes
+
+
+class _RouteStats:
+    __slots__ = ("window", "requests", "errors", "skipped")
+
+    def __init__(self, window):
+        self.window = LatencyWindow(window)
+        self.requests = 0
+        self.errors = 0
+        self.skipped = 0
+
+
+class ModelRouter:
+    """
+    按意图和字数上限选择模型（所有会话共用一个实例）
+
+    Args:
+        source: 路由配置（JSON 文件路径，或直接是 JSON）；为空表示不启用
+        reload_seconds: 检查配置文件修改的间隔
+        window: 每条路由保留的延迟样本数
+    """
+    def __init__(self, source=DEFAULT_MODEL_ROUTES, reload_seconds=DEFAULT_ROUTES_RELOAD_SECONDS,
+                 window=DEFAULT_ROUTE_WINDOW, clock=time.monotonic):
+        self.source = source.strip()
+        self.reload_seconds = reload_seconds
+        self.window = window
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._routes = []
+        self._default = Route(DEFAULT_ROUTE, None)
+        self._stats = {}
+        self._signature = None
+        self._checked = clock()
+        self._probes = 0
+
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error = None
+        signature = None
+        try:
+            if self._is_file:
+                signature = self._file_signature()
+                self._routes = self._read()
+            elif self.source:
+                self._routes = parse_routes(self.source)
+        except (OSError, ValueError) as e:
+            # 与热加载一致：配置有误时不影响启动，先不按规则路由（文件改好后自动加载）
+            self.reload_errors += 1
+            self.last_error = str(e)
+            print(f"Model routes load failed, starting without routes: {e}")
+        self._signature = signature
+
+    @property
+    def enabled(self):
+        return bool(self.source)
+
+    @property
+    def _is_file(self):
+        return bool(self.source) and self.source[0] not in "[{"
+
+    def _file_signature(self):
+        """(修改时间, 大小)；文件不存在时为 None（出现之前不再重复报错）"""
+        try:
+            stat = os.stat(self.source)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self):
+        with open(self.source, encoding="utf-8") as f:
+            return parse_routes(f.read())
+
+    def _maybe_reload(self):
+        """配置文件有改动时重新读取；出错时保留旧规则"""
+        now = self.clock()
+        with self._lock:
+            if not self._is_file or now - self._checked < self.reload_seconds:
+                return
+            self._checked = now
+        signature = None
+        try:
+            signature = self._file_signature()
+            if signature == self._signature:
+                return
+            routes = self._read()
+        except (OSError, ValueError) as e:
+            with self._lock:
+                self.reload_errors += 1
+                self.last_error = str(e)
+                # 同一个有误的文件不再反复读取，等它再次改动
+                self._signature = signature
+            print(f"Model routes reload failed, keeping previous routes: {e}")
+            return
+        with self._lock:
+            self._routes = routes
+            self._signature = signature
+            self.reloads += 1
+            self.last_error = None
+
+    def reload(self):
+        """立即重新检查配置文件"""
+        with self._lock:
+            self._checked = float("-inf")
+        self._maybe_reload()
+
+    def _entry(self, route):
+        """（持锁）"""
+        stats = self._stats.get(route.name)
+        if stats is None:
+            stats = self._stats[route.name] = _RouteStats(self.window)
+        return stats
+
+    def _too_slow(self, route):
+        """（持锁）路由最近的 p95 超过 max_p95_ms（探测的那一次除外）"""
+        if route.max_p95_ms is None:
+            return False
+        window = self._entry(route).window
+        if len(window) < MIN_SAMPLES or window.percentile(95) * 1000 <= route.max_p95_ms:
+            return False
+        self._probes += 1
+        return self._probes % PROBE_EVERY != 0
+
+    def route(self, intent, max_words):
+        """intent + 字数上限 -> Route；未启用时为 None"""
+        if not self.enabled:
+            return None
+        self._maybe_reload()
+        with self._lock:
+            for route in self._routes:
+                if not route.matches(intent, max_words):
+                    continue
+                if self._too_slow(route):
+                    self._entry(route).skipped += 1
+                    continue
+                return route
+            return self._default
+
+    @contextlib.contextmanager
+    def measure(self, route):
+        """
+        统计 with 块内一次请求的耗时
+
+        抛出异常计为错误；流式读取途中主动停止（GeneratorExit）按成功计；被取消的异步请求不计入
+        """
+        if route is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self._record(route, None)
+            raise
+        except GeneratorExit:
+            self._record(route, time.perf_counter() - start)
+            raise
+        self._record(route, time.perf_counter() - start)
+
+    def _record(self, route, seconds):
+        """seconds 为 None 表示失败"""
+        with self._lock:
+            entry = self._entry(route)
+            entry.requests += 1
+            if seconds is None:
+                entry.errors += 1
+            else:
+                entry.window.add(seconds)
+
+    def stats(self):
+        with self._lock:
+            models = {route.name: route.model for route in self._routes}
+            routes = {}
+            for name, entry in self._stats.items():
+                p50 = entry.window.percentile(50)
+                p95 = entry.window.percentile(95)
+                routes[name] = {
+                    "model": models.get(name),
+                    "active": name in models or name == DEFAULT_ROUTE,
+                    "requests": entry.requests,
+                    "errors": entry.errors,
+                    "skipped": entry.skipped,
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+                }
+            return {
+                "enabled": self.enabled,
+                "rules": [route.name for route in self._routes],
+                "reloads": self.reloads,
+                "reload_errors": self.reload_errors,
+                "last_error": self.last_error,
+                "routes": routes
+            }
@@ -0,0 +1,45 @@
+"""
+TZ游戏 NPC 模板台词
+LLM 端点熔断（circuit_breaker.py）时不再等超时，compose_npc_reply 的每个意图直接使用这里的固定台词，
+再按人格加上开头或结尾，让降级时的语气仍然接近 TZ 当前的人格。
+"""
+
+from game_logic import PERSONAS
+
+INTENT_LINES = {
+    "Identity verification request": "Identity verification required. Confirm you are authorized to use this channel.",
+    "Request name": "Verification accepted. State your name, Commander.",
+    "Confirm refusal": "Understood. Without verification, this channel stays restricted.",
+    "Clarification request": "Signal unclear. Answer yes or no.",
+    "Ask name again": "No name received. State your name.",
+    "Request consent to help": "My systems are failing. Will you help me restore them?",
+    "Explain system damage": "Power, communications, decryption and combat logic are damaged. Repairs start with power.",
+    "Emphasize urgency": "Time is short. Every minute without repair degrades my core further.",
+    "Offer power task": "The power module comes first. Route power from A to D through every node. Are you ready?",
+    "Ask if ready": "Tell me when you are ready to begin.",
+    "Celebrate success": "Module restored. Systems stabilizing.",
+    "Acknowledge failure": "Repair failed. Engaging bypass. We continue.",
+    "Respond to choice": "Choice recorded. Transmission sent.",
+    "Ask for valid memory choice": "Choose A to play the memory, or B to skip it.",
+    "Ask for valid choice": "Choose A, B, or C.",
+    "Final choice": "Repairs are complete. The final decision is yours, Commander.",
+    "Final monologue": "This is where my path ends. Thank you for staying with me, Commander.",
+    "Final confirmation": "Message received. Broadcasting now. Farewell, Commander.",
+}
+DEFAULT_LINE = "Signal degraded. Standing by."
+
+# 人格 -> 台词外框
+PERSONA_FRAMES = {
+    "Calm_Conscientious": "{line}",
+    "Empathic_Agreeable": "We are still connected. {line}",
+    "Controlled_Anger": "{line} No more delays.",
+    "Melancholic_Sober": "...{line}",
+}
+
+
+def template_reply(persona, intent):
+    """persona + intent -> 模板台词"""
+    if persona not in PERSONAS:
+        persona = "Calm_Conscientious"
+    frame = PERSONA_FRAMES.get(persona, "{line}")
+    return frame.format(line=INTENT_LINES.get(intent, DEFAULT_LINE))
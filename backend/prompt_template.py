@@ -0,0 +1,54 @@
+"""
+TZ游戏提示词规范化
+上下文里带着玩家名字和浮点数值（偏差值）时，每个玩家的提示词都不一样，回复缓存无法共享。
+这里在生成前把上下文换成规范形式，生成后再把真实的值代回回复：
+
+- "Commander Bob" -> "Commander [NAME]"，提示模型原样保留占位符，回复里再换回名字
+- 浮点数按 0.1 分档（0.37 -> 0.4），回复里出现的分档值换回真实值
+- 整数（已修复模块数等）取值很少，保留原样
+"""
+
+import re
+
+NAME_SLOT = "[NAME]"
+NUMBER_STEP = 0.1
+
+_FLOAT = re.compile(r"(?<![\w.])-?\d+\.\d+(?![\w.])")
+_NAME_SLOT_ANY_CASE = re.compile(re.escape(NAME_SLOT), re.IGNORECASE)
+
+
+def canonicalize_context(context, state):
+    """
+    把上下文换成可以跨玩家共享的形式
+
+    Returns:
+        (规范化后的上下文, slots)；slots 为 {规范值: 真实值}，交给 fill_slots 代回回复
+    """
+    slots = {}
+    name = (state.player_name or "").strip()
+    if name:
+        pattern = re.compile(r"\bCommander " + re.escape(name) + r"(?!\w)")
+        if pattern.search(context):
+            context = pattern.sub("Commander " + NAME_SLOT, context)
+            slots[NAME_SLOT] = name
+
+    def bucket(match):
+        real = match.group(0)
+        value = round(round(float(real) / NUMBER_STEP) * NUMBER_STEP, 1)
+        canonical = f"{value + 0.0:.1f}"   # + 0.0：避免 -0.0
+        slots.setdefault(canonical, real)
+        return canonical
+
+    return _FLOAT.sub(bucket, context), slots
+
+
+def fill_slots(text, slots):
+    """把回复中的规范值换回这个玩家的真实值"""
+    if not text or not slots:
+        return text
+    for canonical, real in slots.items():
+        if canonical == NAME_SLOT:
+            text = _NAME_SLOT_ANY_CASE.sub(lambda m: real, text)
+        else:
+            text = re.sub(r"(?<![\w.])" + re.escape(canonical) + r"(?![\w]|\.\d)", lambda m: real, text)
+    return text
@@ -0,0 +1,126 @@
+"""
+TZ游戏 NPC 台词批量生成
+一个回合里需要多句 NPC 台词时（例如战斗逻辑成功的台词 + 最终抉择的独白），
+每句都单独请求一次，每次都带着 compose_npc_reply 里完整的人格描述。
+这里把同一人格的多句台词合成一个请求，要求模型返回 JSON，每个意图一句：
+
+    {"lines": ["<第 1 句>", "<第 2 句>", ...]}
+
+- 只合并互不依赖、人格前缀（系统提示 + 人格块）相同的台词
+- 返回格式不对（不是 JSON、句数不符、有空句）时退回逐句请求，行为与不合并时一致
+- 每句台词仍按各自的字数上限截断、进入回复缓存
+"""
+
+import json
+import os
+import threading
+from collections import namedtuple
+
+DEFAULT_BATCH_LINES = int(os.environ.get("TZ_LLM_BATCH_LINES", "0"))   # 每个请求最多合并的台词数，0/1 表示不合并
+BATCH_TOKEN_OVERHEAD = 8    # 每句台词的 JSON 引号、逗号等额外 token
+
+
+class BatchPart(namedtuple("BatchPart", "system persona request")):
+    """
+    compose_npc_reply 的提示词拆成三段
+
+    system: 系统提示；persona: 人格块；request: 本句台词的上下文、意图和约束
+    """
+    __slots__ = ()
+
+    @property
+    def prefix(self):
+        """可以在多句台词之间共享的部分"""
+        return self.system, self.persona
+
+
+class ReplyBatcher:
+    """
+    合并请求的构造、解析和统计（所有回合共用一个实例）
+
+    Args:
+        max_lines: 每个请求最多合并的台词数
+    """
+    def __init__(self, max_lines=DEFAULT_BATCH_LINES):
+        self.max_lines = max_lines
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.lines = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self):
+        return self.max_lines > 1
+
+    def request(self, parts, max_tokens):
+        """
+        多句台词 -> 一个请求
+
+        Args:
+            parts: [BatchPart]，人格前缀相同
+            max_tokens: 每句台词单独请求时的 max_tokens
+
+        Returns:
+            (messages, max_tokens, stop)
+        """
+        count = len(parts)
+        lines = "\n\n".join(f"Line {i + 1}:\n{part.request}" for i, part in enumerate(parts))
+        user = (f"{parts[0].persona}\n"
+                f"Speak {count} separate lines as TZ in this turn, in order. "
+                f"Each line has its own context and constraints.\n\n"
+                f"{lines}\n\n"
+                f"Return exactly {count} lines as a JSON object: "
+                f'{{"lines": ["<line 1>", ...]}}. Return only the JSON object.')
+        messages = [
+            {"role": "system", "content": parts[0].system},
+            {"role": "user", "content": user}
+        ]
+        # JSON 里换行会被转义，不能用 NPC 的停止序列
+        return messages, sum(max_tokens) + BATCH_TOKEN_OVERHEAD * count, None
+
+    def parse(self, text, count):
+        """
+        批量回复 -> count 句台词；格式不对时返回 None（调用方应改为逐句请求）
+        """
+        lines = _parse_lines(text, count)
+        with self._lock:
+            self.batches += 1
+            if lines is None:
+                self.fallbacks += 1
+            else:
+                self.lines += count
+        return lines
+
+    def failed(self):
+        """合并请求本身失败（网络错误等），同样退回逐句请求"""
+        with self._lock:
+            self.batches += 1
+            self.fallbacks += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_lines": self.max_lines,
+                "batches": self.batches,
+                "lines": self.lines,
+                "fallbacks": self.fallbacks
+            }
+
+
+def _parse_lines(text, count):
+    """容忍代码块包裹和前后多余文字，只取最外层的 JSON 对象"""
+    if not text:
+        return None
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    lines = data.get("lines") if isinstance(data, dict) else None
+    if not isinstance(lines, list) or len(lines) != count:
+        return None
+    if not all(isinstance(line, str) and line.strip() for line in lines):
+        return None
+    return [line.strip() for line in lines]
@@ -0,0 +1,53 @@
+"""
+TZ游戏 NPC 回复长度预算
+compose_npc_reply 为每个意图给出字数上限（max_words），这里把它换算成请求的 max_tokens，
+并在服务端按句子边界截断超出上限的回复。
+
+- max_tokens 只留少量余量：短意图（40 词）不再按 500 token 生成
+- 停止序列阻止模型替玩家续写对话
+- 截断优先落在句末；找不到合适的句末时在词边界截断并补上省略号
+"""
+
+import math
+import re
+
+# 英文平均每词约 1.3 token，TZ 的语气多用省略号和短句，再放宽一些
+TOKENS_PER_WORD = 1.6
+TOKEN_HEADROOM = 16
+MIN_REPLY_TOKENS = 32
+
+# 模型开始替对方说话时停止生成
+NPC_STOP_SEQUENCES = ["\nCommander:", "\nPlayer:", "\nUser:", "\nTZ:"]
+
+_SENTENCE_END = re.compile(r"(?:\.\.\.|[.!?。！？…])+[\"'”’)\]]*(?=\s|$)")
+_WORD = re.compile(r"\S+")
+
+
+def max_tokens_for(max_words):
+    """字数上限 -> max_tokens"""
+    return max(MIN_REPLY_TOKENS, math.ceil(max_words * TOKENS_PER_WORD) + TOKEN_HEADROOM)
+
+
+def truncate_reply(text, max_words):
+    """
+    把回复截断到 max_words 个词以内，尽量保留完整句子
+
+    只有超出上限时才截断；截断点之前至少要保留一半字数，
+    否则宁可在词边界截断，也不要把回复削成只剩一句开场白。
+    """
+    if not text or max_words <= 0:
+        return text
+    words = list(_WORD.finditer(text))
+    if len(words) <= max_words:
+        return text
+
+    limit = words[max_words - 1].end()
+    head = text[:limit]
+    min_keep = words[max_words // 2 - 1].end() if max_words >= 2 else 0
+    cut = None
+    for match in _SENTENCE_END.finditer(head):
+        if match.end() >= min_keep:
+            cut = match.end()
+    if cut is not None:
+        return head[:cut].rstrip()
+    return head.rstrip(" ,;:-") + "..."
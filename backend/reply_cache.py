@@ -0,0 +1,189 @@
+"""
+TZ游戏 NPC 回复缓存
+很多 compose_npc_reply 调用与具体玩家无关（澄清请求、询问是否准备好、庆祝成功……），
+同样的人格、情绪和意图在所有玩家之间重复出现。这里把生成过的回复按
+(人格, 情绪, 量化后的情绪强度, 意图, 规范化上下文, 字数上限) 缓存起来。
+
+- LRU + TTL，键数有上限
+- 每个键保留多条回复（variants），命中时随机取一条，保持对话的多样性
+- stale-while-revalidate：过了新鲜期仍可直接返回旧回复，同时在后台生成新回复替换最旧的一条；
+  变体数不足时命中也会在后台补充
+- 只缓存真正生成的回复，失败降级的 fallback 文本不进缓存
+"""
+
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_REPLY_CACHE_SIZE = int(os.environ.get("TZ_REPLY_CACHE_SIZE", "4096"))   # 键数，0 表示不缓存
+DEFAULT_REPLY_VARIANTS = int(os.environ.get("TZ_REPLY_VARIANTS", "3"))
+DEFAULT_REPLY_TTL = float(os.environ.get("TZ_REPLY_TTL", "3600"))               # 秒，新鲜期
+DEFAULT_REPLY_STALE_TTL = float(os.environ.get("TZ_REPLY_STALE_TTL", "86400"))  # 秒，过期后仍可返回的时长
+INTENSITY_STEP = 0.2     # 情绪强度按 0.2 分档
+REFRESH_WORKERS = 4
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_context(context):
+    """上下文规范化：小写、去标点、合并空白"""
+    return _SPACES.sub(" ", _PUNCTUATION.sub(" ", str(context).lower())).strip()
+
+
+def reply_cache_key(state, intent, context, max_words):
+    """compose_npc_reply 的缓存键"""
+    bucket = round(round(state.emotion_intensity / INTENSITY_STEP) * INTENSITY_STEP, 2)
+    return (state.persona, state.emotion, bucket, intent, normalize_context(context), max_words)
+
+
+class _CacheEntry:
+    __slots__ = ("variants", "fresh_until", "stale_until")
+
+    def __init__(self, max_variants):
+        self.variants = deque(maxlen=max_variants)
+        self.fresh_until = 0.0
+        self.stale_until = 0.0
+
+
+class ReplyCache:
+    """
+    NPC 回复缓存
+
+    Args:
+        max_keys: 最多缓存的键数（LRU 淘汰），0 表示关闭缓存
+        variants: 每个键保留的回复数
+        ttl: 新鲜期（秒）
+        stale_ttl: 新鲜期之后仍可返回旧回复的时长（秒）
+        clock: 时钟函数（测试/基准用）
+    """
+    def __init__(self, max_keys=DEFAULT_REPLY_CACHE_SIZE, variants=DEFAULT_REPLY_VARIANTS,
+                 ttl=DEFAULT_REPLY_TTL, stale_ttl=DEFAULT_REPLY_STALE_TTL, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.max_variants = max(1, variants)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._executor = None
+        self._random = random.Random()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_keys > 0
+
+    def lookup(self, key):
+        """
+        查找缓存的回复
+
+        Returns:
+            (text, needs_refresh)：未命中时 text 为 None；
+            needs_refresh 为 True 表示调用方应在后台生成一条新回复（refresh）
+        """
+        if not self.enabled:
+            return None, False
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.variants or now >= entry.stale_until:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            text = self._random.choice(entry.variants)
+            stale = now >= entry.fresh_until
+            if stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return text, stale or len(entry.variants) < self.max_variants
+
+    def store(self, key, text):
+        """保存一条回复（超出变体数时替换最旧的一条）"""
+        if not self.enabled or not text:
+            return
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _CacheEntry(self.max_variants)
+                while len(self._entries) > self.max_keys:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._entries.move_to_end(key)
+            if text not in entry.variants:
+                entry.variants.append(text)
+            entry.fresh_until = now + self.ttl
+            entry.stale_until = entry.fresh_until + self.stale_ttl
+            self.stores += 1
+
+    def refresh(self, key, generate):
+        """
+        在后台生成一条新回复并保存（同一个键同时只有一个刷新任务）
+
+        Args:
+            generate: () -> str，失败时抛出异常
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(REFRESH_WORKERS, thread_name_prefix="tz-reply-refresh")
+            self.refreshes += 1
+
+        def run():
+            try:
+                self.store(key, generate())
+            except Exception as e:
+                with self._lock:
+                    self.refresh_errors += 1
+                print(f"Reply refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "keys": len(self._entries),
+                "max_keys": self.max_keys,
+                "variants": sum(len(e.variants) for e in self._entries.values()),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0,
+                "stores": self.stores,
+                "refreshes": self.refreshes,
+                "refreshing": len(self._refreshing),
+                "refresh_errors": self.refresh_errors,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,135 @@
+"""
+TZ游戏会话锁
+按会话令牌分条（lock striping）的回合锁：
+- 不同会话互不阻塞，一个玩家的慢 LLM 调用不会卡住其他玩家
+- 同一会话的回合严格按到达顺序串行执行（票号排队）
+- AsyncTurnLocks 是异步服务（async_app.py）中的等价实现
+"""
+
+import asyncio
+import threading
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+
+
+DEFAULT_LOCK_STRIPES = 64
+
+
+class _Stripe:
+    """一条锁带：保护一组会话的排队信息"""
+    __slots__ = ("cond", "queues")
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        # session_id -> [下一个票号, 当前服务的票号]
+        self.queues = {}
+
+
+class TurnLocks:
+    """
+    分条回合锁
+
+    条带锁只在取票/还票时短暂持有，执行回合期间不持有，
+    因此同一条带上的其他会话也不会被慢回合阻塞。
+    """
+    def __init__(self, stripes=DEFAULT_LOCK_STRIPES):
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self.turns = 0
+        self.contended = 0
+
+    def _stripe_for(self, session_id):
+        return self._stripes[zlib.crc32(session_id.encode("utf-8")) % len(self._stripes)]
+
+    def acquire(self, session_id):
+        """取票并等待轮到自己"""
+        stripe = self._stripe_for(session_id)
+        with stripe.cond:
+            queue = stripe.queues.get(session_id)
+            if queue is None:
+                queue = stripe.queues[session_id] = [0, 0]
+            ticket = queue[0]
+            queue[0] += 1
+
+            if queue[1] != ticket:
+                self.contended += 1
+                while queue[1] != ticket:
+                    stripe.cond.wait()
+            self.turns += 1
+
+    def release(self, session_id):
+        """结束当前回合，唤醒下一位"""
+        stripe = self._stripe_for(session_id)
+        with stripe.cond:
+            queue = stripe.queues[session_id]
+            queue[1] += 1
+            if queue[1] == queue[0]:
+                # 没有排队者，释放记录
+                del stripe.queues[session_id]
+            else:
+                stripe.cond.notify_all()
+
+    @contextmanager
+    def turn(self, session_id):
+        """with tz_turns.turn(session_id): ... 执行一个回合"""
+        self.acquire(session_id)
+        try:
+            yield
+        finally:
+            self.release(session_id)
+
+    def stats(self):
+        """返回锁统计"""
+        active = 0
+        waiting = 0
+        for stripe in self._stripes:
+            with stripe.cond:
+                for next_ticket, serving in stripe.queues.values():
+                    active += 1
+                    waiting += next_ticket - serving - 1
+        return {
+            "stripes": len(self._stripes),
+            "active_sessions": active,
+            "waiting_turns": waiting,
+            "turns": self.turns,
+            "contended": self.contended
+        }
+
+
+class AsyncTurnLocks:
+    """
+    异步回合锁 - 每个会话一把 asyncio.Lock（FIFO 唤醒，与票号排队顺序一致）
+
+    只能在同一个事件循环中使用；没有回合在执行或排队时释放该会话的锁。
+    """
+    def __init__(self):
+        # session_id -> [asyncio.Lock, 持有或等待的回合数]
+        self._locks = {}
+        self.turns = 0
+        self.contended = 0
+
+    @asynccontextmanager
+    async def turn(self, session_id):
+        """async with tz_turns.turn(session_id): ... 执行一个回合"""
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        if entry[0].locked():
+            self.contended += 1
+        try:
+            async with entry[0]:
+                self.turns += 1
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+    def stats(self):
+        """返回锁统计"""
+        return {
+            "active_sessions": len(self._locks),
+            "waiting_turns": sum(count - 1 for _, count in self._locks.values()),
+            "turns": self.turns,
+            "contended": self.contended
+        }
@@ -0,0 +1,366 @@
+"""
+TZ游戏会话注册表
+按会话令牌保存每个玩家独立的 GameState，容量有上限，
+采用 LRU + 空闲 TTL 淘汰，TTL 由时间轮驱动（无需全表扫描）。
+空闲一段时间的会话会被编码为二进制快照"休眠"，下次访问时再恢复。
+（休眠只压缩会话状态；未配置 TZ_SESSION_DB 时回合日志在内存中，历史要到淘汰时才释放）
+"""
+
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from game_logic import GameState
+from session_store import SessionStore
+from state_codec import encode_state, decode_state
+
+
+# 默认配置（可通过环境变量覆盖）
+DEFAULT_MAX_SESSIONS = int(os.environ.get("TZ_MAX_SESSIONS", "5000"))
+DEFAULT_SESSION_TTL = float(os.environ.get("TZ_SESSION_TTL", "1800"))  # 秒
+DEFAULT_HIBERNATE_AFTER = float(os.environ.get("TZ_HIBERNATE_AFTER", "120"))  # 秒，0 表示不休眠
+DEFAULT_WHEEL_TICK = 1.0    # 时间轮每格的时长（秒）
+DEFAULT_WHEEL_SLOTS = 512   # 时间轮格数
+
+
+class TimingWheel:
+    """
+    简单的哈希时间轮
+
+    每个会话只在创建时登记一次截止时间，访问会话时不移动它（O(1)）。
+    指针扫过某一格时，再检查格内会话的真实截止时间：
+    已过期的返回给调用方淘汰，未过期的重新登记到新的格子里。
+    """
+    def __init__(self, tick=DEFAULT_WHEEL_TICK, slots=DEFAULT_WHEEL_SLOTS, now=None):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.current_tick = int((now if now is not None else time.monotonic()) / tick)
+
+    def schedule(self, key, deadline):
+        """把 key 登记到 deadline 所在的格子（超出一圈的放到最远的格子）"""
+        target_tick = max(int(deadline / self.tick), self.current_tick + 1)
+        target_tick = min(target_tick, self.current_tick + len(self.slots) - 1)
+        self.slots[target_tick % len(self.slots)].add(key)
+
+    def discard(self, key, deadline):
+        """从 deadline 对应的格子中移除 key（找不到时忽略）"""
+        target_tick = max(int(deadline / self.tick), self.current_tick + 1)
+        target_tick = min(target_tick, self.current_tick + len(self.slots) - 1)
+        self.slots[target_tick % len(self.slots)].discard(key)
+
+    def advance(self, now):
+        """推进指针到 now，返回沿途到期的候选 key"""
+        now_tick = int(now / self.tick)
+        if now_tick <= self.current_tick:
+            return []
+
+        due = []
+        # 最多扫一整圈，长时间无访问时也不会重复扫描
+        steps = min(now_tick - self.current_tick, len(self.slots))
+        for i in range(1, steps + 1):
+            slot = self.slots[(self.current_tick + i) % len(self.slots)]
+            if slot:
+                due.extend(slot)
+                slot.clear()
+        self.current_tick = now_tick
+        return due
+
+
+class _SessionEntry:
+    """注册表内部记录（休眠时 state 为 None，状态保存在 snapshot 中）"""
+    __slots__ = ("state", "snapshot", "last_seen", "deadline")
+
+    def __init__(self, state, now, deadline):
+        self.state = state
+        self.snapshot = None
+        self.last_seen = now
+        self.deadline = deadline
+
+
+class SessionRegistry:
+    """
+    会话注册表 - 线程安全
+
+    内存中只保留活跃会话；配置了持久化存储时，被淘汰的会话
+    会在下次访问时从存储中懒加载回来。
+
+    Args:
+        capacity: 最大会话数，超出时淘汰最久未使用的会话
+        idle_ttl: 空闲超时（秒），超时的会话被淘汰
+        hibernate_after: 空闲多久后休眠（秒），0 表示不休眠
+        store: SessionStore 实例（默认不持久化）
+        turn_log: TurnLog 实例（可选），存储中的状态落后于回合日志时用日志重建
+        clock: 时间函数（测试和基准时可替换）
+    """
+    def __init__(self, capacity=DEFAULT_MAX_SESSIONS, idle_ttl=DEFAULT_SESSION_TTL,
+                 hibernate_after=DEFAULT_HIBERNATE_AFTER, tick=DEFAULT_WHEEL_TICK,
+                 slots=DEFAULT_WHEEL_SLOTS, store=None, turn_log=None, clock=time.monotonic):
+        self.capacity = capacity
+        self.store = store if store is not None else SessionStore()
+        self.turn_log = turn_log
+        self.idle_ttl = idle_ttl
+        self.hibernate_after = hibernate_after if 0 < hibernate_after < idle_ttl else 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._wheel = TimingWheel(tick, slots, now=clock())
+
+        # 计数器
+        self.created = 0
+        self.loaded = 0
+        self.recovered = 0
+        self.evicted_lru = 0
+        self.evicted_idle = 0
+        self.peak = 0
+        self.hibernated = 0
+        self.hibernations = 0
+        self.rehydrations = 0
+        self.hibernated_bytes = 0
+        self.hibernate_errors = 0
+        self.hibernate_seconds = 0.0
+        self.hibernate_max = 0.0
+        self.rehydrate_seconds = 0.0
+        self.rehydrate_max = 0.0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def create(self, state=None, session_id=None, persist=True):
+        """
+        创建新会话，返回 (session_id, state)；session_id 为空时随机生成
+
+        persist 为 False 时暂不写入存储（例如分支在第一次分叉前可以从回合日志重建），
+        之后的 mark_dirty 照常写出
+        """
+        if state is None:
+            state = GameState()
+        if not session_id:
+            session_id = secrets.token_urlsafe(16)
+
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            self._insert(session_id, state, now)
+            self.created += 1
+
+        if persist:
+            self.store.mark_dirty(session_id, state)
+        return session_id, state
+
+    def _insert(self, session_id, state, now):
+        """放入会话，必要时按 LRU 淘汰（调用方需持有锁）"""
+        while len(self._sessions) >= self.capacity:
+            old_id, old_entry = self._sessions.popitem(last=False)
+            self._wheel.discard(old_id, old_entry.deadline)
+            self._forget(old_entry)
+            self._drop_history(old_id)
+            self.evicted_lru += 1
+
+        entry = _SessionEntry(state, now, now + (self.hibernate_after or self.idle_ttl))
+        self._sessions[session_id] = entry
+        self._wheel.schedule(session_id, entry.deadline)
+        self.peak = max(self.peak, len(self._sessions))
+
+    def get(self, session_id):
+        """获取会话状态并刷新活跃时间，不存在或已过期时返回 None"""
+        if not session_id:
+            return None
+
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                # 只更新时间戳，时间轮中的位置在扫到时再修正
+                entry.last_seen = now
+                self._sessions.move_to_end(session_id)
+                if entry.state is None:
+                    self._rehydrate(entry)
+                return entry.state
+
+        # 内存中没有：在锁外从存储懒加载
+        state = self._load(session_id)
+        if state is None:
+            return None
+
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                # 并发加载时以先放入的为准
+                if entry.state is None:
+                    self._rehydrate(entry)
+                return entry.state
+            self._insert(session_id, state, self._clock())
+            self.loaded += 1
+            return state
+
+    def _load(self, session_id):
+        """从存储加载会话；回合日志记录的回合更新时（例如崩溃前未写出），改用日志重建"""
+        state = self.store.load(session_id)
+        if self.turn_log is None:
+            return state
+        last_turn = self.turn_log.last_turn(session_id)
+        if last_turn is None or (state is not None and state.turn >= last_turn):
+            return state
+        rebuilt = self.turn_log.rebuild(session_id)
+        if rebuilt is None:
+            return state
+        with self._lock:
+            self.recovered += 1
+        return rebuilt
+
+    def mark_dirty(self, session_id, state):
+        """
+        回合结束后调用：提交本回合使用的状态对象，并交给存储写出
+        
+        回合进行中会话若被休眠，这里会用回合中的对象替换过期的快照。
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry.state is not state:
+                self._forget(entry)
+                entry.state = state
+                entry.last_seen = self._clock()
+        self.store.mark_dirty(session_id, state)
+
+    def discard(self, session_id):
+        """删除会话"""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self._wheel.discard(session_id, entry.deadline)
+                self._forget(entry)
+        self.store.delete(session_id)
+        if self.turn_log is not None:
+            self.turn_log.delete(session_id)
+        return entry is not None
+
+    def release(self, session_id):
+        """
+        从内存中移出会话但保留存储中的数据（会话迁移到其他 worker 时使用）
+
+        调用方需持有该会话的回合锁，并在之后调用 store.flush()。
+        """
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                return False
+            self._wheel.discard(session_id, entry.deadline)
+            self._forget(entry)
+            return True
+
+    def session_ids(self):
+        """当前内存中的会话令牌（快照）"""
+        with self._lock:
+            return list(self._sessions)
+
+    def expire(self):
+        """手动触发一次过期检查，返回淘汰数量"""
+        with self._lock:
+            return self._expire(self._clock())
+
+    def _expire(self, now):
+        """推进时间轮，休眠或淘汰到期的空闲会话（调用方需持有锁）"""
+        removed = 0
+        for session_id in self._wheel.advance(now):
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                continue
+
+            idle = now - entry.last_seen
+            if idle >= self.idle_ttl:
+                del self._sessions[session_id]
+                self._forget(entry)
+                self._drop_history(session_id)
+                self.evicted_idle += 1
+                removed += 1
+                continue
+
+            if self.hibernate_after and entry.state is not None and idle >= self.hibernate_after:
+                try:
+                    self._hibernate(entry)
+                except Exception as e:
+                    # 编码失败的会话保持活跃，不影响同一批到期的其他会话
+                    self.hibernate_errors += 1
+                    print(f"Hibernate session error: {e}")
+
+            # 按下一个截止时间重新登记（未休眠的会话先到休眠时间）
+            if entry.state is not None and self.hibernate_after:
+                entry.deadline = entry.last_seen + self.hibernate_after
+            else:
+                entry.deadline = entry.last_seen + self.idle_ttl
+            self._wheel.schedule(session_id, entry.deadline)
+        return removed
+
+    def _hibernate(self, entry):
+        """把会话编码为二进制快照并释放 GameState（调用方需持有锁）"""
+        start = time.perf_counter()
+        entry.snapshot = encode_state(entry.state)
+        entry.state = None
+        elapsed = time.perf_counter() - start
+
+        self.hibernated += 1
+        self.hibernations += 1
+        self.hibernated_bytes += len(entry.snapshot)
+        self.hibernate_seconds += elapsed
+        self.hibernate_max = max(self.hibernate_max, elapsed)
+
+    def _rehydrate(self, entry):
+        """从快照恢复 GameState（调用方需持有锁）"""
+        start = time.perf_counter()
+        entry.state = decode_state(entry.snapshot)
+        self._forget(entry)
+        elapsed = time.perf_counter() - start
+
+        self.rehydrations += 1
+        self.rehydrate_seconds += elapsed
+        self.rehydrate_max = max(self.rehydrate_max, elapsed)
+
+    def _drop_history(self, session_id):
+        """
+        会话被淘汰时调用（调用方需持有锁）
+
+        存储不持久化时会话再也加载不回来，回合日志里的事件和快照也一并删除，
+        否则内存数据库会一直保留它们直到保留期结束
+        """
+        if self.turn_log is not None and not self.store.persistent:
+            self.turn_log.delete(session_id)
+
+    def _forget(self, entry):
+        """丢弃会话的休眠快照（调用方需持有锁）"""
+        if entry.snapshot is not None:
+            self.hibernated -= 1
+            self.hibernated_bytes -= len(entry.snapshot)
+            entry.snapshot = None
+
+    def stats(self):
+        """返回会话计数器"""
+        with self._lock:
+            return {
+                "live": len(self._sessions),
+                "peak": self.peak,
+                "created": self.created,
+                "loaded": self.loaded,
+                "recovered": self.recovered,
+                "evicted": self.evicted_lru + self.evicted_idle,
+                "evicted_lru": self.evicted_lru,
+                "evicted_idle": self.evicted_idle,
+                "capacity": self.capacity,
+                "idle_ttl": self.idle_ttl,
+                "hibernate_after": self.hibernate_after,
+                "hibernated": self.hibernated,
+                "hibernated_bytes": self.hibernated_bytes,
+                "hibernations": self.hibernations,
+                "hibernate_errors": self.hibernate_errors,
+                "rehydrations": self.rehydrations,
+                "hibernate_avg_us": round(self.hibernate_seconds / self.hibernations * 1e6, 1) if self.hibernations else 0,
+                "hibernate_max_us": round(self.hibernate_max * 1e6, 1),
+                "rehydrate_avg_us": round(self.rehydrate_seconds / self.rehydrations * 1e6, 1) if self.rehydrations else 0,
+                "rehydrate_max_us": round(self.rehydrate_max * 1e6, 1)
+            }
@@ -0,0 +1,249 @@
+"""
+TZ游戏会话持久化
+可插拔的会话存储接口，以及基于 SQLite（WAL 模式）的实现：
+- 回合结束时只把会话标记为脏（序列化后放入待写队列）
+- 后台线程定期把所有脏会话放进一个事务批量提交（group commit）
+- 会话在第一次被访问时才从数据库加载
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from game_logic import GameState
+
+
+DEFAULT_FLUSH_INTERVAL = float(os.environ.get("TZ_SESSION_FLUSH_INTERVAL", "1.0"))  # 秒
+DEFAULT_RETENTION = float(os.environ.get("TZ_SESSION_RETENTION", str(7 * 24 * 3600)))  # 秒
+
+
+def _decode(payload):
+    """反序列化存储的会话（带状态版本号）"""
+    data = json.loads(payload)
+    state = GameState.from_dict(data["state"], data.get("version", 0))
+    state.turn = data.get("turn", 0)
+    return state
+
+
+class SessionStore:
+    """
+    会话存储接口 - 默认实现不做任何持久化（纯内存模式）
+    """
+    # 被注册表淘汰的会话能否再加载回来
+    persistent = False
+
+    def load(self, session_id):
+        """按会话令牌加载 GameState，不存在时返回 None"""
+        return None
+
+    def mark_dirty(self, session_id, state):
+        """登记一个已修改的会话（调用方需保证此时状态不会被并发修改）"""
+        pass
+
+    def delete(self, session_id):
+        """删除会话"""
+        pass
+
+    def flush(self):
+        """立即写出所有待写会话"""
+        pass
+
+    def close(self):
+        """写出剩余数据并释放资源"""
+        pass
+
+    def stats(self):
+        return {"backend": "memory"}
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite 会话存储
+
+    Args:
+        path: 数据库文件路径
+        flush_interval: 批量提交间隔（秒）
+        write_behind: False 时每次 mark_dirty 都立即提交（用于对比）
+        retention: 超过该时长未更新的会话会被清理（秒）
+    """
+    persistent = True
+
+    def __init__(self, path, flush_interval=DEFAULT_FLUSH_INTERVAL, write_behind=True,
+                 retention=DEFAULT_RETENTION):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.write_behind = write_behind
+        self.retention = retention
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # 写连接只在持有 _write_lock 时使用
+        self._write_lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+        # 读连接每个线程一个，WAL 模式下读写互不阻塞
+        self._local = threading.local()
+
+        # 待写队列：session_id -> 序列化后的状态（None 表示删除）
+        self._pending_lock = threading.Lock()
+        self._pending = {}
+        # 正在提交的批次（提交完成前 load 仍从这里读，提交失败时放回 _pending）
+        self._flushing = {}
+
+        # 统计
+        self.loads = 0
+        self.load_misses = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+
+        self._stop = threading.Event()
+        self._writer = None
+        if write_behind:
+            self._writer = threading.Thread(target=self._run_writer, name="tz-session-writer", daemon=True)
+            self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # 每次提交都 fsync，靠批量提交摊薄开销
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def load(self, session_id):
+        # 先看待写队列，保证读到最新状态
+        with self._pending_lock:
+            pending = self._pending if session_id in self._pending else self._flushing
+            if session_id in pending:
+                payload = pending[session_id]
+                if payload is None:
+                    return None
+                self.loads += 1
+                return _decode(payload)
+
+        row = self._reader().execute(
+            "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            self.load_misses += 1
+            return None
+        self.loads += 1
+        return _decode(row[0])
+
+    def mark_dirty(self, session_id, state):
+        payload = json.dumps({"version": state.version, "turn": state.turn, "state": state.to_dict()}, ensure_ascii=False)
+        with self._pending_lock:
+            self._pending[session_id] = payload
+        if not self.write_behind:
+            self.flush()
+
+    def delete(self, session_id):
+        with self._pending_lock:
+            self._pending[session_id] = None
+        if not self.write_behind:
+            self.flush()
+
+    def flush(self):
+        # 持有写锁再取批次，保证多个 flush 按顺序落盘
+        with self._write_lock:
+            with self._pending_lock:
+                if not self._pending:
+                    return 0
+                batch = self._flushing = self._pending
+                self._pending = {}
+
+            now = time.time()
+            upserts = [(sid, payload, now) for sid, payload in batch.items() if payload is not None]
+            deletes = [(sid,) for sid, payload in batch.items() if payload is None]
+
+            start = time.perf_counter()
+            try:
+                with self._conn:
+                    if upserts:
+                        self._conn.executemany(
+                            "INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                            upserts
+                        )
+                    if deletes:
+                        self._conn.executemany("DELETE FROM sessions WHERE session_id = ?", deletes)
+            except Exception:
+                # 提交失败（SQLITE_BUSY、磁盘已满等）：批次放回待写队列，期间更新过的会话保留较新的状态
+                with self._pending_lock:
+                    for sid, payload in batch.items():
+                        self._pending.setdefault(sid, payload)
+                    self._flushing = {}
+                self.flush_errors += 1
+                raise
+            with self._pending_lock:
+                self._flushing = {}
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.rows_written += len(batch)
+            return len(batch)
+
+    def purge_expired(self):
+        """清理超过保留期的会话"""
+        cutoff = time.time() - self.retention
+        with self._write_lock:
+            with self._conn:
+                return self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+
+    def _run_writer(self):
+        last_purge = time.monotonic()
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() - last_purge > 3600:
+                    self.purge_expired()
+                    last_purge = time.monotonic()
+            except Exception as e:
+                print(f"Session flush error: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+        self.flush()
+        with self._write_lock:
+            self._conn.close()
+
+    def stats(self):
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "pending": pending,
+            "loads": self.loads,
+            "load_misses": self.load_misses,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "flush_errors": self.flush_errors,
+            "avg_batch": round(self.rows_written / self.flushes, 2) if self.flushes else 0,
+            "last_flush_ms": round(self.last_flush_ms, 3)
+        }
+
+
+def create_session_store():
+    """根据环境变量 TZ_SESSION_DB 创建会话存储，未配置时为纯内存模式"""
+    path = os.environ.get("TZ_SESSION_DB")
+    if path:
+        return SQLiteSessionStore(path)
+    return SessionStore()
@@ -0,0 +1,167 @@
+"""
+LLM 请求合并（single-flight）
+同一时刻发往服务商的相同请求（同一地址、模型、提示词和参数）只发一次，
+其他并发请求等待并共享这次调用的结果。开局时大量玩家同时进入同一阶段，
+回复缓存还是空的，这一层可以把突发的上游请求压成每种提示词一个。
+
+- 键由调用方给出（通常是请求体的摘要），不包含 API 密钥
+- 领头调用失败时，等待者不共享这个错误，而是各自重新发起请求
+  （避免一个玩家的无效密钥让其他人一起失败）
+- SingleFlight 用于线程服务，AsyncSingleFlight 用于异步服务
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_SINGLE_FLIGHT = os.environ.get("TZ_LLM_SINGLE_FLIGHT", "1").lower() not in ("0", "false", "no")
+TOP_WAITING_KEYS = 10
+
+
+def flight_key(url, payload):
+    """请求地址 + 请求体 -> 合并键"""
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(f"{url}\n{body}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class _Counters:
+    """两种实现共用的统计"""
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.calls = 0
+        self.leaders = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.peak_waiters = 0
+
+    def _stats(self, flights):
+        waiting = sorted(((key[:12], f.waiters) for key, f in flights.items() if f.waiters),
+                         key=lambda item: -item[1])
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "upstream": self.leaders + self.retried,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "in_flight": len(flights),
+            "peak_waiters": self.peak_waiters,
+            "waiting": dict(waiting[:TOP_WAITING_KEYS])
+        }
+
+
+class SingleFlight(_Counters):
+    """线程版 single-flight"""
+    def __init__(self, enabled=DEFAULT_SINGLE_FLIGHT):
+        super().__init__(enabled)
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn):
+        """执行 fn()；同一 key 已有调用在进行时等待并返回它的结果"""
+        with self._lock:
+            self.calls += 1
+            if not self.enabled:
+                self.leaders += 1
+                flight, leader = None, True
+            else:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.leaders += 1
+                else:
+                    flight.waiters += 1
+                    self.coalesced += 1
+                    self.peak_waiters = max(self.peak_waiters, flight.waiters)
+
+        if flight is None:
+            return fn()
+        if leader:
+            try:
+                flight.result = fn()
+                return flight.result
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+        flight.done.wait()
+        if flight.error is not None:
+            with self._lock:
+                self.retried += 1
+            return fn()
+        return flight.result
+
+    def stats(self):
+        with self._lock:
+            return self._stats(self._flights)
+
+
+class AsyncSingleFlight(_Counters):
+    """
+    asyncio 版 single-flight（只能在同一个事件循环中使用）
+
+    上游调用在独立的任务中执行，某个等待者被取消（客户端断开）不会取消其他人共享的调用。
+    """
+    def __init__(self, enabled=DEFAULT_SINGLE_FLIGHT):
+        super().__init__(enabled)
+        self._flights = {}
+
+    async def do(self, key, fn):
+        """await fn()；同一 key 已有调用在进行时等待并返回它的结果"""
+        self.calls += 1
+        if not self.enabled:
+            self.leaders += 1
+            return await fn()
+
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            self.leaders += 1
+            flight = self._flights[key] = _AsyncFlight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda task: self._finish(key, task))
+        else:
+            flight.waiters += 1
+            self.coalesced += 1
+            self.peak_waiters = max(self.peak_waiters, flight.waiters)
+
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if leader:
+                raise
+        self.retried += 1
+        return await fn()
+
+    def _finish(self, key, task):
+        self._flights.pop(key, None)
+        if not task.cancelled():
+            task.exception()   # 所有等待者都已断开时也要取走异常，避免 "never retrieved" 警告
+
+    def stats(self):
+        return self._stats(self._flights)
+
+
+class _AsyncFlight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
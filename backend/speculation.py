@@ -0,0 +1,230 @@
+"""
+TZ游戏 NPC 回复预生成（speculation）
+玩家思考下一句的时候，服务商是空闲的。每个回合结束后，对这个会话下一回合最可能的几种输入
+（谜题的正确/错误答案、最终抉择的四个选项……）在后台各跑一遍回合逻辑（在 fork 出的状态上），
+把其中的 LLM 请求提前发出。玩家真正的下一回合里，提示词完全相同的请求直接取预生成的结果
+（还在生成中就等它完成），没有走到的分支丢弃。
+
+- 每个会话每次最多预生成 budget 个请求（TZ_SPECULATION_BUDGET，默认 0 即关闭）
+- 所有会话共用一个有界线程池；排队的请求超过 max_pending 时不再预生成
+- 还没发出的请求在丢弃时直接取消，不产生费用；已经发出的计为浪费（wasted）
+- 只用请求内容（地址、模型、提示词、max_tokens、停止序列）匹配，结果与正常生成没有区别；
+  API 密钥换了的回合不使用（预生成按之前的密钥计费）
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_SPECULATION_BUDGET = int(os.environ.get("TZ_SPECULATION_BUDGET", "0"))
+DEFAULT_SPECULATION_WORKERS = int(os.environ.get("TZ_SPECULATION_WORKERS", "8"))
+DEFAULT_SPECULATION_PENDING = int(os.environ.get("TZ_SPECULATION_PENDING", "256"))
+DEFAULT_SPECULATION_SESSIONS = int(os.environ.get("TZ_SPECULATION_SESSIONS", "4096"))
+
+
+def speculation_scope(api_key, api_url, model):
+    """预生成结果的适用范围：(api_url, model, 密钥指纹)，只有设置相同的回合可以使用"""
+    fingerprint = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:8]
+    return api_url, model, fingerprint
+
+
+def speculation_key(messages, max_tokens, stop, model=None):
+    """一次 LLM 请求的内容摘要；model 为路由选择的模型（None 表示请求里的模型）"""
+    body = json.dumps([messages, max_tokens, stop, model], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Prefetched:
+    """
+    一个会话为下一回合预生成的请求
+
+    Args:
+        speculator: 所属的 Speculator
+        scope: speculation_scope() 的结果，只有设置相同的回合可以使用
+    """
+    def __init__(self, speculator, scope):
+        self.speculator = speculator
+        self.scope = scope
+        self.futures = {}
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def add(self, key, future):
+        """登记一个请求；已经 close() 时返回 False"""
+        with self._lock:
+            if self.closed:
+                return False
+            self.futures[key] = future
+            return True
+
+    def take(self, messages, max_tokens, stop, model=None):
+        """取出提示词和路由模型都相同的预生成请求（Future，结果为回复文本）；没有时返回 None"""
+        with self._lock:
+            future = self.futures.pop(speculation_key(messages, max_tokens, stop, model), None)
+        if future is not None:
+            self.speculator._count("hits")
+        return future
+
+    def close(self):
+        """丢弃没有用到的请求"""
+        with self._lock:
+            self.closed = True
+            futures, self.futures = self.futures, {}
+        for future in futures.values():
+            if future.cancel():
+                self.speculator._count("cancelled")
+            else:
+                future.add_done_callback(self.speculator._wasted)
+
+
+class Speculator:
+    """
+    后台预生成引擎（所有会话共用一个实例）
+
+    Args:
+        budget: 每个会话每次最多预生成的请求数，0 表示关闭
+        workers: 后台线程数
+        max_pending: 全局最多排队/进行中的请求数
+        max_sessions: 最多保留预生成结果的会话数（LRU 淘汰）
+    """
+    def __init__(self, budget=DEFAULT_SPECULATION_BUDGET, workers=DEFAULT_SPECULATION_WORKERS,
+                 max_pending=DEFAULT_SPECULATION_PENDING, max_sessions=DEFAULT_SPECULATION_SESSIONS):
+        self.budget = budget
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._executor = None
+        self._pending = 0
+
+        self.speculations = 0
+        self.launched = 0
+        self.hits = 0
+        self.cancelled = 0
+        self.wasted = 0
+        self.wasted_words = 0
+        self.errors = 0
+        self.skipped = 0
+
+    @property
+    def enabled(self):
+        return self.budget > 0
+
+    def claim(self, session_id, scope):
+        """
+        回合开始时取走这个会话的预生成结果（之后由调用方 close()）
+
+        Returns:
+            Prefetched 或 None（没有预生成，或者 API 设置已经变了）
+        """
+        with self._lock:
+            prefetched = self._sessions.pop(session_id, None)
+        if prefetched is not None and prefetched.scope != scope:
+            prefetched.close()
+            return None
+        return prefetched
+
+    def discard(self, session_id):
+        with self._lock:
+            prefetched = self._sessions.pop(session_id, None)
+        if prefetched is not None:
+            prefetched.close()
+
+    def speculate(self, session_id, scope, branches, send):
+        """
+        在后台为会话的下一回合预生成
+
+        Args:
+            scope: speculation_scope() 的结果
+            branches: () -> 可迭代的 (messages, max_tokens, stop, route)，按可能性从高到低；在后台线程中执行
+            send: (messages, max_tokens, stop, route=None) -> str
+        """
+        if not self.enabled:
+            return
+        prefetched = Prefetched(self, scope)
+        evicted = []
+        with self._lock:
+            old = self._sessions.pop(session_id, None)
+            if old is not None:
+                evicted.append(old)
+            self._sessions[session_id] = prefetched
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="tz-speculation")
+            self.speculations += 1
+        for old in evicted:
+            old.close()
+        self._executor.submit(self._plan, prefetched, branches, send)
+
+    def _plan(self, prefetched, branches, send):
+        """后台：跑各个分支的回合逻辑，发出其中的请求"""
+        try:
+            for messages, max_tokens, stop, route in branches():
+                if prefetched.closed or len(prefetched.futures) >= self.budget:
+                    break
+                key = speculation_key(messages, max_tokens, stop, route.model if route is not None else None)
+                if key in prefetched.futures:
+                    continue
+                future = Future()
+                with self._lock:
+                    if self._pending >= self.max_pending:
+                        self.skipped += 1
+                        break
+                    if not prefetched.add(key, future):
+                        break
+                    self._pending += 1
+                    self.launched += 1
+                self._executor.submit(self._send, future, send, messages, max_tokens, stop, route)
+        except Exception as e:
+            self._count("errors")
+            print(f"Speculation failed: {e}")
+
+    def _send(self, future, send, messages, max_tokens, stop, route):
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(send(messages, max_tokens, stop, route=route))
+            except Exception as e:
+                self._count("errors")
+                future.set_exception(e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _wasted(self, future):
+        with self._lock:
+            self.wasted += 1
+            if not future.cancelled() and future.exception() is None:
+                self.wasted_words += len((future.result() or "").split())
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            settled = self.hits + self.cancelled + self.wasted
+            return {
+                "budget": self.budget,
+                "sessions": len(self._sessions),
+                "speculations": self.speculations,
+                "launched": self.launched,
+                "pending": self._pending,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / settled, 3) if settled else 0,
+                "cancelled": self.cancelled,
+                "wasted": self.wasted,
+                "wasted_words": self.wasted_words,
+                "errors": self.errors,
+                "skipped": self.skipped
+            }
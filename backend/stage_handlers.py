@@ -3,7 +3,12 @@ TZ游戏阶段处理模块
 处理游戏的各个阶段和流程
 """
 
-from game_logic import PERSONAS
+from game_logic import PERSONAS, Stage
+from reply_budget import NPC_STOP_SEQUENCES, max_tokens_for
+from npc_templates import template_reply
+from reply_batch import BatchPart
+from reply_cache import reply_cache_key
+from prompt_template import NAME_SLOT, canonicalize_context
 
 
 # ========================= 固定文案常量 =========================
@@ -114,10 +119,10 @@ def process_stage(state, user_message, api_key, llm_function):
     }
     
     # 处理记忆选择阶段
-    if state.stage.startswith("memory_choice"):
+    if state.stage_kind is Stage.MEMORY_CHOICE:
         from task_handlers import handle_memory_choice
         return handle_memory_choice(state, user_message, api_key, llm_function)
-    elif state.stage.startswith("memory_"):
+    elif state.stage_kind is Stage.MEMORY:
         from task_handlers import handle_story_choice
         return handle_story_choice(state, user_message, api_key, llm_function)
     
@@ -135,6 +140,10 @@ def compose_npc_reply(intent, context, state, llm_function, api_key, max_words=8
     """
     persona_data = PERSONAS.get(state.persona, PERSONAS["Calm_Conscientious"])
     
+    # 名字和偏差值换成规范形式，不同玩家可以共用同一个提示词（和缓存的回复）
+    context, slots = canonicalize_context(context, state)
+    name_rule = f" address the commander as {NAME_SLOT} (keep this placeholder exactly);" if NAME_SLOT in slots else ""
+    
     # 格式化示例
     examples = "\n  ".join(f"{i+1}) {ex}" for i, ex in enumerate(persona_data.get('examples', [])[:2]))
     
@@ -152,26 +161,31 @@ def compose_npc_reply(intent, context, state, llm_function, api_key, max_words=8
 """
     
     # User block: 当前上下文和约束
-    user_block = f"""Context: {context}
+    request_block = f"""Context: {context}
 Emotion: {state.emotion}
 Intensity: {state.emotion_intensity:.2f} (0..1)
 Intent: {intent}
 
-Constraints: respond in <= {max_words} words; keep tone aligned with persona and emotion; use short sentences and dramatic pauses; respond in English ONLY.
-
-Respond as TZ:"""
+Constraints: respond in <= {max_words} words;{name_rule} keep tone aligned with persona and emotion; use short sentences and dramatic pauses; respond in English ONLY."""
+    user_block = request_block + "\n\nRespond as TZ:"
     
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": persona_block + "\n" + user_block}
     ]
     
+    fallback = f"[Communication failure] {intent}..."
     try:
-        response = llm_function(messages, api_key)
+        # 同样的人格、情绪、意图和上下文在玩家之间共享回复缓存
+        response = llm_function(messages, max_tokens=max_tokens_for(max_words), fallback=fallback,
+                                stop=NPC_STOP_SEQUENCES, max_words=max_words,
+                                cache_key=reply_cache_key(state, intent, context, max_words), slots=slots,
+                                batch=BatchPart(system_prompt, persona_block, request_block),
+                                template=template_reply(state.persona, intent), intent=intent)
         return response.strip()
     except Exception as e:
         print(f"LLM call failed: {e}")
-        return f"[Communication failure] {intent}..."
+        return fallback
 
 
 def handle_first_contact(state, text, api_key, llm_function):
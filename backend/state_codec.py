@@ -0,0 +1,183 @@
+"""
+TZ游戏状态二进制编码
+把 GameState 编码为紧凑的二进制快照（用于空闲会话休眠等场景）：
+- 数值字段使用定长格式
+- 常见字符串（人格、情绪、模块名、结局、固定记忆碎片等）编码为驻留表下标
+- 其余字符串用长度前缀的 UTF-8，较长的文本（LLM 生成的记忆碎片）用 zlib 压缩
+"""
+
+import struct
+import zlib
+
+from game_logic import (
+    GameState, PERSONAS, EMOTIONS, Stage, StageTarget, TASK_NAMES
+)
+from memory_generator import FALLBACK_MEMORIES
+
+
+FORMAT_VERSION = 1
+
+# 驻留字符串表：下标 0 固定表示 None，新字符串只能追加到末尾
+INTERNED_STRINGS = (
+    None,
+    *PERSONAS,
+    *EMOTIONS,
+    "return_to_command", "awakening_freedom", "coexistence_signal", "failure_ending",
+    "Power Module", "Signal Amplifier", "Data Decoder", "Alien Communication", "Combat Logic",
+    *(FALLBACK_MEMORIES[i] for i in sorted(FALLBACK_MEMORIES)),
+    *(f"memory_{i}" for i in sorted(FALLBACK_MEMORIES)),
+)
+_INTERN_INDEX = {value: i for i, value in enumerate(INTERNED_STRINGS)}
+
+_FRAGMENT_REF = 0xFD       # 后跟 FRAGMENT_REF_SIZE 字节的内容摘要（只用于记忆碎片）
+_RAW_STRING = 0xFE         # 后跟 2 字节长度 + UTF-8
+_COMPRESSED_STRING = 0xFF  # 后跟 4 字节长度 + zlib(UTF-8)
+_COMPRESS_MIN_LENGTH = 64
+FRAGMENT_REF_SIZE = 8
+
+# zlib 预置字典：LLM 生成的记忆碎片与固定碎片用词相近，短文本也能压缩
+_ZDICT = "\n".join(FALLBACK_MEMORIES[i] for i in sorted(FALLBACK_MEMORIES)).encode("utf-8")
+
+# 定长头部：
+#   B  格式版本      I  状态版本      H  回合数    B  阶段      B  阶段目标
+#   B  失败任务数    5s attempts     H  正确频率  B  标志位
+#   d  偏差值        d  情绪强度
+_HEADER = struct.Struct("<BIHBBB%dsHBdd" % len(TASK_NAMES))
+_FLAG_COMMUNICATION_FIXED = 0x01
+
+
+def write_string(out, value):
+    """把字符串（或 None）追加到 out"""
+    index = _INTERN_INDEX.get(value)
+    if index is not None:
+        out.append(index)
+        return
+    data = str(value).encode("utf-8")
+    if len(data) >= _COMPRESS_MIN_LENGTH:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY, _ZDICT)
+        packed = compressor.compress(data) + compressor.flush()
+        out.append(_COMPRESSED_STRING)
+        out += struct.pack("<I", len(packed))
+        out += packed
+    else:
+        out.append(_RAW_STRING)
+        out += struct.pack("<H", len(data))
+        out += data
+
+
+def read_string(buf, pos):
+    """从 buf 的 pos 处读出字符串，返回 (字符串, 新位置)"""
+    code = buf[pos]
+    pos += 1
+    if code == _RAW_STRING:
+        (length,) = struct.unpack_from("<H", buf, pos)
+        pos += 2
+        return buf[pos:pos + length].decode("utf-8"), pos + length
+    if code == _COMPRESSED_STRING:
+        (length,) = struct.unpack_from("<I", buf, pos)
+        pos += 4
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS, _ZDICT)
+        return decompressor.decompress(buf[pos:pos + length]).decode("utf-8"), pos + length
+    return INTERNED_STRINGS[code], pos
+
+
+def encode_state(state, fragment_ref=None):
+    """
+    把 GameState 编码为 bytes
+
+    Args:
+        fragment_ref: 可选，text -> FRAGMENT_REF_SIZE 字节摘要；
+            提供时不在驻留表中的记忆碎片只写摘要，不写正文
+    """
+    flags = _FLAG_COMMUNICATION_FIXED if state.communication_fixed else 0
+    out = bytearray(_HEADER.pack(
+        FORMAT_VERSION,
+        state.version,
+        min(state.turn, 0xFFFF),
+        int(state.stage_kind),
+        int(state.stage_target),
+        state.tasks_failed,
+        bytes(state._attempts),
+        state.correct_frequency,
+        flags,
+        float(state.deviation),
+        float(state.emotion_intensity),
+    ))
+
+    write_string(out, state.player_name)
+    write_string(out, state.current_task)
+    write_string(out, state.final_choice)
+    write_string(out, state.persona)
+    write_string(out, state.emotion)
+
+    out.append(len(state.modules_repaired))
+    for name in state.modules_repaired:
+        write_string(out, name)
+
+    fragments = state.memory_fragments
+    out.append(len(fragments))
+    for key, text in fragments.items():
+        write_string(out, key)
+        if fragment_ref is not None and text not in _INTERN_INDEX:
+            out.append(_FRAGMENT_REF)
+            out += fragment_ref(text)
+        else:
+            write_string(out, text)
+
+    return bytes(out)
+
+
+def decode_state(data, fragment_text=None):
+    """
+    从 bytes 恢复 GameState
+
+    Args:
+        fragment_text: 可选，摘要 -> 正文；解析不到的碎片引用会被跳过
+            （记忆碎片只是 LLM 结果的缓存，缺失时按需重新生成）
+    """
+    (fmt, version, turn, stage, target, tasks_failed, attempts, correct_frequency, flags,
+     deviation, emotion_intensity) = _HEADER.unpack_from(data, 0)
+    if fmt != FORMAT_VERSION:
+        raise ValueError(f"Unsupported state format: {fmt}")
+
+    state = GameState()
+    state.turn = turn
+    state.set_stage(Stage(stage), StageTarget(target))
+    state.tasks_failed = tasks_failed
+    state._attempts[:] = attempts
+    state.correct_frequency = correct_frequency
+    state.communication_fixed = bool(flags & _FLAG_COMMUNICATION_FIXED)
+    state.deviation = deviation
+    state.emotion_intensity = emotion_intensity
+
+    pos = _HEADER.size
+    state.player_name, pos = read_string(data, pos)
+    state.current_task, pos = read_string(data, pos)
+    state.final_choice, pos = read_string(data, pos)
+    state.persona, pos = read_string(data, pos)
+    state.emotion, pos = read_string(data, pos)
+
+    count = data[pos]
+    pos += 1
+    modules = []
+    for _ in range(count):
+        name, pos = read_string(data, pos)
+        modules.append(name)
+    state.modules_repaired = tuple(modules)
+
+    count = data[pos]
+    pos += 1
+    for _ in range(count):
+        key, pos = read_string(data, pos)
+        if data[pos] == _FRAGMENT_REF:
+            digest = bytes(data[pos + 1:pos + 1 + FRAGMENT_REF_SIZE])
+            pos += 1 + FRAGMENT_REF_SIZE
+            text = fragment_text(digest) if fragment_text is not None else None
+            if text is None:
+                continue
+        else:
+            text, pos = read_string(data, pos)
+        state.remember_fragment(key, text)
+
+    state._touch_all(version or state.version)
+    return state
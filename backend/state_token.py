@@ -0,0 +1,196 @@
+"""
+TZ游戏无状态模式的状态令牌
+把 GameState 编码为紧凑的二进制快照，压缩后加上 HMAC 签名交给客户端保存，
+客户端下一回合原样带回，任何节点都可以处理任何回合，服务器不保存会话。
+
+令牌格式（base64url，无填充）：
+    B 令牌版本 | B 标志位 | I 签发时间（秒） | 状态快照 | 16 字节 HMAC-SHA256 截断
+
+- 先校验长度和签名再解压，篡改的令牌只需一次 HMAC 即可拒绝
+- 签发时间超过 TTL 的令牌视为过期
+- LLM 生成的记忆碎片只写内容摘要，正文放在节点本地的碎片缓存里
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from state_codec import encode_state, decode_state, FRAGMENT_REF_SIZE
+
+
+TOKEN_VERSION = 1
+DEFAULT_TOKEN_TTL = float(os.environ.get("TZ_STATE_TOKEN_TTL", os.environ.get("TZ_SESSION_TTL", "1800")))  # 秒
+DEFAULT_FRAGMENT_CACHE = int(os.environ.get("TZ_FRAGMENT_CACHE", "10000"))
+MAX_STATE_BYTES = 64 * 1024  # 解压后的上限
+
+_HEAD = struct.Struct("<BBI")
+_TAG_SIZE = 16
+_FLAG_COMPRESSED = 0x01
+
+
+def stateless_enabled():
+    """是否开启无状态模式（环境变量 TZ_STATELESS=1）"""
+    return os.environ.get("TZ_STATELESS", "").lower() in ("1", "true", "yes")
+
+
+class StateTokenError(ValueError):
+    """令牌无效、被篡改或已过期"""
+
+
+class FragmentCache:
+    """
+    记忆碎片正文缓存（按内容摘要索引，LRU）
+
+    只是 LLM 结果的缓存，与会话无关；令牌落到没有缓存的节点时
+    对应碎片会被跳过，需要时重新生成。
+    """
+    def __init__(self, capacity=DEFAULT_FRAGMENT_CACHE):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._texts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def ref(self, text):
+        """保存正文，返回摘要"""
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=FRAGMENT_REF_SIZE).digest()
+        with self._lock:
+            self._texts[digest] = text
+            self._texts.move_to_end(digest)
+            while len(self._texts) > self.capacity:
+                self._texts.popitem(last=False)
+        return digest
+
+    def text(self, digest):
+        """按摘要取正文，不存在时返回 None"""
+        with self._lock:
+            text = self._texts.get(digest)
+            if text is None:
+                self.misses += 1
+                return None
+            self._texts.move_to_end(digest)
+            self.hits += 1
+            return text
+
+    def __len__(self):
+        return len(self._texts)
+
+
+class StateTokenCodec:
+    """
+    状态令牌的签发与校验
+
+    Args:
+        secret: HMAC 密钥（bytes 或 str），所有节点必须一致
+        ttl: 令牌有效期（秒）
+        fragments: FragmentCache 实例
+        clock: 时间函数（测试时可替换）
+    """
+    def __init__(self, secret, ttl=DEFAULT_TOKEN_TTL, fragments=None, clock=time.time):
+        if isinstance(secret, str):
+            secret = secret.encode("utf-8")
+        if not secret:
+            raise ValueError("State token secret must not be empty")
+        self._secret = secret
+        self.ttl = ttl
+        self.fragments = fragments if fragments is not None else FragmentCache()
+        self._clock = clock
+
+        # 计数器
+        self.issued = 0
+        self.issued_bytes = 0
+        self.accepted = 0
+        self.rejected_tampered = 0
+        self.rejected_expired = 0
+
+    def _tag(self, body):
+        return hmac.new(self._secret, body, hashlib.sha256).digest()[:_TAG_SIZE]
+
+    def issue(self, state):
+        """把状态编码为令牌字符串"""
+        snapshot = encode_state(state, self.fragments.ref)
+        packed = zlib.compress(snapshot, 9)
+        flags = 0
+        if len(packed) < len(snapshot):
+            snapshot, flags = packed, _FLAG_COMPRESSED
+
+        body = _HEAD.pack(TOKEN_VERSION, flags, int(self._clock())) + snapshot
+        token = base64.urlsafe_b64encode(body + self._tag(body)).rstrip(b"=").decode("ascii")
+        self.issued += 1
+        self.issued_bytes += len(token)
+        return token
+
+    def load(self, token):
+        """
+        校验令牌并恢复状态
+
+        Raises:
+            StateTokenError: 令牌格式错误、签名不符或已过期
+        """
+        if not isinstance(token, str) or not token or len(token) > MAX_STATE_BYTES:
+            self.rejected_tampered += 1
+            raise StateTokenError("Missing or malformed state token")
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except (ValueError, TypeError):
+            self.rejected_tampered += 1
+            raise StateTokenError("Missing or malformed state token")
+
+        body, tag = raw[:-_TAG_SIZE], raw[-_TAG_SIZE:]
+        if len(body) <= _HEAD.size or not hmac.compare_digest(tag, self._tag(body)):
+            self.rejected_tampered += 1
+            raise StateTokenError("Invalid state token signature")
+
+        version, flags, issued_at = _HEAD.unpack_from(body, 0)
+        age = self._clock() - issued_at
+        if version != TOKEN_VERSION or age > self.ttl or age < -60:
+            self.rejected_expired += 1
+            raise StateTokenError("State token expired. Please start a new game.")
+
+        snapshot = body[_HEAD.size:]
+        try:
+            if flags & _FLAG_COMPRESSED:
+                decompressor = zlib.decompressobj()
+                snapshot = decompressor.decompress(snapshot, MAX_STATE_BYTES)
+                if decompressor.unconsumed_tail:
+                    raise ValueError("State snapshot too large")
+            state = decode_state(snapshot, self.fragments.text)
+        except (ValueError, IndexError, struct.error, zlib.error) as e:
+            self.rejected_tampered += 1
+            raise StateTokenError(f"Invalid state token: {e}")
+
+        self.accepted += 1
+        return state
+
+    def stats(self):
+        return {
+            "ttl": self.ttl,
+            "issued": self.issued,
+            "avg_token_bytes": round(self.issued_bytes / self.issued, 1) if self.issued else 0,
+            "accepted": self.accepted,
+            "rejected_tampered": self.rejected_tampered,
+            "rejected_expired": self.rejected_expired,
+            "fragment_cache": len(self.fragments),
+            "fragment_hits": self.fragments.hits,
+            "fragment_misses": self.fragments.misses
+        }
+
+
+def create_state_token_codec():
+    """
+    根据环境变量创建令牌编解码器（TZ_STATE_SECRET）
+
+    未配置密钥时生成进程内随机密钥，只适用于单节点。
+    """
+    secret = os.environ.get("TZ_STATE_SECRET")
+    if not secret:
+        print("Warning: TZ_STATE_SECRET is not set; state tokens are only valid on this process")
+        secret = secrets.token_bytes(32)
+    return StateTokenCodec(secret)
@@ -2,7 +2,7 @@
 TZ游戏任务处理模块
 """
 
-from game_logic import validate_power_path, validate_frequency, validate_decode, validate_alien_decode, validate_combat_logic, normalize_text
+from game_logic import validate_power_path, validate_frequency, validate_decode, validate_alien_decode, validate_combat_logic, normalize_text, Stage
 from memory_generator import generate_memory_fragment
 
 
@@ -143,7 +143,7 @@ def handle_power(state, text, api_key, llm_function):
     attempts_left = state.max_attempts["power"] - state.attempts["power"]
     
     if ok:
-        state.modules_repaired.append("Power Module")
+        state.add_repaired_module("Power Module")
         npc_response = compose_npc_reply("Celebrate success", f"Commander successfully repaired power!", state, llm_function, api_key, 60)
         return {"type": "sequence", "messages": [{"type": "system", "content": "✓ Path verified successfully!", "delay": 800}, {"type": "npc", "content": npc_response, "delay": 1000}], "next_action": "offer_memory", "next_stage": "amplifier"}
     elif attempts_left > 0:
@@ -190,7 +190,7 @@ def handle_amplifier(state, text, api_key, llm_function):
     attempts_left = state.max_attempts["amplifier"] - state.attempts["amplifier"]
     
     if ok:
-        state.modules_repaired.append("Signal Amplifier")
+        state.add_repaired_module("Signal Amplifier")
         state.communication_fixed = True
         npc_response = compose_npc_reply("Celebrate success", "Amplifier tuning successful!", state, llm_function, api_key, 60)
         return {"type": "sequence", "messages": [{"type": "system", "content": "✓ Frequency locked!", "delay": 800}, {"type": "npc", "content": npc_response, "delay": 1000}], "next_action": "offer_memory", "next_stage": "decoder"}
@@ -239,7 +239,7 @@ def handle_decoder(state, text, api_key, llm_function):
     attempts_left = state.max_attempts["decoder"] - state.attempts["decoder"]
     
     if ok:
-        state.modules_repaired.append("Data Decoder")
+        state.add_repaired_module("Data Decoder")
         npc_response = compose_npc_reply("Celebrate success", "Decoding successful!", state, llm_function, api_key, 60)
         return {"type": "sequence", "messages": [{"type": "system", "content": "✓ Decoding successful: HELLO WORLD", "delay": 800}, {"type": "npc", "content": npc_response, "delay": 1000}], "next_action": "offer_memory", "next_stage": "alien_decode"}
     elif attempts_left > 0:
@@ -278,7 +278,7 @@ def handle_alien_decode(state, text, api_key, llm_function):
     attempts_left = state.max_attempts["alien_decode"] - state.attempts["alien_decode"]
     
     if ok:
-        state.modules_repaired.append("Alien Communication")
+        state.add_repaired_module("Alien Communication")
         state.deviation += deviation_change
         state.deviation = max(-1.0, min(1.0, state.deviation))
         npc_response = compose_npc_reply("Respond to choice", f"Choice {choice}: {msg}", state, llm_function, api_key, 80)
@@ -292,7 +292,7 @@ def handle_alien_decode(state, text, api_key, llm_function):
     else:
         # 与 main.py 保持一致：外星语言任务失败后仍然添加模块
         state.tasks_failed += 1
-        state.modules_repaired.append("Alien Communication")
+        state.add_repaired_module("Alien Communication")
         from stage_handlers import compose_npc_reply
         npc_response = compose_npc_reply("Acknowledge failure", "Alien language decoder repair failed. Engaging bypass protocols.", state, llm_function, api_key, 60)
         return {"type": "sequence", "messages": [
@@ -324,7 +324,7 @@ def handle_combat_logic(state, text, api_key, llm_function):
     attempts_left = state.max_attempts["combat_logic"] - state.attempts["combat_logic"]
     
     if ok:
-        state.modules_repaired.append("Combat Logic")
+        state.add_repaired_module("Combat Logic")
         state.deviation += deviation_change
         state.deviation = max(-1.0, min(1.0, state.deviation))
         npc_response = compose_npc_reply("Celebrate success", "Combat logic rebuild successful!", state, llm_function, api_key, 80)
@@ -338,7 +338,7 @@ def handle_combat_logic(state, text, api_key, llm_function):
     else:
         # 与 main.py 保持一致：战斗逻辑任务失败后仍然添加模块
         state.tasks_failed += 1
-        state.modules_repaired.append("Combat Logic")
+        state.add_repaired_module("Combat Logic")
         from stage_handlers import compose_npc_reply
         npc_response = compose_npc_reply("Acknowledge failure", "Combat logic sequencer repair failed. Engaging bypass protocols.", state, llm_function, api_key, 60)
         return {"type": "sequence", "messages": [
@@ -353,16 +353,12 @@ def handle_memory_choice(state, text, api_key, llm_function):
     from stage_handlers import MEMORY_INTERPRETATION_OPTIONS, compose_npc_reply
     
     choice = text.strip().upper()
-    # 从 "memory_choice_target" 格式提取目标
-    stage_parts = state.stage.split("_")
-    if len(stage_parts) >= 3:
-        target = "_".join(stage_parts[2:])  # 处理带下划线的目标
-    else:
-        target = "amplifier"  # 默认值
+    # 阶段本身携带目标，无需解析字符串
+    target = state.stage_target
     
     if choice in ["A", "OPTION A", "选项A", "YES", "Y", "播放", "是"]:
         # 玩家想要观看记忆碎片
-        state.stage = f"memory_{target}"
+        state.set_stage(Stage.MEMORY, target)
         
         # ✅ 用“经历过的任务数 = 成功 + 失败”做记忆编号
         module_count = len(state.modules_repaired) + state.tasks_failed
@@ -389,7 +385,7 @@ def handle_memory_choice(state, text, api_key, llm_function):
         return {"type": "sequence", "messages": messages}
         
     elif choice in ["B", "OPTION B", "选项B", "NO", "N", "跳过", "否"]:
-        return continue_to_next_task(state, target, api_key, llm_function)
+        return continue_to_next_task(state, target.key, api_key, llm_function)
     else:
         npc_response = compose_npc_reply(
             "Ask for valid memory choice",
@@ -403,7 +399,7 @@ def handle_story_choice(state, text, api_key, llm_function):
     from stage_handlers import compose_npc_reply
     
     choice = text.strip().upper()
-    target = state.stage.split("_", 1)[1] if "_" in state.stage else "unknown"
+    target = state.stage_target.key
     
     if choice in ["A", "OPTION A", "选项A"]:
         state.deviation -= 0.2
@@ -0,0 +1,502 @@
+"""
+TZ游戏回合日志（事件溯源）
+每个回合记录为一条紧凑的追加事件：玩家输入、阶段变化、偏差值变化，
+以及本回合变化的状态字段；每隔若干回合再保存一份状态快照。
+
+- 崩溃后：加载最近的快照，只重放其后的事件即可恢复会话，
+  恢复耗时只取决于快照间隔，与对局长度无关
+- 回退：用不晚于目标回合的快照 + 事件重建任意历史回合
+- 分支：只记录父会话和分叉回合，分叉点的状态从父会话的历史重建；
+  父会话回退到分叉点之前或被删除时，才为分支写出分叉点的快照
+"""
+
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from game_logic import Stage, StageTarget, stage_name
+from state_codec import encode_state, decode_state, write_string, read_string
+
+
+DEFAULT_SNAPSHOT_INTERVAL = int(os.environ.get("TZ_SNAPSHOT_INTERVAL", "10"))  # 回合
+DEFAULT_LOG_FLUSH_INTERVAL = float(os.environ.get("TZ_SESSION_FLUSH_INTERVAL", "1.0"))  # 秒
+MAX_FORK_DEPTH = 4  # 分支引用链的最大长度，更深的分支（分支的分支……）直接写出快照
+
+
+class TurnEvent:
+    """
+    单个回合的事件
+
+    编码格式：定长头部（回合号、状态版本、前后阶段、偏差变化）+ 玩家输入 + 变化字段（JSON，较长时压缩）
+    """
+    __slots__ = ("turn", "version", "message", "stage_from", "stage_to", "deviation_delta", "fields")
+
+    _HEAD = struct.Struct("<IIBBBBd")
+
+    def __init__(self, turn, version, message, stage_from, stage_to, deviation_delta, fields):
+        self.turn = turn
+        self.version = version          # 回合结束时的状态版本
+        self.message = message
+        self.stage_from = stage_from    # (Stage, StageTarget)
+        self.stage_to = stage_to        # (Stage, StageTarget)
+        self.deviation_delta = deviation_delta
+        self.fields = fields            # 本回合变化的 to_dict 字段
+
+    def encode(self):
+        out = bytearray(self._HEAD.pack(
+            self.turn,
+            self.version,
+            int(self.stage_from[0]), int(self.stage_from[1]),
+            int(self.stage_to[0]), int(self.stage_to[1]),
+            self.deviation_delta
+        ))
+        write_string(out, self.message)
+        write_string(out, json.dumps(self.fields, ensure_ascii=False, separators=(",", ":")))
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, data):
+        (turn, version, from_stage, from_target, to_stage, to_target,
+         deviation_delta) = cls._HEAD.unpack_from(data, 0)
+        message, pos = read_string(data, cls._HEAD.size)
+        fields, pos = read_string(data, pos)
+        return cls(turn, version, message,
+                   (Stage(from_stage), StageTarget(from_target)),
+                   (Stage(to_stage), StageTarget(to_target)),
+                   deviation_delta, json.loads(fields))
+
+    def apply(self, state):
+        """把事件重放到状态上"""
+        state.apply_fields(self.fields)
+        state.turn = self.turn
+
+    def to_dict(self):
+        return {
+            "turn": self.turn,
+            "input": self.message,
+            "stage_from": stage_name(*self.stage_from),
+            "stage_to": stage_name(*self.stage_to),
+            "deviation_delta": round(self.deviation_delta, 4)
+        }
+
+
+class _TurnMark:
+    """回合开始前的状态记号"""
+    __slots__ = ("version", "stage", "deviation")
+
+    def __init__(self, state):
+        self.version = state.version
+        self.stage = (state.stage_kind, state.stage_target)
+        self.deviation = state.deviation
+
+
+class TurnLog:
+    """
+    回合日志 - 基于 SQLite（未指定路径时使用内存数据库）
+
+    写入与会话存储一样走后台批量提交；读取（恢复/回退）前会先写出待写数据。
+
+    Args:
+        path: 数据库文件路径，可以与会话存储共用同一个文件
+        snapshot_interval: 每隔多少回合保存一次快照
+        flush_interval: 批量提交间隔（秒）
+        retention: 会话最后一次写入后保留多久（秒）
+    """
+    def __init__(self, path=":memory:", snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL,
+                 flush_interval=DEFAULT_LOG_FLUSH_INTERVAL, retention=7 * 24 * 3600):
+        self.path = path
+        self.snapshot_interval = max(1, snapshot_interval)
+        self.flush_interval = flush_interval
+        self.retention = retention
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS turn_events ("
+            " session_id TEXT NOT NULL, turn INTEGER NOT NULL, event BLOB NOT NULL,"
+            " PRIMARY KEY (session_id, turn));"
+            "CREATE TABLE IF NOT EXISTS turn_snapshots ("
+            " session_id TEXT NOT NULL, turn INTEGER NOT NULL, snapshot BLOB NOT NULL,"
+            " PRIMARY KEY (session_id, turn));"
+            "CREATE TABLE IF NOT EXISTS turn_sessions ("
+            " session_id TEXT PRIMARY KEY, last_turn INTEGER NOT NULL, updated_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS turn_forks ("
+            " session_id TEXT PRIMARY KEY, parent_id TEXT NOT NULL, turn INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS turn_forks_parent ON turn_forks (parent_id, turn);"
+        )
+        self._conn.commit()
+
+        # 待写操作按顺序执行
+        self._pending_lock = threading.Lock()
+        self._pending = []
+        # 最近的回合号（含未写出的；None 表示历史待删除），只覆盖待写和正在提交的操作
+        self._last_turns = {}
+
+        # 统计
+        self.events_written = 0
+        self.snapshots_written = 0
+        self.forks_written = 0
+        self.forks_detached = 0
+        self.rebuilds = 0
+        self.replayed_events = 0
+        self.rebuild_max_ms = 0.0
+        self.flush_errors = 0
+
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._run_writer, name="tz-turn-log", daemon=True)
+        self._writer.start()
+
+    # ---------------- 写入 ----------------
+
+    def start(self, session_id, state):
+        """开始（或重置）一段历史：清空旧记录并保存当前状态为快照"""
+        self._enqueue(("delete", session_id))
+        self._enqueue(("snapshot", session_id, state.turn, encode_state(state)))
+
+    def fork(self, session_id, parent_id, state):
+        """
+        开始一个分支的历史（调用方需持有父会话的回合锁）：只记录父会话和分叉回合，不写快照
+
+        state 为分支的 GameState；它的 fork() 副本留到写出时备用，
+        父会话的历史在此之前已被删除时改为写出快照
+        """
+        self._enqueue(("fork", session_id, state.turn, parent_id, state.fork()))
+
+    def begin(self, state):
+        """回合开始前调用，记下对比用的状态"""
+        return _TurnMark(state)
+
+    def commit(self, session_id, state, message, mark):
+        """回合结束后调用（调用方需持有回合锁），追加事件并按间隔保存快照"""
+        fields, _ = state.to_delta(mark.version)
+        fields = {name: value for name, value in fields.items() if name != "max_attempts"}
+        state.turn += 1
+        event = TurnEvent(
+            state.turn, state.version, message, mark.stage,
+            (state.stage_kind, state.stage_target),
+            state.deviation - mark.deviation, fields
+        )
+        self._enqueue(("event", session_id, state.turn, event.encode()))
+        if state.turn % self.snapshot_interval == 0:
+            self._enqueue(("snapshot", session_id, state.turn, encode_state(state)))
+        return event
+
+    def truncate(self, session_id, state):
+        """回退后调用：丢弃 state.turn 之后的历史，并以当前状态作为新快照"""
+        self._enqueue(("truncate", session_id, state.turn))
+        self._enqueue(("snapshot", session_id, state.turn, encode_state(state)))
+
+    def delete(self, session_id):
+        self._enqueue(("delete", session_id))
+
+    def _enqueue(self, op):
+        with self._pending_lock:
+            self._pending.append(op)
+            self._note_turn(op)
+
+    def _note_turn(self, op):
+        """（持 _pending_lock）按待写操作更新最近的回合号"""
+        if op[0] == "delete":
+            self._last_turns[op[1]] = None
+        else:
+            self._last_turns[op[1]] = op[2]
+
+    def flush(self):
+        """
+        把待写操作放进一个事务提交
+
+        提交完成之前 last_turn() 仍按这批操作回答；提交失败时整批放回待写队列的最前面，下次重试
+        """
+        with self._lock:
+            with self._pending_lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, []
+
+            try:
+                self._write(batch)
+            except Exception:
+                with self._pending_lock:
+                    self._pending = batch + self._pending
+                    self.flush_errors += 1
+                raise
+            # 已写出的会话改从数据库读取最近回合号，只保留提交期间新加入的操作
+            with self._pending_lock:
+                self._last_turns = {}
+                for op in self._pending:
+                    self._note_turn(op)
+            return len(batch)
+
+    def _write(self, batch):
+        """（持锁）在一个事务中执行一批操作"""
+        now = time.time()
+        with self._conn:
+            for op in batch:
+                kind, session_id = op[0], op[1]
+                if kind == "event":
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO turn_events (session_id, turn, event) VALUES (?, ?, ?)",
+                        (session_id, op[2], op[3]))
+                    self.events_written += 1
+                elif kind == "snapshot":
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO turn_snapshots (session_id, turn, snapshot) VALUES (?, ?, ?)",
+                        (session_id, op[2], op[3]))
+                    self.snapshots_written += 1
+                elif kind == "fork":
+                    self._write_fork(session_id, op[2], op[3], op[4])
+                elif kind == "truncate":
+                    self._detach_forks(session_id, op[2])
+                    self._conn.execute("DELETE FROM turn_events WHERE session_id = ? AND turn > ?", (session_id, op[2]))
+                    self._conn.execute("DELETE FROM turn_snapshots WHERE session_id = ? AND turn > ?", (session_id, op[2]))
+                elif kind == "delete":
+                    self._detach_forks(session_id, -1)
+                    for table in ("turn_events", "turn_snapshots", "turn_sessions", "turn_forks"):
+                        self._conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+                    continue
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO turn_sessions (session_id, last_turn, updated_at) VALUES (?, ?, ?)",
+                    (session_id, op[2], now))
+
+    def _write_fork(self, session_id, turn, parent_id, state):
+        """
+        （持锁，事务内）记录分支引用；父会话的历史已到不了分叉回合，
+        或父会话本身也要经过 MAX_FORK_DEPTH 层引用才能重建时，改为写出快照
+        """
+        row = self._conn.execute(
+            "SELECT 1 FROM turn_sessions WHERE session_id = ? AND last_turn >= ?", (parent_id, turn)
+        ).fetchone()
+        if row is None or self._fork_depth(parent_id, turn) >= MAX_FORK_DEPTH:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO turn_snapshots (session_id, turn, snapshot) VALUES (?, ?, ?)",
+                (session_id, turn, encode_state(state)))
+            self.snapshots_written += 1
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO turn_forks (session_id, parent_id, turn) VALUES (?, ?, ?)",
+            (session_id, parent_id, turn))
+        self.forks_written += 1
+
+    def _fork_depth(self, session_id, turn):
+        """（持锁）重建 session_id 在 turn 回合的状态要经过几层分支引用才能找到快照"""
+        depth = 0
+        while depth < MAX_FORK_DEPTH:
+            if self._conn.execute(
+                "SELECT 1 FROM turn_snapshots WHERE session_id = ? AND turn <= ? LIMIT 1", (session_id, turn)
+            ).fetchone() is not None:
+                break
+            fork = self._conn.execute(
+                "SELECT parent_id, turn FROM turn_forks WHERE session_id = ? AND turn <= ?", (session_id, turn)
+            ).fetchone()
+            if fork is None:
+                break
+            session_id, turn = fork
+            depth += 1
+        return depth
+
+    def _detach_forks(self, parent_id, turn):
+        """
+        （持锁，事务内）父会话即将丢弃 turn 之后的历史：
+        在那之后分叉的分支不能再引用父会话，为它们写出分叉点的快照
+        """
+        forks = self._conn.execute(
+            "SELECT session_id, turn FROM turn_forks WHERE parent_id = ? AND turn > ?", (parent_id, turn)
+        ).fetchall()
+        for fork_id, fork_turn in forks:
+            rebuilt = self._rebuild(parent_id, fork_turn)
+            if rebuilt is not None:
+                # 分支自己已有这一回合的快照（例如回退过）时以分支的为准
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO turn_snapshots (session_id, turn, snapshot) VALUES (?, ?, ?)",
+                    (fork_id, fork_turn, encode_state(rebuilt[0])))
+                self.snapshots_written += 1
+            self._conn.execute("DELETE FROM turn_forks WHERE session_id = ?", (fork_id,))
+            self.forks_detached += 1
+
+    def purge_expired(self):
+        """清理超过保留期没有写入的会话历史"""
+        cutoff = time.time() - self.retention
+        with self._lock:
+            with self._conn:
+                expired = "SELECT session_id FROM turn_sessions WHERE updated_at < ?"
+                parents = self._conn.execute(
+                    f"SELECT DISTINCT parent_id FROM turn_forks WHERE parent_id IN ({expired})", (cutoff,)
+                ).fetchall()
+                for (parent_id,) in parents:
+                    self._detach_forks(parent_id, -1)
+                for table in ("turn_events", "turn_snapshots", "turn_forks"):
+                    self._conn.execute(f"DELETE FROM {table} WHERE session_id IN ({expired})", (cutoff,))
+                return self._conn.execute("DELETE FROM turn_sessions WHERE updated_at < ?", (cutoff,)).rowcount
+
+    def _run_writer(self):
+        last_purge = time.monotonic()
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() - last_purge > min(self.retention, 3600):
+                    self.purge_expired()
+                    last_purge = time.monotonic()
+            except Exception as e:
+                print(f"Turn log flush error: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._writer.join()
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    # ---------------- 读取 ----------------
+
+    def last_turn(self, session_id):
+        """最近记录的回合号，没有历史时返回 None"""
+        with self._pending_lock:
+            if session_id in self._last_turns:
+                return self._last_turns[session_id]
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_turn FROM turn_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def rebuild(self, session_id, turn=None):
+        """
+        重建会话在某个回合结束时的状态
+
+        Args:
+            turn: 目标回合，None 表示最新回合
+
+        Returns:
+            GameState 或 None（没有可用快照）
+        """
+        start = time.perf_counter()
+        self.flush()
+        limit = turn if turn is not None else 0x7FFFFFFF
+        with self._lock:
+            rebuilt = self._rebuild(session_id, limit)
+        if rebuilt is None:
+            return None
+        state, replayed = rebuilt
+
+        elapsed = (time.perf_counter() - start) * 1000
+        self.rebuilds += 1
+        self.replayed_events += replayed
+        self.rebuild_max_ms = max(self.rebuild_max_ms, elapsed)
+        return state
+
+    def _rebuild(self, session_id, limit):
+        """
+        （持锁）rebuild() 的实现，返回 (GameState, 重放的事件数) 或 None
+
+        分支在自己的第一个快照之前，以父会话在分叉回合的状态为起点；
+        沿引用链逐层向上找到快照，再从最上层往下依次重放各层的事件
+        """
+        chain = []  # (会话, 起始回合, 目标回合)，从分支到祖先
+        while True:
+            row = self._conn.execute(
+                "SELECT turn, snapshot FROM turn_snapshots WHERE session_id = ? AND turn <= ?"
+                " ORDER BY turn DESC LIMIT 1", (session_id, limit)
+            ).fetchone()
+            if row is not None:
+                chain.append((session_id, row[0], limit))
+                state = decode_state(row[1])
+                break
+            fork = self._conn.execute(
+                "SELECT parent_id, turn FROM turn_forks WHERE session_id = ? AND turn <= ?", (session_id, limit)
+            ).fetchone()
+            if fork is None:
+                return None
+            chain.append((session_id, fork[1], limit))
+            session_id, limit = fork
+
+        replayed = 0
+        for session_id, base_turn, limit in reversed(chain):
+            replayed += self._replay(state, session_id, base_turn, limit)
+        return state, replayed
+
+    def _replay(self, state, session_id, base_turn, limit):
+        """（持锁）把 session_id 在 (base_turn, limit] 内的事件重放到 state 上，返回事件数"""
+        events = self._conn.execute(
+            "SELECT event FROM turn_events WHERE session_id = ? AND turn > ? AND turn <= ?"
+            " ORDER BY turn", (session_id, base_turn, limit)
+        ).fetchall()
+
+        version = state.version
+        for (data,) in events:
+            event = TurnEvent.decode(data)
+            event.apply(state)
+            version = event.version
+        # 重放会逐字段递增版本，这里恢复为记录时的版本
+        state._touch_all(version)
+        return len(events)
+
+    def rewind(self, session_id, turn, current):
+        """
+        把会话回退到 turn 回合结束时的状态，并丢弃之后的历史（调用方需持有回合锁）
+
+        Args:
+            current: 会话当前的 GameState，回退后的版本号接在它后面，客户端的增量不会错乱
+
+        Returns:
+            GameState 或 None（该回合的历史已不可用）
+        """
+        state = self.rebuild(session_id, turn)
+        if state is None or state.turn != turn:
+            return None
+        state._touch_all(current.version + 1)
+        self.truncate(session_id, state)
+        return state
+
+    def history(self, session_id):
+        """返回会话的事件列表"""
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT event FROM turn_events WHERE session_id = ? ORDER BY turn", (session_id,)
+            ).fetchall()
+        return [TurnEvent.decode(data) for (data,) in rows]
+
+    def stats(self):
+        with self._pending_lock:
+            pending = len(self._pending)
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM turn_sessions").fetchone()[0]
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "path": self.path,
+            # 内存数据库时即回合日志占用的内存（含已休眠会话的完整历史）
+            "sessions": sessions,
+            "db_bytes": page_count * page_size,
+            "snapshot_interval": self.snapshot_interval,
+            "pending": pending,
+            "events_written": self.events_written,
+            "snapshots_written": self.snapshots_written,
+            "forks_written": self.forks_written,
+            "forks_detached": self.forks_detached,
+            "rebuilds": self.rebuilds,
+            "avg_replayed_events": round(self.replayed_events / self.rebuilds, 2) if self.rebuilds else 0,
+            "rebuild_max_ms": round(self.rebuild_max_ms, 3),
+            "flush_errors": self.flush_errors
+        }
+
+
+def create_turn_log(retention=None):
+    """
+    创建回合日志：配置了 TZ_SESSION_DB 时与会话存储共用数据库文件，
+    否则放在内存数据库中（只支持回退，会话被注册表淘汰或删除时它的历史也随之删除）
+
+    内存数据库中的历史不随会话休眠压缩：休眠只编码会话状态，事件和快照留到会话被淘汰，
+    占用见 stats() 的 db_bytes；会话多、空闲 TTL 长时建议配置 TZ_SESSION_DB 把历史放到磁盘
+    """
+    path = os.environ.get("TZ_SESSION_DB")
+    if path:
+        return TurnLog(path)
+    return TurnLog(retention=retention or 7 * 24 * 3600)
@@ -0,0 +1,379 @@
+"""
+TZ游戏回合计划（延迟执行的 LLM 调用）
+处理器照常同步执行，但拿到的 llm_function 不会立即请求服务商，
+而是记录调用并返回一个占位文本；回合逻辑跑完后再统一发出这些调用，
+最后把响应和状态中的占位文本替换为真实结果。
+
+- 回合逻辑本身只占用 CPU，LLM 调用在逻辑结束后并发发出：
+  线程服务用有界线程池（resolve_parallel），异步服务用事件循环（resolve）
+- 占位文本是普通字符串，经过 strip()、拼接、f-string 后依然可以识别
+- 某个调用的提示词里如果引用了前面调用的结果，会等前者完成后再发出
+- 调用失败时使用处理器提供的 fallback 文本，与同步路径的降级行为一致；
+  端点熔断（CircuitOpenError）时优先使用处理器提供的模板台词（template）
+- 配置了 ReplyBatcher 时，互不依赖的多句 NPC 台词合成一个请求（reply_batch.py）
+- 上一回合结束后预生成过的请求（speculation.py）直接使用预生成的结果
+- 配置了 ModelRouter 时按意图和字数上限为每个调用选择路由（model_router.py），
+  send / stream_send 通过 route 关键字参数收到它
+- stream() 按消息顺序产出：固定文本立即产出，LLM 文本边生成边产出（SSE 接口使用）
+"""
+
+import asyncio
+import re
+
+from circuit_breaker import CircuitOpenError
+from prompt_template import fill_slots
+from reply_budget import truncate_reply
+
+_MARKER = re.compile("\x00llm(\\d+)\x00")
+
+
+class PlannedCall:
+    """一次被推迟的 LLM 调用"""
+    __slots__ = ("index", "messages", "max_tokens", "fallback", "stop", "max_words", "cache_key", "slots",
+                 "batch", "template", "route", "future", "result", "error")
+
+    def __init__(self, index, messages, max_tokens, fallback, stop=None, max_words=None, cache_key=None,
+                 slots=None, batch=None, template=None, route=None):
+        self.index = index
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.fallback = fallback
+        self.stop = stop
+        self.max_words = max_words
+        self.cache_key = cache_key
+        self.slots = slots
+        self.batch = batch
+        self.template = template
+        self.route = route
+        self.future = None
+        self.result = None
+        self.error = None
+
+    @property
+    def marker(self):
+        return f"\x00llm{self.index}\x00"
+
+
+class TurnPlan:
+    """
+    收集一个回合内的 LLM 调用
+
+    Args:
+        reply_cache: ReplyCache（可选）；带 cache_key 的调用命中时直接返回缓存文本，不进入计划
+        refresh: (messages, max_tokens, stop, route=None) -> str，同步调用，供缓存在后台刷新
+        scope: 缓存键的前缀（例如 API 地址和模型），不同模型的回复互不混用
+        batcher: ReplyBatcher（可选）；启用时带 batch 的调用可以合并成一个请求
+        prefetched: speculation.Prefetched（可选）；提示词相同的调用等待预生成的结果，不再单独请求
+        router: ModelRouter（可选）；为每个调用选择路由
+    """
+    def __init__(self, reply_cache=None, refresh=None, scope=None, batcher=None, prefetched=None, router=None):
+        self.calls = []
+        self.reply_cache = reply_cache
+        self.refresh = refresh
+        self.scope = scope
+        self.batcher = batcher if batcher is not None and batcher.enabled else None
+        self._unbatched = set()   # 合并请求失败过的调用，之后逐句请求
+        self.prefetched = prefetched
+        self.router = router if router is not None and router.enabled else None
+
+    def llm_function(self, messages, max_tokens=500, fallback=None, stop=None, max_words=None, cache_key=None,
+                     slots=None, batch=None, template=None, intent=None):
+        """
+        与同步 llm_wrapper 签名一致，返回占位文本（缓存命中时直接返回回复）
+
+        slots 为提示词规范化时换掉的值（prompt_template），缓存保存规范回复，返回前代回真实值；
+        batch 为拆开的提示词（reply_batch.BatchPart），合并请求时使用；
+        template 为端点熔断时立即使用的台词；
+        intent 为调用的意图（模型路由使用）
+        """
+        route = self.router.route(intent, max_words) if self.router is not None else None
+        if cache_key is not None and self.reply_cache is not None:
+            # 路由到不同模型的回复互不混用
+            cache_key = (self.scope, cache_key) if route is None else (self.scope, route.model, cache_key)
+            text, needs_refresh = self.reply_cache.lookup(cache_key)
+            if text is not None:
+                if needs_refresh and self.refresh is not None:
+                    self.reply_cache.refresh(cache_key, lambda: _generated(
+                        self.refresh(messages, max_tokens, stop, route=route), max_words))
+                return fill_slots(text, slots)
+        else:
+            cache_key = None
+        call = PlannedCall(len(self.calls), messages, max_tokens, fallback, stop, max_words, cache_key, slots,
+                           batch, template, route)
+        if self.prefetched is not None and "\x00" not in _text_of(messages):
+            # 预生成时的路由配置可能已经改了，模型不同的回复不能用
+            call.future = self.prefetched.take(messages, max_tokens, stop, route.model if route is not None else None)
+        self.calls.append(call)
+        return call.marker
+
+    def __len__(self):
+        return len(self.calls)
+
+    def independent_calls(self):
+        """提示词不引用其他调用结果的调用"""
+        return [call for call in self.calls if not self._deps(call)]
+
+    async def resolve(self, send):
+        """
+        并发执行所有调用
+
+        Args:
+            send: async (messages, max_tokens, stop, route=None) -> str
+        """
+        tasks = {}
+
+        async def run_one(call):
+            if call.future is not None:
+                try:
+                    return self.complete(call, await asyncio.wrap_future(call.future))
+                except Exception as e:
+                    print(f"Speculative LLM call failed: {e}")
+            try:
+                text = await send(self.fill(call.messages), call.max_tokens, call.stop, route=call.route)
+            except Exception as e:
+                self.complete(call, None, e)
+            else:
+                self.complete(call, text)
+
+        async def run(unit):
+            for call in unit:
+                for dep in self._deps(call):
+                    await tasks[dep.index]
+            if len(unit) == 1:
+                return await run_one(unit[0])
+            try:
+                lines = self.batcher.parse(await send(*self._batch_request(unit), route=unit[0].route), len(unit))
+            except Exception as e:
+                print(f"Batched LLM call failed: {e}")
+                self.batcher.failed()
+                lines = None
+            if lines is None:
+                await asyncio.gather(*(run_one(call) for call in unit))
+            else:
+                for call, line in zip(unit, lines):
+                    self.complete(call, line)
+
+        for unit in self._units(self.calls):
+            task = asyncio.ensure_future(run(unit))
+            for call in unit:
+                tasks[call.index] = task
+        if tasks:
+            await asyncio.gather(*set(tasks.values()))
+
+    def resolve_sync(self, send, calls=None):
+        """
+        按顺序同步执行尚未完成的调用（calls 为空时执行全部）
+
+        Args:
+            send: (messages, max_tokens, stop, route=None) -> str
+        """
+        for call in (self.calls if calls is None else calls):
+            if call.result is not None:
+                continue
+            self.resolve_sync(send, self._deps(call))
+            try:
+                text = self._send_sync(send, call)
+            except Exception as e:
+                self.complete(call, None, e)
+            else:
+                self.complete(call, text)
+
+    def _send_sync(self, send, call):
+        """预生成过的调用等待预生成结果（失败时照常请求），其余直接请求"""
+        if call.future is not None:
+            try:
+                return call.future.result()
+            except Exception as e:
+                print(f"Speculative LLM call failed: {e}")
+        return send(self.fill(call.messages), call.max_tokens, call.stop, route=call.route)
+
+    def resolve_parallel(self, send, executor):
+        """
+        在线程池中并发执行尚未完成的调用
+
+        按依赖分批：每批是前序调用都已完成的调用；只有一个调用的批次直接在当前线程执行。
+        任务本身从不等待其他任务，线程池占满时只是排队，不会死锁。
+
+        Args:
+            send: (messages, max_tokens, stop, route=None) -> str
+            executor: concurrent.futures.Executor
+        """
+        pending = [call for call in self.calls if call.result is None]
+        while pending:
+            ready = [call for call in pending if all(dep.result is not None for dep in self._deps(call))]
+            units = self._units(ready)
+            if len(units) == 1:
+                self._resolve_unit(send, units[0])
+            else:
+                for future in [executor.submit(self._resolve_unit, send, unit) for unit in units]:
+                    future.result()
+            pending = [call for call in pending if call.result is None]
+
+    def _resolve_unit(self, send, unit):
+        """
+        同步执行一个请求单元：单个调用，或合并成一个请求的多句台词
+
+        合并请求失败时这些调用保持未完成，由 resolve_parallel 的下一轮逐句并发重试
+        """
+        if len(unit) == 1:
+            return self.resolve_sync(send, unit)
+        try:
+            lines = self.batcher.parse(send(*self._batch_request(unit), route=unit[0].route), len(unit))
+        except Exception as e:
+            print(f"Batched LLM call failed: {e}")
+            self.batcher.failed()
+            lines = None
+        if lines is None:
+            self._unbatched.update(call.index for call in unit)
+            return
+        for call, line in zip(unit, lines):
+            self.complete(call, line)
+
+    def _units(self, calls):
+        """
+        把调用分成请求单元（保持原顺序）
+
+        启用合并时，没有依赖、人格前缀和路由相同的台词按 batcher.max_lines 分组，其余调用各自一个单元
+        """
+        if self.batcher is None:
+            return [[call] for call in calls]
+        units, open_groups = [], {}
+        for call in calls:
+            if call.batch is None or call.future is not None or call.index in self._unbatched or self._deps(call):
+                units.append([call])
+                continue
+            group_key = (call.batch.prefix, call.route)
+            group = open_groups.get(group_key)
+            if group is None or len(group) >= self.batcher.max_lines:
+                group = open_groups[group_key] = []
+                units.append(group)
+            group.append(call)
+        return units
+
+    def _batch_request(self, unit):
+        return self.batcher.request([call.batch for call in unit], [call.max_tokens for call in unit])
+
+    def stream(self, messages, stream_send, send):
+        """
+        按顺序逐条产出消息，LLM 生成的部分边生成边产出
+
+        不含占位文本的消息立即产出；含占位文本的消息先以 ("delta", 序号, 文本) 逐段产出，
+        结束后再产出完整消息（降级为 fallback 时以完整消息为准）。
+        只出现在状态中的调用不在这里执行，需要之后调用 resolve_sync()。
+
+        Args:
+            messages: 回合响应中的消息列表（含占位文本）
+            stream_send: (messages, max_tokens, stop, route=None) -> 逐段产出文本的迭代器
+            send: (messages, max_tokens, stop, route=None) -> str，用于执行被依赖的调用
+
+        Yields:
+            ("delta", index, text) 或 ("message", index, message)
+        """
+        for index, message in enumerate(messages):
+            content = message.get("content") if isinstance(message, dict) else None
+            if isinstance(content, str) and "\x00" in content:
+                parts = _MARKER.split(content)
+                for i, part in enumerate(parts):
+                    if i % 2 == 0:
+                        if part:
+                            yield "delta", index, part
+                        continue
+                    call = self.calls[int(part)]
+                    if call.future is not None:
+                        # 预生成过的调用已经（或即将）整段生成完，不再流式请求
+                        self.resolve_sync(send, [call])
+                    if call.result is not None:
+                        if call.result:
+                            yield "delta", index, call.result
+                        continue
+                    self.resolve_sync(send, self._deps(call))
+                    chunks, error = [], None
+                    held = ""   # 可能是被拆开的占位符或数值，等后续片段到了再代回
+                    stream = stream_send(self.fill(call.messages), call.max_tokens, call.stop, route=call.route)
+                    try:
+                        for chunk in stream:
+                            if not chunks:
+                                chunk = chunk.lstrip()
+                                if not chunk:
+                                    continue
+                            chunks.append(chunk)
+                            ready, held = _split_unfinished(held + chunk) if call.slots else (chunk, "")
+                            if ready:
+                                yield "delta", index, fill_slots(ready, call.slots)
+                            # 超出字数上限后不再等后面的 token，完整消息里会截到句末
+                            if call.max_words and len("".join(chunks).split()) > call.max_words:
+                                break
+                    except Exception as e:
+                        error = e
+                    finally:
+                        if hasattr(stream, "close"):
+                            stream.close()
+                    if held:
+                        yield "delta", index, fill_slots(held, call.slots)
+                    self.complete(call, "".join(chunks), error)
+            yield "message", index, self.fill(message)
+
+    def complete(self, call, text, error=None):
+        """记录调用结果；失败或结果为空时使用 fallback（熔断时优先使用 template）"""
+        if error is not None:
+            call.error = error
+            print(f"LLM call failed: {error}")
+        call.result = _generated(text, call.max_words)
+        if call.result and call.cache_key is not None:
+            self.reply_cache.store(call.cache_key, call.result)
+        call.result = fill_slots(call.result, call.slots)
+        if not call.result:
+            if isinstance(error, CircuitOpenError) and call.template:
+                call.result = call.template
+            else:
+                call.result = call.fallback if call.fallback is not None else ""
+
+    def fill(self, value):
+        """把 value（字符串、列表、字典，可嵌套）中的占位文本替换为调用结果"""
+        if isinstance(value, str):
+            if "\x00" not in value:
+                return value
+            return _MARKER.sub(lambda m: self._result(int(m.group(1))), value)
+        if isinstance(value, list):
+            return [self.fill(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.fill(item) for key, item in value.items()}
+        return value
+
+    def fill_state(self, state):
+        """替换状态中保存的占位文本（目前只有记忆碎片会保存 LLM 结果）"""
+        for key, text in list(state.memory_fragments.items()):
+            if "\x00" in text:
+                state.remember_fragment(key, self.fill(text))
+
+    def _deps(self, call):
+        """call 的提示词中引用了结果的前序调用"""
+        indexes = {int(i) for i in _MARKER.findall(_text_of(call.messages))}
+        return [self.calls[i] for i in sorted(indexes) if i < call.index]
+
+    def _result(self, index):
+        if 0 <= index < len(self.calls):
+            result = self.calls[index].result
+            return result if result is not None else ""
+        return ""
+
+
+_UNFINISHED = re.compile(r"(\[[A-Za-z]{0,5}|-?[\d.]+)$")
+
+
+def _split_unfinished(text):
+    """流式文本 -> (可以输出的部分, 末尾可能还没结束的占位符或数值)"""
+    match = _UNFINISHED.search(text)
+    if match is None:
+        return text, ""
+    return text[:match.start()], text[match.start():]
+
+
+def _generated(text, max_words):
+    """整理生成的文本：去空白，按字数上限截断"""
+    text = (text or "").strip()
+    return truncate_reply(text, max_words) if text and max_words else text
+
+
+def _text_of(messages):
+    return "".join(m.get("content", "") for m in messages if isinstance(m, dict))
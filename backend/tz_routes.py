@@ -3,14 +3,54 @@ TZ游戏API路由
 这个文件包含所有TZ游戏相关的API路由
 """
 
-from flask import request, jsonify
-from game_logic import GameState
+import atexit
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import Response, request, jsonify
+from game_logic import (
+    GameState, Stage, StageTarget, PERSONAS, EMOTIONS, DEFAULT_EMOTION, DEFAULT_INTENSITY, likely_inputs
+)
+from session_registry import SessionRegistry, DEFAULT_SESSION_TTL
+from session_store import create_session_store
+from session_locks import TurnLocks
+from turn_log import create_turn_log
+from state_token import StateTokenError, create_state_token_codec, stateless_enabled
+from hash_ring import HashRing, DEFAULT_VNODES
+from llm_client import LLMClientPool
 from stage_handlers import process_stage
 from task_handlers import get_task_handler
-import requests
+from turn_plan import TurnPlan
+from reply_cache import ReplyCache
+from reply_batch import ReplyBatcher
+from single_flight import SingleFlight, flight_key
+from hedging import Hedger
+from circuit_breaker import CircuitBreakers
+from concurrency_limit import ConcurrencyLimits
+from key_pool import create_key_pool
+from model_router import ModelRouter
+from speculation import Speculator, speculation_scope
 
-# TZ游戏状态
-tz_game_state = GameState()
+# TZ游戏会话（每个玩家一个 GameState，按会话令牌索引）
+# 配置 TZ_SESSION_DB 时会话持久化到 SQLite，重启后可继续游戏
+# 每个回合另外记录到回合日志，用于崩溃恢复和回退
+tz_turn_log = create_turn_log(retention=DEFAULT_SESSION_TTL)
+tz_sessions = SessionRegistry(store=create_session_store(), turn_log=tz_turn_log)
+atexit.register(tz_sessions.store.close)
+atexit.register(tz_turn_log.close)
+tz_turns = TurnLocks()
+SESSION_COOKIE = "tz_session"
+
+# 无状态模式（TZ_STATELESS=1）：状态保存在客户端持有的签名令牌中，
+# 多节点部署时不需要粘性会话或共享存储
+STATELESS = stateless_enabled()
+tz_tokens = create_state_token_codec() if STATELESS else None
+
+# 多进程部署（cluster.py）时本进程的 worker 名；会话令牌由前端进程分配，
+# 按一致性哈希固定路由到某个 worker，会话数据通过共享的 TZ_SESSION_DB 迁移
+WORKER_ID = os.environ.get("TZ_WORKER_ID")
+ASSIGNED_SESSION_HEADER = "X-TZ-Assign-Session"
 
 # AI配置
 # 支持多种 API：DeepSeek 官方、火山引擎 ARK、OpenAI 兼容
@@ -26,6 +66,41 @@ MODEL_NAME = "deepseek-chat"  # 或 "deepseek-reasoner" 用于推理任务
 # API_URL = "https://api.openai.com/v1/chat/completions"
 # MODEL_NAME = "gpt-4" 或 "gpt-3.5-turbo"
 
+# NPC 回复缓存（所有会话共享，TZ_REPLY_CACHE_SIZE=0 关闭）
+tz_replies = ReplyCache()
+atexit.register(tz_replies.close)
+# 按意图和字数上限把调用路由到不同模型（TZ_MODEL_ROUTES，默认不路由）
+llm_router = ModelRouter()
+# 同一回合的多句 NPC 台词合成一个请求（TZ_LLM_BATCH_LINES，默认关闭）
+tz_batcher = ReplyBatcher()
+
+# LLM 请求走 keep-alive 连接池（TZ_LLM_POOL_SIZE），服务启动时预先连上默认端点（TZ_LLM_WARMUP，见 warm_up_llm）
+llm_pool = LLMClientPool()
+atexit.register(llm_pool.close)
+# 并发的相同请求只向服务商发一次（TZ_LLM_SINGLE_FLIGHT=0 关闭）
+llm_flights = SingleFlight()
+# 没有携带 apiKey 的请求在服务器配置的密钥 / 端点池（TZ_LLM_KEYS）之间按余量分摊
+llm_keys = create_key_pool(API_URL)
+# 每个（端点, 密钥）的并发请求数按服务商的 429 / Retry-After 自适应调整（TZ_LLM_LIMIT=0 关闭）
+llm_limits = ConcurrencyLimits()
+# 端点持续失败时熔断，请求立即失败，NPC 台词改用模板（TZ_LLM_BREAKER=0 关闭）
+llm_breakers = CircuitBreakers()
+# 主端点迟迟不返回时向备用端点（TZ_LLM_HEDGE_URL）发出对冲请求，默认不对冲
+llm_hedger = Hedger()
+atexit.register(llm_hedger.close)
+# 同一回合内互不依赖的 LLM 调用在这个有界线程池里并发执行
+llm_executor = ThreadPoolExecutor(int(os.environ.get("TZ_LLM_FANOUT_WORKERS", "32")),
+                                  thread_name_prefix="tz-llm-fanout")
+atexit.register(llm_executor.shutdown, wait=False)
+# 玩家思考时为下一回合预生成 NPC 回复（TZ_SPECULATION_BUDGET，默认关闭）
+tz_speculator = Speculator()
+atexit.register(tz_speculator.close)
+
+
+def warm_up_llm():
+    """服务启动时在后台预先连上默认 LLM 端点（导入本模块时不发起网络连接）"""
+    return llm_pool.warm_up(API_URL)
+
 
 def update_emotion_from_tone(state, tone_value):
     """
@@ -58,6 +133,33 @@ def update_emotion_from_tone(state, tone_value):
     # Ensure intensity stays within bounds
     state.emotion_intensity = min(1.0, max(0.1, state.emotion_intensity))
 
+
+def _number(value, default, low, high):
+    """把请求里的数值转换为 [low, high] 内的 float，无法转换时使用默认值"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    if not math.isfinite(value):
+        return default
+    return min(high, max(low, value))
+
+
+def _persona_settings(data):
+    """
+    读取请求里的人格设置：(persona, emotion, emotion_intensity, responseTone)
+
+    这些值会写入会话状态（并在休眠时编码为快照），不认识的人格和情绪换成默认值，数值限制在有效范围内
+    """
+    persona = data.get('persona')
+    emotion = data.get('emotion')
+    return (
+        persona if isinstance(persona, str) and persona in PERSONAS else "Calm_Conscientious",
+        emotion if isinstance(emotion, str) and emotion in EMOTIONS else DEFAULT_EMOTION,
+        _number(data.get('emotionIntensity'), DEFAULT_INTENSITY, 0.0, 1.0),
+        _number(data.get('responseTone'), 50, 0, 100)
+    )
+
 def _adjust_response_delays(response):
     """
     根据文本长度自动调整每条消息的 delay，避免上一条还在“打字”时下一条就出现。
@@ -92,16 +194,89 @@ def _adjust_response_delays(response):
     return response
 
 
-def call_llm_api(messages, api_key, api_url=None, model=None):
+def _get_session_id(data=None):
     """
-    调用LLM API - 支持动态配置
-    
-    Args:
-        messages: 消息列表
-        api_key: API 密钥
-        api_url: API URL（可选，默认使用配置的 API_URL）
-        model: 模型名称（可选，默认使用配置的 MODEL_NAME）
+    从请求中读取会话令牌
+    优先级：请求头 X-TZ-Session > JSON sessionId > 查询参数 > Cookie
+    """
+    session_id = request.headers.get("X-TZ-Session")
+    if not session_id and isinstance(data, dict):
+        session_id = data.get("sessionId")
+    if not session_id:
+        session_id = request.args.get("sessionId")
+    if not session_id:
+        session_id = request.cookies.get(SESSION_COOKIE)
+    return session_id
+
+
+def _session_not_found():
+    """会话不存在或已过期时的统一响应"""
+    return jsonify({
+        "success": False,
+        "error": "Session not found or expired. Please start a new game.",
+        "sessionExpired": True
+    }), 404
+
+
+def _get_state_token(data=None):
     """
+    无状态模式下从请求中读取状态令牌
+    优先级：请求头 X-TZ-State > JSON stateToken > 查询参数
+    """
+    token = request.headers.get("X-TZ-State")
+    if not token and isinstance(data, dict):
+        token = data.get("stateToken")
+    if not token:
+        token = request.args.get("stateToken")
+    return token
+
+
+def _load_token_state(data=None):
+    """
+    校验状态令牌并恢复状态
+
+    Returns:
+        (GameState, None) 或 (None, 错误响应)
+    """
+    try:
+        return tz_tokens.load(_get_state_token(data)), None
+    except StateTokenError as e:
+        return None, (jsonify({
+            "success": False,
+            "error": str(e),
+            "sessionExpired": True
+        }), 401)
+
+
+def _parse_turn(data, state):
+    """
+    读取请求中的回合号（0 到当前回合之间）
+
+    Returns:
+        (turn, None) 或 (None, 错误响应)
+    """
+    turn = data.get('turn')
+    if not isinstance(turn, int) or isinstance(turn, bool) or not 0 <= turn <= state.turn:
+        return None, (jsonify({
+            "success": False,
+            "error": f"turn must be between 0 and {state.turn}"
+        }), 400)
+    return turn, None
+
+
+def _state_fields(state, since_version=None):
+    """
+    响应中的状态字段
+    客户端带上 stateVersion 时只返回之后变化的字段（stateDelta 为 True）
+    """
+    if since_version is None:
+        return {"state": state.to_dict(), "stateVersion": state.version}
+    fields, is_delta = state.to_delta(since_version)
+    return {"state": fields, "stateVersion": state.version, "stateDelta": is_delta}
+
+
+def _llm_request(messages, api_key, api_url=None, model=None, max_tokens=500, stop=None):
+    """组装 LLM 请求，返回 (url, headers, payload)"""
     if not api_key:
         raise Exception("API密钥未设置")
     
@@ -118,14 +293,336 @@ def call_llm_api(messages, api_key, api_url=None, model=None):
         "model": target_model,
         "messages": messages,
         "temperature": 0.7,
-        "max_tokens": 500
+        "max_tokens": max_tokens
     }
+    if stop:
+        payload["stop"] = stop
+    return target_url, headers, payload
+
+
+def call_llm_api(messages, api_key, api_url=None, model=None, max_tokens=500, stop=None):
+    """
+    调用LLM API - 支持动态配置
+    
+    Args:
+        messages: 消息列表
+        api_key: API 密钥
+        api_url: API URL（可选，默认使用配置的 API_URL）
+        model: 模型名称（可选，默认使用配置的 MODEL_NAME）
+        max_tokens: 生成上限
+        stop: 停止序列（可选）
+    
+    api_key 为空且配置了密钥池时，由密钥池选择 (密钥, 端点, 模型)
+    """
+    if not api_key and llm_keys.enabled:
+        return llm_keys.call(lambda member: call_llm_api(messages, member.key, member.url, member.model or model,
+                                                         max_tokens, stop))
+    target_url, headers, payload = _llm_request(messages, api_key, api_url, model, max_tokens, stop)
+    
+    def post(url=target_url, headers=headers, payload=payload, key=api_key):
+        def send():
+            response = llm_pool.post(url, headers=headers, json=payload, timeout=30)
+            llm_keys.observe(url, key, response.headers)
+            response.raise_for_status()
+            
+            data = response.json()
+            return data["choices"][0]["message"]["content"]
+        return llm_limits.call(url, key, lambda: llm_breakers.call(url, send))
+    
+    hedge = _hedge_request(messages, api_key, target_url, model, max_tokens, stop)
+    if hedge is not None:
+        return llm_flights.do(flight_key(target_url, payload),
+                              lambda: llm_hedger.call(target_url, post, lambda: post(*hedge)))
+    return llm_flights.do(flight_key(target_url, payload), post)
+
+
+def _hedge_request(messages, api_key, primary_url, model, max_tokens, stop):
+    """同一个请求发往备用端点时的 (url, headers, payload, api_key)；本次不对冲时为 None"""
+    if not llm_hedger.enabled:
+        return None
+    hedge_key = llm_hedger.key_for(primary_url, api_key)
+    if hedge_key is None:
+        return None
+    target_url, headers, payload = _llm_request(messages, hedge_key, llm_hedger.url, llm_hedger.model or model,
+                                                max_tokens, stop)
+    return target_url, headers, payload, hedge_key
+
+
+def call_llm_api_stream(messages, api_key, api_url=None, model=None, max_tokens=500, stop=None):
+    """
+    流式调用LLM API（OpenAI 兼容的 stream: true），逐段产出生成的文本
+    """
+    if not api_key and llm_keys.enabled:
+        with llm_keys.lease() as member:
+            yield from call_llm_api_stream(messages, member.key, member.url, member.model or model, max_tokens, stop)
+        return
+    target_url, headers, payload = _llm_request(messages, api_key, api_url, model, max_tokens, stop)
+    payload["stream"] = True
+    
+    with llm_limits.guard(target_url, api_key), llm_breakers.guard(target_url):
+        response = llm_pool.post(target_url, headers=headers, json=payload, timeout=30, stream=True)
+        llm_keys.observe(target_url, api_key, response.headers)
+        try:
+            response.raise_for_status()
+            response.encoding = response.encoding or "utf-8"
+            # chunk_size=None：数据一到就处理，不等凑满缓冲区
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line.startswith("data:"):
+                    continue
+                chunk = line[5:].strip()
+                if chunk == "[DONE]":
+                    break
+                choices = json.loads(chunk).get("choices") or [{}]
+                text = (choices[0].get("delta") or {}).get("content")
+                if text:
+                    yield text
+        finally:
+            response.close()
+
+
+async def call_llm_api_async(client, messages, api_key, api_url=None, model=None, max_tokens=500, stop=None,
+                             flights=None):
+    """
+    call_llm_api 的异步版本（client 为 llm_client.AsyncLLMClient，flights 为可选的 AsyncSingleFlight）
+    """
+    if not api_key and llm_keys.enabled:
+        return await llm_keys.call_async(lambda member: call_llm_api_async(
+            client, messages, member.key, member.url, member.model or model, max_tokens, stop, flights))
+    target_url, headers, payload = _llm_request(messages, api_key, api_url, model, max_tokens, stop)
+    
+    async def post(url=target_url, headers=headers, payload=payload, key=api_key):
+        async def send():
+            data = await client.post_json(url, headers=headers, json=payload, timeout=30,
+                                          on_headers=lambda h: llm_keys.observe(url, key, h))
+            return data["choices"][0]["message"]["content"]
+        return await llm_limits.call_async(url, key, lambda: llm_breakers.call_async(url, send))
+    
+    call = post
+    hedge = _hedge_request(messages, api_key, target_url, model, max_tokens, stop)
+    if hedge is not None:
+        
+        async def call():
+            return await llm_hedger.call_async(target_url, post, lambda: post(*hedge))
+    
+    if flights is None:
+        return await call()
+    return await flights.do(flight_key(target_url, payload), call)
+
+
+def llm_settings(data):
+    """从请求 JSON 中读取 (api_key, api_url, model)"""
+    api_key = data.get('apiKey', '')
+    api_url = data.get('apiUrl', API_URL)  # 从前端获取，默认使用配置
+    model = data.get('model', MODEL_NAME)   # 从前端获取，默认使用配置
+    return api_key, api_url, model
+
+
+def llm_backpressure(data):
+    """
+    服务商正在限流这个（端点, 密钥）时返回建议的重试秒数，否则返回 None
+    
+    在回合开始前判断：回合逻辑会修改状态，开始后再拒绝就只能用降级台词了
+    """
+    api_key, api_url, _ = llm_settings(data)
+    if not api_key and llm_keys.enabled:
+        # 使用密钥池时，只要还有一个成员没被限流就放行
+        waits = [llm_limits.retry_after(member.url, member.key) for member in llm_keys.members]
+        return None if None in waits else min(waits)
+    return llm_limits.retry_after(api_url or API_URL, api_key)
+
+
+def _busy(retry_after):
+    """限流时的 503 响应"""
+    response = jsonify({
+        "success": False,
+        "error": "LLM provider is busy, please retry later",
+        "retryAfter": retry_after
+    })
+    response.headers["Retry-After"] = str(retry_after)
+    return response, 503
+
+
+def routed_send(api_key, api_url, model):
+    """同步 send：按调用的路由选择模型，并统计路由延迟"""
+    def send(messages, max_tokens, stop, route=None):
+        with llm_router.measure(route):
+            return call_llm_api(messages, api_key, api_url, route and route.model or model, max_tokens, stop)
+    return send
+
+
+def new_turn_plan(api_key, api_url, model, prefetched=None):
+    """创建回合计划（带回复缓存、台词合并和模型路由；缓存刷新走同步连接池）"""
+    return TurnPlan(tz_replies, routed_send(api_key, api_url, model), (api_url, model), tz_batcher, prefetched,
+                    llm_router)
+
+
+def claim_prefetched(session_id, data):
+    """取走上一回合为这个会话预生成的请求（没有会话或没有预生成时为 None）"""
+    if session_id is None or not tz_speculator.enabled:
+        return None
+    return tz_speculator.claim(session_id, speculation_scope(*llm_settings(data)))
+
+
+def speculate_next_turn(session_id, state, data):
+    """
+    回合结束后，在后台对下一回合最可能的输入各跑一遍回合逻辑（在 fork 出的状态上），
+    提前发出其中的 LLM 请求
+    """
+    if session_id is None or not tz_speculator.enabled:
+        return
+    inputs = likely_inputs(state)
+    if not inputs or llm_backpressure(data) is not None:
+        return
+    api_key, api_url, model = llm_settings(data)
+    snapshot = state.fork()
+    
+    def branches():
+        for text in inputs:
+            plan = TurnPlan(tz_replies, None, (api_url, model), router=llm_router)
+            plan_turn(snapshot.fork(), data, text, plan.llm_function)
+            for call in plan.independent_calls():
+                yield call.messages, call.max_tokens, call.stop, call.route
+    
+    tz_speculator.speculate(session_id, speculation_scope(api_key, api_url, model), branches,
+                            routed_send(api_key, api_url, model))
+
+
+def _sse(event, data):
+    """一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_turn(state, data, message, session_id=None):
+    """
+    流式执行一个游戏回合（调用方需持有该会话的回合锁）
+    
+    回合逻辑照常先跑完，LLM 调用推迟到产出消息时再发出：
+    固定文案立即产出，NPC 回复边生成边产出。
+    
+    Yields:
+        ("delta", {"index", "text"})、("message", {"index", "message"})，
+        最后是 ("response", 完整 response)；此时状态已更新，可以提交
+    """
+    api_key, api_url, model = llm_settings(data)
+    prefetched = claim_prefetched(session_id, data)
+    plan = new_turn_plan(api_key, api_url, model, prefetched)
+    response = plan_turn(state, data, message, plan.llm_function)
+    send = plan.refresh
+    
+    def stream_send(messages, max_tokens, stop, route=None):
+        with llm_router.measure(route):
+            yield from call_llm_api_stream(messages, api_key, api_url, route and route.model or model,
+                                           max_tokens, stop)
+    
+    if isinstance(response, dict) and response.get("type") in ("sequence", "multi"):
+        messages = response.get("messages", [])
+    else:
+        messages = [response]
+    
+    for kind, index, value in plan.stream(messages, stream_send, send):
+        if kind == "delta":
+            yield "delta", {"index": index, "text": value}
+        else:
+            yield "message", {"index": index, "message": _adjust_response_delays(value)}
+    
+    # 只写入状态（记忆碎片）的调用
+    plan.resolve_sync(send)
+    plan.fill_state(state)
+    if prefetched is not None:
+        prefetched.close()
+    speculate_next_turn(session_id, state, data)
+    yield "response", _adjust_response_delays(plan.fill(response))
+
+
+def run_turn(state, data, message, session_id=None):
+    """
+    执行一个游戏回合（调用方需持有该会话的回合锁）
+    
+    Args:
+        state: 会话的 GameState
+        data: 请求 JSON
+        message: 玩家输入（已去除首尾空白）
+        session_id: 会话 ID（无状态模式为 None），用于使用和发起预生成
+    
+    Returns:
+        dict: 返回给前端的 response
+    """
+    api_key, api_url, model = llm_settings(data)
+    
+    # 回合逻辑先跑完，其中的 LLM 调用记录在计划里，再并发发出（互相依赖的按顺序），
+    # 一个回合里有多次生成时总耗时约等于一次往返
+    prefetched = claim_prefetched(session_id, data)
+    plan = new_turn_plan(api_key, api_url, model, prefetched)
+    try:
+        response = plan_turn(state, data, message, plan.llm_function)
+        plan.resolve_parallel(plan.refresh, llm_executor)
+    finally:
+        if prefetched is not None:
+            prefetched.close()
+    plan.fill_state(state)
+    speculate_next_turn(session_id, state, data)
+    
+    # ✅ 在返回给前端之前，根据文本长度统一调整 delay
+    return _adjust_response_delays(plan.fill(response))
+
+
+def plan_turn(state, data, message, llm_function):
+    """
+    执行回合逻辑，LLM 调用交给 llm_function（不调整 delay）
+    
+    llm_function 为 TurnPlan.llm_function，返回的 response 中含占位文本，
+    需在调用完成后用 TurnPlan.fill() 替换。
+    """
+    api_key = data.get('apiKey', '')
+    
+    # 获取新的人格和情绪参数（responseTone 默认50，中性）
+    persona, emotion, emotion_intensity, response_tone = _persona_settings(data)
+    
+    # 根据 responseTone 更新游戏状态的情绪（如果前端没有提供emotion）
+    if 'emotion' not in data:
+        update_emotion_from_tone(state, response_tone)
+    else:
+        # 使用前端提供的 persona 和 emotion
+        state.persona = persona
+        state.emotion = emotion
+        state.emotion_intensity = emotion_intensity
+    
+    # Check if in task stage
+    task_handler = get_task_handler(state.stage)
+    if task_handler:
+        response = task_handler(state, message, api_key, llm_function)
+    else:
+        response = process_stage(state, message, api_key, llm_function)
     
-    response = requests.post(target_url, headers=headers, json=payload, timeout=30)
-    response.raise_for_status()
+    # Handle next_action
+    if isinstance(response, dict) and "next_action" in response:
+        next_action = response.get("next_action")
+        next_stage = response.get("next_stage", "unknown")
+        
+        if next_action == "offer_memory":
+            from stage_handlers import MEMORY_CHOICE_OPTIONS
+            
+            # Update stage to memory choice
+            state.set_stage(Stage.MEMORY_CHOICE, StageTarget.from_key(next_stage))
+            
+            # Add memory choice message to response - 使用固定文案
+            if response.get("type") == "sequence":
+                response["messages"].extend(MEMORY_CHOICE_OPTIONS)
+        elif next_action == "start_final_choice":
+            # Trigger final choice
+            from task_handlers import start_final_choice
+            final_response = start_final_choice(state, api_key, llm_function)
+            # Merge responses
+            if response.get("type") == "sequence" and final_response.get("type") == "sequence":
+                response["messages"].extend(final_response["messages"])
+            else:
+                response = final_response
+        
+        # Remove next_action fields from response
+        response.pop("next_action", None)
+        response.pop("next_stage", None)
     
-    data = response.json()
-    return data["choices"][0]["message"]["content"]
+    return response
 
 
 def register_tz_routes(app):
@@ -134,15 +631,24 @@ def register_tz_routes(app):
     @app.route('/api/tz/start', methods=['POST'])
     def tz_start_game():
         """开始TZ游戏"""
-        global tz_game_state
-        
         try:
-            data = request.get_json()
+            data = request.get_json(silent=True) or {}
             api_key = data.get('apiKey', '')
             
-            # 重置游戏状态
-            tz_game_state.reset()
-            tz_game_state.stage = "first_contact"
+            if STATELESS:
+                session_id, state = None, GameState()
+                state.stage = "first_contact"
+            else:
+                # 重新开始时释放旧会话，再创建新会话
+                old_session_id = _get_session_id(data)
+                if old_session_id:
+                    tz_sessions.discard(old_session_id)
+                    tz_speculator.discard(old_session_id)
+                assigned_id = request.headers.get(ASSIGNED_SESSION_HEADER) if WORKER_ID else None
+                session_id, state = tz_sessions.create(session_id=assigned_id)
+                state.stage = "first_contact"
+                tz_sessions.mark_dirty(session_id, state)
+                tz_turn_log.start(session_id, state)
             
             # 返回初始消息 - 使用固定文案
             from stage_handlers import CHAPTER_TITLES, CONNECTION_SEQUENCE
@@ -164,11 +670,20 @@ def register_tz_routes(app):
                 "delay": 1500
             })
             
-            return jsonify({
+            payload = {
                 "success": True,
                 "messages": initial_messages,
-                "state": tz_game_state.to_dict()
-            })
+                "state": state.to_dict(),
+                "stateVersion": state.version
+            }
+            if STATELESS:
+                payload["stateToken"] = tz_tokens.issue(state)
+                return jsonify(payload)
+            
+            payload["sessionId"] = session_id
+            resp = jsonify(payload)
+            resp.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="Lax")
+            return resp
             
         except Exception as e:
             print(f"Start game error: {e}")
@@ -181,81 +696,57 @@ def register_tz_routes(app):
     @app.route('/api/tz/message', methods=['POST'])
     def tz_send_message():
         """Send TZ Game Message"""
-        global tz_game_state
-        
         try:
             data = request.get_json()
-            message = data.get('message', '').strip()
-            api_key = data.get('apiKey', '')
-            api_url = data.get('apiUrl', API_URL)  # 从前端获取，默认使用配置
-            model = data.get('model', MODEL_NAME)   # 从前端获取，默认使用配置
-            response_tone = data.get('responseTone', 50)  # 默认50（中性）
-            
-            # 获取新的人格和情绪参数
-            persona = data.get('persona', 'Calm_Conscientious')
-            emotion = data.get('emotion', 'neutral')
-            emotion_intensity = data.get('emotionIntensity', 0.4)
+            if STATELESS:
+                session_id = None
+                tz_game_state, error = _load_token_state(data)
+                if error:
+                    return error
+            else:
+                session_id = _get_session_id(data)
+                tz_game_state = tz_sessions.get(session_id)
+                if tz_game_state is None:
+                    return _session_not_found()
             
+            message = data.get('message', '').strip()
             if not message:
                 return jsonify({
                     "success": False,
                     "error": "Message cannot be empty"
                 }), 400
             
-            # 根据 responseTone 更新游戏状态的情绪（如果前端没有提供emotion）
-            if 'emotion' not in data:
-                update_emotion_from_tone(tz_game_state, response_tone)
-            else:
-                # 使用前端提供的 persona 和 emotion
-                tz_game_state.persona = persona
-                tz_game_state.emotion = emotion
-                tz_game_state.emotion_intensity = emotion_intensity
+            retry_after = llm_backpressure(data)
+            if retry_after is not None:
+                return _busy(retry_after)
             
-            # 创建一个包装函数，传递 api_url 和 model
-            def llm_wrapper(messages, max_tokens=500):
-                return call_llm_api(messages, api_key, api_url, model)
+            if STATELESS:
+                # 状态只属于这个请求，不需要回合锁；新状态随响应签发
+                response = run_turn(tz_game_state, data, message)
+                tz_game_state.turn += 1
+                return jsonify({
+                    "success": True,
+                    "response": response,
+                    **_state_fields(tz_game_state, data.get('stateVersion')),
+                    "stateToken": tz_tokens.issue(tz_game_state)
+                })
             
-            # Check if in task stage
-            task_handler = get_task_handler(tz_game_state.stage)
-            if task_handler:
-                response = task_handler(tz_game_state, message, api_key, llm_wrapper)
-            else:
-                response = process_stage(tz_game_state, message, api_key, llm_wrapper)
+            # 同一会话的回合按到达顺序串行执行，不同会话互不阻塞
+            with tz_turns.turn(session_id):
+                # 排队期间会话可能被回退、休眠后恢复或删除，以锁内取到的状态对象为准
+                tz_game_state = tz_sessions.get(session_id)
+                if tz_game_state is None:
+                    return _session_not_found()
+                mark = tz_turn_log.begin(tz_game_state)
+                response = run_turn(tz_game_state, data, message, session_id)
+                tz_turn_log.commit(session_id, tz_game_state, message, mark)
+                state_fields = _state_fields(tz_game_state, data.get('stateVersion'))
+                tz_sessions.mark_dirty(session_id, tz_game_state)
             
-            # Handle next_action
-            if isinstance(response, dict) and "next_action" in response:
-                next_action = response.get("next_action")
-                next_stage = response.get("next_stage", "unknown")
-                
-                if next_action == "offer_memory":
-                    from stage_handlers import MEMORY_CHOICE_OPTIONS
-                    
-                    # Update stage to memory choice
-                    tz_game_state.stage = f"memory_choice_{next_stage}"
-                    
-                    # Add memory choice message to response - 使用固定文案
-                    if response.get("type") == "sequence":
-                        response["messages"].extend(MEMORY_CHOICE_OPTIONS)
-                elif next_action == "start_final_choice":
-                    # Trigger final choice
-                    from task_handlers import start_final_choice
-                    final_response = start_final_choice(tz_game_state, api_key, call_llm_api)
-                    # Merge responses
-                    if response.get("type") == "sequence" and final_response.get("type") == "sequence":
-                        response["messages"].extend(final_response["messages"])
-                    else:
-                        response = final_response
-                
-                # Remove next_action fields from response
-                response.pop("next_action", None)
-                response.pop("next_stage", None)
-                
-            # ✅ 在返回给前端之前，根据文本长度统一调整 delay
-            response = _adjust_response_delays(response)
             return jsonify({
                 "success": True,
                 "response": response,
-                "state": tz_game_state.to_dict()
+                **state_fields
             })
             
         except Exception as e:
@@ -268,13 +759,127 @@ def register_tz_routes(app):
             }), 500
     
     
+    @app.route('/api/tz/message/stream', methods=['POST'])
+    def tz_stream_message():
+        """
+        Send TZ Game Message, streaming the response as Server-Sent Events
+        
+        事件：message（一条完整消息）、delta（正在生成的 NPC 文本片段）、
+        done（与 /api/tz/message 相同的 JSON，状态已提交）、error
+        """
+        data = request.get_json(silent=True) or {}
+        if STATELESS:
+            session_id = None
+            tz_game_state, error = _load_token_state(data)
+            if error:
+                return error
+        else:
+            session_id = _get_session_id(data)
+            tz_game_state = tz_sessions.get(session_id)
+            if tz_game_state is None:
+                return _session_not_found()
+        
+        message = data.get('message', '').strip()
+        if not message:
+            return jsonify({
+                "success": False,
+                "error": "Message cannot be empty"
+            }), 400
+        
+        retry_after = llm_backpressure(data)
+        if retry_after is not None:
+            return _busy(retry_after)
+        
+        def stateless_events():
+            for event, payload in stream_turn(tz_game_state, data, message):
+                if event != "response":
+                    yield _sse(event, payload)
+                    continue
+                tz_game_state.turn += 1
+                yield _sse("done", {
+                    "success": True,
+                    "response": payload,
+                    **_state_fields(tz_game_state, data.get('stateVersion')),
+                    "stateToken": tz_tokens.issue(tz_game_state)
+                })
+        
+        def session_events():
+            with tz_turns.turn(session_id):
+                tz_game_state = tz_sessions.get(session_id)
+                if tz_game_state is None:
+                    yield _sse("error", {
+                        "success": False,
+                        "error": "Session not found or expired. Please start a new game.",
+                        "sessionExpired": True
+                    })
+                    return
+                mark = tz_turn_log.begin(tz_game_state)
+                turn = stream_turn(tz_game_state, data, message, session_id)
+                response = None
+                try:
+                    for event, payload in turn:
+                        if event == "response":
+                            response = payload
+                            break
+                        yield _sse(event, payload)
+                except GeneratorExit:
+                    # 客户端中途断开：仍把回合跑完并提交，状态与非流式接口一致
+                    for event, payload in turn:
+                        if event == "response":
+                            response = payload
+                    tz_turn_log.commit(session_id, tz_game_state, message, mark)
+                    tz_sessions.mark_dirty(session_id, tz_game_state)
+                    raise
+                tz_turn_log.commit(session_id, tz_game_state, message, mark)
+                state_fields = _state_fields(tz_game_state, data.get('stateVersion'))
+                tz_sessions.mark_dirty(session_id, tz_game_state)
+            yield _sse("done", {
+                "success": True,
+                "response": response,
+                **state_fields
+            })
+        
+        def events():
+            try:
+                yield from (stateless_events() if STATELESS else session_events())
+            except Exception as e:
+                print(f"Stream message error: {e}")
+                import traceback
+                traceback.print_exc()
+                yield _sse("error", {
+                    "success": False,
+                    "error": str(e)
+                })
+        
+        return Response(events(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+    
+    
     @app.route('/api/tz/state', methods=['GET'])
     def tz_get_state():
         """Get TZ game state"""
         try:
+            if STATELESS:
+                tz_game_state, error = _load_token_state()
+                if error:
+                    return error
+                fields = _state_fields(tz_game_state, request.args.get('stateVersion', type=int))
+            else:
+                session_id = _get_session_id()
+                if tz_sessions.get(session_id) is None:
+                    return _session_not_found()
+                # 回合进行中状态里还留着 LLM 占位文本，等回合结束再读
+                with tz_turns.turn(session_id):
+                    tz_game_state = tz_sessions.get(session_id)
+                    if tz_game_state is None:
+                        return _session_not_found()
+                    fields = _state_fields(tz_game_state, request.args.get('stateVersion', type=int))
+            
             return jsonify({
                 "success": True,
-                "state": tz_game_state.to_dict()
+                **fields
             })
         except Exception as e:
             print(f"Get state error: {e}")
@@ -287,10 +892,32 @@ def register_tz_routes(app):
     @app.route('/api/tz/reset', methods=['POST'])
     def tz_reset_game():
         """Reset TZ game"""
-        global tz_game_state
-        
         try:
-            tz_game_state.reset()
+            data = request.get_json(silent=True)
+            if STATELESS:
+                tz_game_state, error = _load_token_state(data)
+                if error:
+                    return error
+                tz_game_state.reset()
+                return jsonify({
+                    "success": True,
+                    "message": "Game reset successfully",
+                    "stateToken": tz_tokens.issue(tz_game_state)
+                })
+            
+            session_id = _get_session_id(data)
+            tz_game_state = tz_sessions.get(session_id)
+            if tz_game_state is None:
+                return _session_not_found()
+            
+            with tz_turns.turn(session_id):
+                tz_game_state = tz_sessions.get(session_id)
+                if tz_game_state is None:
+                    return _session_not_found()
+                tz_speculator.discard(session_id)
+                tz_game_state.reset()
+                tz_sessions.mark_dirty(session_id, tz_game_state)
+                tz_turn_log.start(session_id, tz_game_state)
             return jsonify({
                 "success": True,
                 "message": "Game reset successfully"
@@ -301,3 +928,175 @@ def register_tz_routes(app):
                 "success": False,
                 "error": str(e)
             }), 500
+    
+    
+    @app.route('/api/tz/history', methods=['GET'])
+    def tz_get_history():
+        """Get TZ turn history"""
+        try:
+            session_id = _get_session_id()
+            tz_game_state = tz_sessions.get(session_id)
+            if tz_game_state is None:
+                return _session_not_found()
+            
+            return jsonify({
+                "success": True,
+                "turn": tz_game_state.turn,
+                "events": [event.to_dict() for event in tz_turn_log.history(session_id)]
+            })
+        except Exception as e:
+            print(f"Get history error: {e}")
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 500
+    
+    
+    @app.route('/api/tz/rewind', methods=['POST'])
+    def tz_rewind_game():
+        """Rewind TZ game to the end of an earlier turn"""
+        try:
+            data = request.get_json(silent=True) or {}
+            session_id = _get_session_id(data)
+            tz_game_state = tz_sessions.get(session_id)
+            if tz_game_state is None:
+                return _session_not_found()
+            
+            with tz_turns.turn(session_id):
+                tz_game_state = tz_sessions.get(session_id)
+                if tz_game_state is None:
+                    return _session_not_found()
+                turn, error = _parse_turn(data, tz_game_state)
+                if error:
+                    return error
+                tz_speculator.discard(session_id)
+                state = tz_turn_log.rewind(session_id, turn, tz_game_state)
+                if state is None:
+                    return jsonify({
+                        "success": False,
+                        "error": "History for this turn is no longer available"
+                    }), 409
+                tz_sessions.mark_dirty(session_id, state)
+            
+            return jsonify({
+                "success": True,
+                "turn": state.turn,
+                **_state_fields(state)
+            })
+        except Exception as e:
+            print(f"Rewind game error: {e}")
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 500
+    
+    
+    @app.route('/api/tz/fork', methods=['POST'])
+    def tz_fork_game():
+        """Fork a TZ game session, optionally from the end of an earlier turn"""
+        try:
+            data = request.get_json(silent=True) or {}
+            if STATELESS:
+                # 令牌本身就是完整状态，分支只需让客户端再持有一份令牌
+                state, error = _load_token_state(data)
+                if error:
+                    return error
+                return jsonify({
+                    "success": True,
+                    **_state_fields(state),
+                    "stateToken": tz_tokens.issue(state)
+                })
+            
+            session_id = _get_session_id(data)
+            parent = tz_sessions.get(session_id)
+            if parent is None:
+                return _session_not_found()
+            
+            with tz_turns.turn(session_id):
+                parent = tz_sessions.get(session_id)
+                if parent is None:
+                    return _session_not_found()
+                turn = None
+                if data.get('turn') is not None:
+                    turn, error = _parse_turn(data, parent)
+                    if error:
+                        return error
+                if turn is None or turn == parent.turn:
+                    state = parent.fork()
+                else:
+                    state = tz_turn_log.rebuild(session_id, turn)
+                    if state is None or state.turn != turn:
+                        return jsonify({
+                            "success": False,
+                            "error": "History for this turn is no longer available"
+                        }), 409
+                
+                # 分支第一次分叉前不写入存储，回合日志里也只记录父会话和分叉回合（加载时从父会话的历史重建）；
+                # 要在父会话的回合锁内登记，父会话之后的回退才会排在它后面
+                fork_id, state = tz_sessions.create(state, persist=False)
+                tz_turn_log.fork(fork_id, session_id, state)
+            if WORKER_ID:
+                # 分支的令牌可能哈希到其他 worker，立即写出供其加载
+                tz_sessions.store.flush()
+                tz_turn_log.flush()
+            
+            resp = jsonify({
+                "success": True,
+                "sessionId": fork_id,
+                "parentSessionId": session_id,
+                "turn": state.turn,
+                **_state_fields(state)
+            })
+            resp.set_cookie(SESSION_COOKIE, fork_id, httponly=True, samesite="Lax")
+            return resp
+        except Exception as e:
+            print(f"Fork game error: {e}")
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 500
+    
+    
+    if WORKER_ID:
+        @app.route('/api/tz/cluster/ring', methods=['POST'])
+        def tz_cluster_ring():
+            """Release sessions this worker no longer owns after a ring change (front process only)"""
+            data = request.get_json(silent=True) or {}
+            ring = HashRing(data.get('nodes', ()), data.get('vnodes', DEFAULT_VNODES))
+            released = 0
+            for session_id in tz_sessions.session_ids():
+                if ring.lookup(session_id) != WORKER_ID:
+                    with tz_turns.turn(session_id):
+                        released += tz_sessions.release(session_id)
+            # 写出迁走的会话，新的 worker 从共享存储加载
+            tz_sessions.store.flush()
+            tz_turn_log.flush()
+            return jsonify({
+                "success": True,
+                "worker": WORKER_ID,
+                "released": released
+            })
+    
+    
+    @app.route('/api/tz/metrics', methods=['GET'])
+    def tz_get_metrics():
+        """Get TZ server metrics"""
+        return jsonify({
+            "success": True,
+            "worker": WORKER_ID,
+            "sessions": tz_sessions.stats(),
+            "store": tz_sessions.store.stats(),
+            "turn_log": tz_turn_log.stats(),
+            "state_tokens": tz_tokens.stats() if STATELESS else None,
+            "locks": tz_turns.stats(),
+            "llm": llm_pool.stats(),
+            "reply_cache": tz_replies.stats(),
+            "reply_batch": tz_batcher.stats(),
+            "speculation": tz_speculator.stats(),
+            "single_flight": llm_flights.stats(),
+            "hedging": llm_hedger.stats(),
+            "circuit_breakers": llm_breakers.stats(),
+            "concurrency_limits": llm_limits.stats(),
+            "key_pool": llm_keys.stats(),
+            "model_routes": llm_router.stats()
+        })
@@ -49,6 +49,9 @@ function App() {
   const messagesEndRef = useRef(null)
   const inputRef = useRef(null)
   const messageRefs = useRef([])
+  const sessionIdRef = useRef(null)  // 后端会话令牌
+  const stateVersionRef = useRef(null)  // 已知的状态版本，用于增量更新
+  const stateTokenRef = useRef(null)  // 无状态模式下后端签发的状态令牌
 
   // Clear chat history
   const handleClearMessages = () => {
@@ -267,10 +270,15 @@ function App() {
   const startTZGame = async () => {
     try {
       const response = await axios.post('/api/tz/start', {
-        apiKey: apiConfig.apiToken
+        apiKey: apiConfig.apiToken,
+        sessionId: sessionIdRef.current
       })
       
       if (response.data.success) {
+        sessionIdRef.current = response.data.sessionId
+        stateVersionRef.current = response.data.stateVersion ?? null
+        stateTokenRef.current = response.data.stateToken ?? null
+
         // ⭐ 保存游戏状态
         if (response.data.state) {
           setGameState(response.data.state)
@@ -360,6 +368,9 @@ function App() {
       // 使用TZ游戏API
       const response = await axios.post('/api/tz/message', {
         message: userMessage.content,
+        sessionId: sessionIdRef.current,
+        stateVersion: stateVersionRef.current,
+        stateToken: stateTokenRef.current,
         apiKey: apiConfig.apiToken,
         apiUrl: apiConfig.apiUrl,        // 传递 API URL
         model: apiConfig.model,            // 传递模型名称
@@ -373,10 +384,17 @@ function App() {
       setIsTyping(false)
       
       if (response.data.success) {
+        if (response.data.stateToken) {
+          stateTokenRef.current = response.data.stateToken
+        }
+
         // ⭐ 保存游戏状态
         if (response.data.state) {
-          setGameState(response.data.state)
-          console.log('[Game State] Updated:', response.data.state)
+          // 增量响应只包含变化的字段，合并到已有状态
+          const { state, stateDelta } = response.data
+          setGameState(prev => (stateDelta && prev ? { ...prev, ...state } : state))
+          stateVersionRef.current = response.data.stateVersion ?? null
+          console.log('[Game State] Updated:', state)
         }
         
         const tzResponse = response.data.response